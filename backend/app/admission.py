@@ -0,0 +1,199 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After seconds"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Concurrency limiter with a bounded FIFO wait queue and an AIMD-adjusted limit.
+
+    The limit grows slowly while upstream first-token latency stays under the target, shrinks by
+    one on slow responses and is cut multiplicatively when upstream returns 429.
+    """
+
+    def __init__(self, name: str, limit: int, min_limit: int, max_limit: int,
+                 max_queue: int, max_wait: float, latency_target: float):
+        self.name = name
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self.in_use = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self) -> float:
+        """Wait for a slot and return the time spent queued"""
+        if self.in_use < int(self.limit) and not self.queued:
+            self.in_use += 1
+            self._admit(0.0)
+            return 0.0
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(429, f"{self.name} queue is full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted at the same moment we gave up - hand the slot on
+                self.release()
+            else:
+                waiter.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise AdmissionRejected(503, f"{self.name} queue wait exceeded {self.max_wait}s", self.retry_after())
+
+        waited = time.time() - started
+        self._admit(waited)
+        return waited
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False) -> None:
+        """Free a slot and adapt the limit to the observed upstream latency or throttling"""
+        self.in_use = max(0, self.in_use - 1)
+        if throttled:
+            self.throttled += 1
+            self.limit = max(self.min_limit, self.limit * 0.5)
+            logger.warning(f"Admission {self.name}: upstream throttled, limit reduced to {int(self.limit)}")
+        elif latency is not None and latency > self.latency_target:
+            self.limit = max(self.min_limit, self.limit - 1)
+        elif latency is not None:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._grant_waiters()
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up, from the average queue wait so far"""
+        average_wait = self.total_wait / self.admitted if self.admitted else self.max_wait
+        return max(1, min(60, math.ceil(average_wait or 1)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': int(self.limit),
+            'in_use': self.in_use,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'throttled': self.throttled,
+            'avg_wait_seconds': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            'max_wait_seconds': round(self.max_observed_wait, 4)
+        }
+
+    def _admit(self, waited: float) -> None:
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_observed_wait = max(self.max_observed_wait, waited)
+
+    def _grant_waiters(self) -> None:
+        while self._waiters and self.in_use < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_use += 1
+            waiter.set_result(None)
+
+
+class Permit:
+    """Slots held on a set of limiters for one upstream call"""
+
+    def __init__(self, limiters: List[AdaptiveLimiter], queue_wait: float):
+        self.limiters = limiters
+        self.queue_wait = queue_wait
+        self.latency: Optional[float] = None
+        self.throttled = False
+        self._released = False
+
+    def observe(self, latency: Optional[float] = None, throttled: bool = False) -> None:
+        if latency is not None:
+            self.latency = latency
+        self.throttled = self.throttled or throttled
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        for limiter in self.limiters:
+            limiter.release(self.latency, self.throttled)
+
+
+class AdmissionController:
+    """Per-persona and per-model limiters in front of the upstream call"""
+
+    def __init__(self, model_limit: int, persona_limit: int, min_limit: int, max_limit: int,
+                 max_queue: int, max_wait: float, latency_target: float):
+        self.model_limit = model_limit
+        self.persona_limit = persona_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def limiter(self, name: str, limit: int) -> AdaptiveLimiter:
+        if name not in self._limiters:
+            self._limiters[name] = AdaptiveLimiter(
+                name, limit, min(self.min_limit, limit), max(self.max_limit, limit),
+                self.max_queue, self.max_wait, self.latency_target
+            )
+        return self._limiters[name]
+
+    async def acquire(self, persona_id: str, model: str, persona_limit: Optional[int] = None) -> Permit:
+        """Take a persona slot, then a model slot; raises AdmissionRejected when saturated"""
+        persona_limiter = self.limiter(f"persona:{persona_id}", persona_limit or self.persona_limit)
+        model_limiter = self.limiter(f"model:{model}", self.model_limit)
+        waited = await persona_limiter.acquire()
+        try:
+            waited += await model_limiter.acquire()
+        except BaseException:
+            persona_limiter.release()
+            raise
+        return Permit([persona_limiter, model_limiter], waited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+
+def create_admission_controller() -> AdmissionController:
+    """Create the admission controller configured through environment variables"""
+    model_limit = int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "32"))
+    persona_limit = int(os.getenv("ADMISSION_PERSONA_CONCURRENCY", "32"))
+    min_limit = int(os.getenv("ADMISSION_MIN_CONCURRENCY", "2"))
+    max_limit = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "128"))
+    max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+    max_wait = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+    latency_target = float(os.getenv("ADMISSION_LATENCY_TARGET_SECONDS", "20"))
+    logger.info(f"Admission control: model={model_limit}, persona={persona_limit}, queue={max_queue}, max_wait={max_wait}s, latency_target={latency_target}s")
+    return AdmissionController(model_limit, persona_limit, min_limit, max_limit, max_queue, max_wait, latency_target)
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItem:
+    """One line of a batch: its position, the client's custom_id and the parsed request or a parse error"""
+
+    def __init__(self, index: int, custom_id: str, payload: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self.index = index
+        self.custom_id = custom_id
+        self.payload = payload
+        self.error = error
+
+
+def parse_batch(body: bytes) -> Tuple[List[BatchItem], str]:
+    """Parse a JSONL body into items plus a digest used to check that a resumed batch is the same one"""
+    items = []
+    digest = hashlib.sha256()
+    for line in body.decode('utf-8').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        digest.update(line.encode('utf-8') + b'\n')
+        index = len(items)
+        try:
+            payload = json.loads(line)
+            if not isinstance(payload, dict):
+                raise ValueError("each line must be a JSON object")
+        except ValueError as e:
+            items.append(BatchItem(index, str(index), error=f"Invalid JSON: {str(e)}"))
+            continue
+        custom_id = str(payload.pop('custom_id', index))
+        items.append(BatchItem(index, custom_id, payload))
+    return items, digest.hexdigest()
+
+
+def item_error(item: BatchItem, message: str, status_code: Optional[int] = None) -> Dict[str, Any]:
+    result = {'index': item.index, 'custom_id': item.custom_id, 'status': 'error', 'error': message}
+    if status_code:
+        result['status_code'] = status_code
+    return result
+
+
+class BatchStore:
+    """In-memory batch records so an interrupted batch can resume and only re-run unfinished items"""
+
+    def __init__(self, ttl_seconds: float, max_batches: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_batches = max_batches
+        self._batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, batch_id: str, digest: str, items: int, mode: str) -> Dict[str, Any]:
+        record = {
+            'batch_id': batch_id,
+            'digest': digest,
+            'items': items,
+            'mode': mode,
+            'status': 'running',
+            'created_at': time.time(),
+            'results': {}
+        }
+        with self._lock:
+            self._batches[batch_id] = record
+            self._batches.move_to_end(batch_id)
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+        return record
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._batches.get(batch_id)
+            if record is None:
+                return None
+            if time.time() - record['created_at'] > self.ttl_seconds:
+                del self._batches[batch_id]
+                return None
+            self._batches.move_to_end(batch_id)
+            return record
+
+    def record_result(self, batch_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            record = self._batches.get(batch_id)
+            if record is not None:
+                record['results'][result['index']] = result
+
+    def summary(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        results = list(record['results'].values())
+        return {
+            'batch_id': record['batch_id'],
+            'mode': record['mode'],
+            'status': record['status'],
+            'items': record['items'],
+            'completed': len(results),
+            'succeeded': sum(1 for result in results if result['status'] == 'ok'),
+            'failed': sum(1 for result in results if result['status'] == 'error')
+        }
+
+
+async def run_batch(
+    items: List[BatchItem],
+    run_item: Callable[[BatchItem], Awaitable[Dict[str, Any]]],
+    concurrency: int
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run items with at most concurrency in flight and yield each result as soon as it finishes"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(item: BatchItem) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await run_item(item)
+            except Exception as e:
+                logger.error(f"Batch item {item.index} failed: {str(e)}")
+                return item_error(item, str(e))
+
+    tasks = [asyncio.create_task(bounded(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # A client that disconnects mid-batch stops the remaining items; finished ones stay recorded
+        for task in tasks:
+            task.cancel()
+
+
+def response_output_text(body: Dict[str, Any]) -> str:
+    """Concatenated output_text of a Responses API response body"""
+    parts = []
+    for output in body.get('output') or []:
+        if output.get('type') != 'message':
+            continue
+        for content in output.get('content') or []:
+            if content.get('type') == 'output_text':
+                parts.append(content.get('text', ''))
+    return "".join(parts)
+
+
+def create_batch_store() -> BatchStore:
+    """Create the batch store configured through environment variables"""
+    return BatchStore(
+        ttl_seconds=float(os.getenv("BATCH_TTL_SECONDS", "86400")),
+        max_batches=int(os.getenv("BATCH_MAX_BATCHES", "100"))
+    )
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    """Collapse whitespace in all strings so trivially different inputs share a key"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+def make_cache_key(persona_sha256: str, response_params: Dict[str, Any]) -> str:
+    """Build an exact-match key from the persona hash and the parameters that shape the answer"""
+    material = {
+        'persona_sha256': persona_sha256,
+        'model': response_params.get('model'),
+        'verbosity': response_params.get('text', {}).get('verbosity'),
+        'reasoning_effort': response_params.get('reasoning', {}).get('effort'),
+        'temperature': response_params.get('temperature'),
+        'previous_response_id': response_params.get('previous_response_id'),
+        'input': _normalize(response_params.get('input')),
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of completed responses, bounded by entry count and total size"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for key, counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires_at'] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None) -> None:
+        """Store value under key, evicting least recently used entries to stay within limits"""
+        size = len(json.dumps(value, ensure_ascii=False))
+        if not self.enabled or size > self.max_bytes:
+            return
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'value': value, 'size': size, 'expires_at': time.time() + ttl}
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+
+class SharedResponseCache(ResponseCache):
+    """Response cache kept in the shared store so every worker process sees the same entries.
+
+    Expiry is delegated to the store; the entry count and total size are bounded by the store's
+    own eviction (max keys for the local store, maxmemory for Redis). max_bytes caps single entries.
+    Calls block on the store, so callers on the event loop make them in a thread. Store errors
+    and unreadable entries count as misses, and a failed put is skipped.
+    """
+
+    def __init__(self, client: Any, max_entries: int, max_bytes: int, ttl_seconds: float, prefix: str = "response-cache"):
+        super().__init__(max_entries, max_bytes, ttl_seconds)
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = self.client.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared response cache read failed: {str(e)}")
+            data = None
+        try:
+            value = json.loads(data) if data is not None else None
+        except ValueError as e:
+            self.errors += 1
+            logger.warning(f"Shared response cache entry unreadable: {str(e)}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None) -> None:
+        encoded = json.dumps(value, ensure_ascii=False)
+        if not self.enabled or len(encoded) > self.max_bytes:
+            return
+        try:
+            self.client.set(f"{self.prefix}:{key}", encoded, ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared response cache write failed: {str(e)}")
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        for start in range(0, len(keys), 500):
+            self.client.delete(*keys[start:start + 500])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'store': 'shared',
+            'max_bytes_per_entry': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def create_response_cache(shared_client: Any = None) -> ResponseCache:
+    """Create the response cache configured through environment variables"""
+    max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    if os.getenv("RESPONSE_CACHE_STORE", "memory").lower() == "shared":
+        if shared_client is None:
+            raise ValueError("RESPONSE_CACHE_STORE=shared needs SHARED_STORE_URL")
+        logger.info(f"Response cache: shared store (max_bytes per entry={max_bytes}, ttl={ttl_seconds}s)")
+        return SharedResponseCache(shared_client, max_entries, max_bytes, ttl_seconds)
+    logger.info(f"Response cache: max_entries={max_entries}, max_bytes={max_bytes}, ttl={ttl_seconds}s")
+    return ResponseCache(max_entries, max_bytes, ttl_seconds)
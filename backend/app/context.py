@@ -0,0 +1,178 @@
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Words and single punctuation marks; long words count as several tokens, like BPE pieces
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+SUMMARY_INSTRUCTIONS = (
+    "You compact chat history. Summarize the conversation below for the assistant that will continue it. "
+    "Keep facts, decisions, names, numbers, open questions and the user's goals and preferences. "
+    "If an earlier summary is included, merge it with the new turns. Write plain prose, at most 300 words."
+)
+
+
+class TokenEstimator:
+    """Offline token estimator, calibrated against the input token counts upstream reports"""
+
+    def __init__(self, chars_per_token: float = 4.0, message_overhead: int = 4, image_tokens: int = 1000):
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+        self.image_tokens = image_tokens
+        self.factor = 1.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        """Uncalibrated estimate for a piece of text"""
+        return sum(max(1, math.ceil(len(piece) / self.chars_per_token)) for piece in _TOKEN_PATTERN.findall(text))
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """Uncalibrated estimate for chat messages, including multimodal content parts"""
+        total = 0
+        for message in messages:
+            total += self.message_overhead
+            content = message.get('content', '')
+            if isinstance(content, str):
+                total += self.count(content)
+                continue
+            for part in content:
+                if part.get('type') == 'input_image':
+                    total += self.image_tokens
+                else:
+                    total += self.count(part.get('text', ''))
+        return total
+
+    def calibrated(self, raw: int) -> int:
+        return math.ceil(raw * self.factor)
+
+    def observe(self, estimated_raw: int, actual: int) -> None:
+        """Move the calibration factor towards the observed actual/estimated ratio"""
+        if estimated_raw <= 0 or actual <= 0:
+            return
+        ratio = max(0.5, min(2.0, actual / estimated_raw))
+        with self._lock:
+            self.factor = ratio if self.samples == 0 else 0.9 * self.factor + 0.1 * ratio
+            self.samples += 1
+
+
+class SummaryCache:
+    """Rolling summaries keyed by the hash of the exact message prefix they cover"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.created = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prefix_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(prefix_hash)
+            if entry is not None:
+                self._entries.move_to_end(prefix_hash)
+            return entry
+
+    def put(self, prefix_hash: str, summary: str, tokens: int) -> None:
+        with self._lock:
+            self._entries[prefix_hash] = {'summary': summary, 'tokens': tokens}
+            self._entries.move_to_end(prefix_hash)
+            self.created += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'created': self.created}
+
+
+def prefix_hashes(messages: List[Dict[str, Any]]) -> List[str]:
+    """hashes[i] identifies messages[:i]; computed incrementally in one pass"""
+    digest = hashlib.sha256()
+    hashes = [digest.hexdigest()]
+    for message in messages:
+        digest.update(f"{message.get('role')}\x00{message.get('content')}\x01".encode('utf-8'))
+        hashes.append(digest.copy().hexdigest())
+    return hashes
+
+
+class ContextPlan:
+    """How to fit a conversation into the input budget"""
+
+    def __init__(self, keep_from: int, summary: Optional[str] = None, summarize_from: int = 0,
+                 previous_summary: Optional[str] = None, prefix_hash: Optional[str] = None):
+        self.keep_from = keep_from  # messages[keep_from:] are sent verbatim
+        self.summary = summary  # reusable cached summary of messages[:keep_from]
+        self.summarize_from = summarize_from  # when summary is None: new turns to fold into previous_summary
+        self.previous_summary = previous_summary
+        self.prefix_hash = prefix_hash  # cache key for the summary of messages[:keep_from]
+
+    @property
+    def needs_summary(self) -> bool:
+        return self.keep_from > 0 and self.summary is None
+
+
+def plan_context(messages: List[Dict[str, Any]], budget: int, estimator: TokenEstimator,
+                 summaries: SummaryCache, keep_ratio: float = 0.5) -> ContextPlan:
+    """Decide which older turns to replace with a rolling summary so the input fits budget tokens.
+
+    A cached summary is reused whenever one covers a prefix that makes the rest fit. Otherwise
+    enough older turns are compacted to bring the verbatim tail under keep_ratio of the budget,
+    so the next several turns fit without summarizing again.
+    """
+    sizes = [estimator.calibrated(estimator.count_messages([message])) for message in messages]
+    if sum(sizes) <= budget or len(messages) < 2:
+        return ContextPlan(0)
+
+    # Tail sizes: suffix[i] = tokens of messages[i:]
+    suffix = [0] * (len(messages) + 1)
+    for i in range(len(messages) - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + sizes[i]
+
+    hashes = prefix_hashes(messages)
+    for i in range(len(messages) - 1, 0, -1):
+        entry = summaries.get(hashes[i])
+        if entry is not None and entry['tokens'] + suffix[i] <= budget:
+            summaries.hits += 1
+            return ContextPlan(i, summary=entry['summary'], prefix_hash=hashes[i])
+
+    keep_from = len(messages) - 1
+    while keep_from > 1 and suffix[keep_from - 1] <= budget * keep_ratio:
+        keep_from -= 1
+
+    # Roll forward from the longest cached summary inside the compacted prefix
+    for i in range(keep_from - 1, 0, -1):
+        entry = summaries.get(hashes[i])
+        if entry is not None:
+            return ContextPlan(keep_from, summarize_from=i, previous_summary=entry['summary'], prefix_hash=hashes[keep_from])
+    return ContextPlan(keep_from, prefix_hash=hashes[keep_from])
+
+
+def summary_input(plan: ContextPlan, messages: List[Dict[str, Any]]) -> str:
+    """Text handed to the summarizer: the previous summary (if any) and the turns to fold in"""
+    parts = []
+    if plan.previous_summary:
+        parts.append(f"Earlier summary:\n{plan.previous_summary}")
+    turns = messages[plan.summarize_from:plan.keep_from]
+    parts.append("New turns:\n" + "\n\n".join(f"{m.get('role')}: {m.get('content')}" for m in turns))
+    return "\n\n".join(parts)
+
+
+def summary_message(summary: str) -> Dict[str, Any]:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+def create_token_estimator() -> TokenEstimator:
+    """Create the token estimator configured through environment variables"""
+    return TokenEstimator(
+        chars_per_token=float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4")),
+        image_tokens=int(os.getenv("CONTEXT_IMAGE_TOKENS", "1000"))
+    )
+
+
+def create_summary_cache() -> SummaryCache:
+    """Create the rolling summary cache configured through environment variables"""
+    return SummaryCache(int(os.getenv("CONTEXT_SUMMARY_CACHE_ENTRIES", "2000")))
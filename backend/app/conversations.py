@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from app.shared import SharedStoreError
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """Base class for server-side conversation state: one record per response id, naming its conversation"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def get(self, response_id: str) -> Optional[Dict[str, Any]]:
+        """Return the unexpired record for a response id, or None"""
+        raise NotImplementedError
+
+    def put(self, record: Dict[str, Any]) -> None:
+        """Store a record; it must contain 'response_id' and 'conversation_id'"""
+        raise NotImplementedError
+
+    def after_fork(self) -> None:
+        """Called in each worker process after fork; stores holding connections reopen them"""
+
+    def _expired(self, record: Dict[str, Any]) -> bool:
+        return time.time() - record['created_at'] > self.ttl_seconds
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process store with TTL expiry and LRU eviction once max_entries is reached"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        super().__init__(ttl_seconds, max_entries)
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, response_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(response_id)
+            if record is None:
+                return None
+            if self._expired(record):
+                del self._records[response_id]
+                return None
+            self._records.move_to_end(response_id)
+            return dict(record)
+
+    def put(self, record: Dict[str, Any]) -> None:
+        record = {'created_at': time.time(), **record}
+        with self._lock:
+            self._records[record['response_id']] = record
+            self._records.move_to_end(record['response_id'])
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+
+
+class SqliteConversationStore(ConversationStore):
+    """SQLite-backed store so conversation state survives restarts"""
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        super().__init__(ttl_seconds, max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "response_id TEXT PRIMARY KEY, conversation_id TEXT NOT NULL, "
+            "created_at REAL NOT NULL, record TEXT NOT NULL)"
+        )
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def after_fork(self) -> None:
+        # A SQLite connection must not be shared across processes
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def get(self, response_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM conversations WHERE response_id = ? AND created_at >= ?",
+                (response_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, record: Dict[str, Any]) -> None:
+        record = {'created_at': time.time(), **record}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (response_id, conversation_id, created_at, record) VALUES (?, ?, ?, ?)",
+                (record['response_id'], record['conversation_id'], record['created_at'], json.dumps(record))
+            )
+            self._writes += 1
+            # Prune periodically rather than on every write
+            if self._writes % 100 == 1:
+                self._prune()
+
+    def _prune(self) -> None:
+        self._conn.execute("DELETE FROM conversations WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM conversations WHERE response_id NOT IN "
+            "(SELECT response_id FROM conversations ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+
+class SharedConversationStore(ConversationStore):
+    """Store in the shared store (Redis or the local stand-in) so all worker processes see each chain.
+
+    Expiry uses the store's key TTL; max_entries is left to the store's own eviction. When the
+    store is unreachable a chain reads as unknown (the history is rebuilt from the request)
+    and new records are not kept.
+    """
+
+    def __init__(self, client: Any, ttl_seconds: float, max_entries: int, prefix: str = "conversation"):
+        super().__init__(ttl_seconds, max_entries)
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    def get(self, response_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = self.client.get(f"{self.prefix}:response:{response_id}")
+        except SharedStoreError as e:
+            self.errors += 1
+            logger.warning(f"Shared conversation store read failed: {str(e)}")
+            return None
+        return json.loads(data) if data else None
+
+    def put(self, record: Dict[str, Any]) -> None:
+        record = {'created_at': time.time(), **record}
+        try:
+            self.client.set(f"{self.prefix}:response:{record['response_id']}", json.dumps(record), self.ttl_seconds)
+        except SharedStoreError as e:
+            self.errors += 1
+            logger.warning(f"Shared conversation store write failed: {str(e)}")
+
+
+def create_conversation_store(shared_client: Any = None) -> ConversationStore:
+    """Create the conversation store configured through environment variables"""
+    backend = os.getenv("CONVERSATION_STORE", "memory").lower()
+    ttl_seconds = float(os.getenv("CONVERSATION_TTL_SECONDS", "86400"))
+    max_entries = int(os.getenv("CONVERSATION_MAX_ENTRIES", "10000"))
+
+    if backend == "shared":
+        if shared_client is None:
+            raise ValueError("CONVERSATION_STORE=shared needs SHARED_STORE_URL")
+        logger.info(f"Conversation store: shared store (ttl={ttl_seconds}s)")
+        return SharedConversationStore(shared_client, ttl_seconds, max_entries)
+
+    if backend == "sqlite":
+        path = os.getenv("CONVERSATION_STORE_PATH", "conversations.db")
+        logger.info(f"Conversation store: sqlite at {path} (ttl={ttl_seconds}s, max_entries={max_entries})")
+        return SqliteConversationStore(path, ttl_seconds, max_entries)
+
+    logger.info(f"Conversation store: memory (ttl={ttl_seconds}s, max_entries={max_entries})")
+    return MemoryConversationStore(ttl_seconds, max_entries)
+
+
+def trim_history(messages: List[Dict[str, Any]], max_messages: int, max_chars: int) -> List[Dict[str, Any]]:
+    """Keep the most recent messages within the message and character budgets (the latest is always kept)"""
+    trimmed: List[Dict[str, Any]] = []
+    total_chars = 0
+    for message in reversed(messages[-max_messages:] if max_messages > 0 else messages[-1:]):
+        total_chars += len(str(message.get('content', '')))
+        if trimmed and total_chars > max_chars:
+            break
+        trimmed.append(message)
+    trimmed.reverse()
+    return trimmed
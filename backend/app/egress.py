@@ -0,0 +1,63 @@
+import asyncio
+import socket
+import ipaddress
+from typing import List, Optional, Sequence
+from urllib.parse import urlsplit
+
+
+class UnsafeURLError(ValueError):
+    """A URL the server must not fetch or post to: wrong scheme, host not allowed or a non-public address"""
+
+
+def parse_hosts(value: str) -> List[str]:
+    """Host patterns from a comma-separated setting; "*.example.com" matches subdomains, "*" any host"""
+    return [host.strip().lower() for host in value.split(",") if host.strip()]
+
+
+def host_allowed(host: str, patterns: Sequence[str]) -> bool:
+    host = host.lower().rstrip(".")
+    for pattern in patterns:
+        if pattern == "*":
+            return True
+        if pattern.startswith("*."):
+            if host.endswith(pattern[1:]):
+                return True
+        elif host == pattern:
+            return True
+    return False
+
+
+def public_address(address: str) -> bool:
+    """Whether an IP address is routable on the internet (not private, loopback, link-local or reserved)"""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+                or ip.is_multicast or ip.is_unspecified)
+
+
+async def resolve_host(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def check_url(url: str, allowed_hosts: Optional[Sequence[str]] = None, schemes: Sequence[str] = ("https",)) -> str:
+    """Validate an outbound URL and return its host.
+
+    The host must match allowed_hosts when given, and every address it resolves to must be
+    public, so a URL cannot reach the internal network or cloud metadata endpoints.
+    Raises UnsafeURLError otherwise.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in schemes or not parts.hostname:
+        raise UnsafeURLError(f"URL must use {' or '.join(schemes)} and name a host")
+    host = parts.hostname
+    if allowed_hosts is not None and not host_allowed(host, allowed_hosts):
+        raise UnsafeURLError(f"Host {host} is not allowed")
+    try:
+        addresses = await resolve_host(host, parts.port or (443 if parts.scheme == "https" else 80))
+    except (OSError, UnicodeError) as e:
+        raise UnsafeURLError(f"Host {host} could not be resolved: {str(e)}")
+    if not addresses or not all(public_address(address) for address in addresses):
+        raise UnsafeURLError(f"Host {host} resolves to a non-public address")
+    return host
@@ -0,0 +1,295 @@
+import io
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.egress import UnsafeURLError, check_url, parse_hosts
+
+_pillow: Any = False  # Imported on first use: Pillow adds startup time and only the image stage needs it
+
+
+def pillow() -> Any:
+    """The PIL.Image module, or None when Pillow is not installed (images are then uploaded unresized)"""
+    global _pillow
+    if _pillow is False:
+        try:
+            from PIL import Image as _pillow
+        except ImportError:
+            _pillow = None
+    return _pillow
+
+logger = logging.getLogger(__name__)
+
+
+class ImageError(Exception):
+    """An image could not be fetched, decoded or uploaded"""
+
+
+class _LRU:
+    """Small bounded mapping used for the URL and content-hash indexes"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class OpenAIImageStore:
+    """Uploads images through the Files API so requests can reference them by file id"""
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    async def upload(self, data: bytes, filename: str, content_type: str) -> str:
+        uploaded = await self.client.files.create(file=(filename, data, content_type), purpose="vision")
+        return uploaded.id
+
+
+class LocalImageStore:
+    """Content-addressed files on local disk; a stand-in for the Files API in development and tests"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    async def upload(self, data: bytes, filename: str, content_type: str) -> str:
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            await asyncio.to_thread(_write_file, path, data)
+        return f"file-local-{os.path.splitext(filename)[0]}"
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def fit_size(width: int, height: int, max_side: int, short_side: int) -> Tuple[int, int]:
+    """Target size the model works at: longest side within max_side, then shortest within short_side"""
+    scale = min(1.0, max_side / max(width, height))
+    scale = min(scale, short_side / max(1, min(width, height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF8", "gif", "image/gif"),
+    (b"RIFF", "webp", "image/webp")
+)
+
+
+def sniff(data: bytes) -> Tuple[str, str]:
+    """(extension, content type) from the file signature"""
+    for signature, extension, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return extension, content_type
+    raise ImageError("Unsupported image format")
+
+
+def reencode(data: bytes, max_side: int, short_side: int, quality: int) -> Tuple[bytes, str, str]:
+    """Downscale and re-encode an image; returns (bytes, extension, content type).
+
+    Without Pillow, or when an image already at model resolution would not get smaller,
+    the original bytes are kept.
+    """
+    Image = pillow()
+    if Image is None:
+        return (data, *sniff(data))
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            target = fit_size(image.width, image.height, max_side, short_side)
+            resized = target != (image.width, image.height)
+            if resized:
+                image = image.resize(target, Image.LANCZOS)
+            output = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(output, format="PNG", optimize=True)
+                extension, content_type = "png", "image/png"
+            else:
+                image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+                extension, content_type = "jpg", "image/jpeg"
+    except Exception as e:
+        raise ImageError(f"Could not decode image: {str(e)}") from e
+    encoded = output.getvalue()
+    if not resized and len(encoded) >= len(data):
+        return (data, *sniff(data))
+    return encoded, extension, content_type
+
+
+class ImagePipeline:
+    """Fetches, downscales, deduplicates and uploads images, returning input_image parts by file id.
+
+    Each URL is fetched once and each distinct image (by content hash) is uploaded once; concurrent
+    requests for the same URL share one task. Fetching and re-encoding run in a bounded pool.
+    Only https URLs on allowed_hosts that resolve to public addresses are fetched, and redirects
+    must stay on the same host.
+    """
+
+    def __init__(self, store: Any, http_client: httpx.AsyncClient, workers: int = 4, max_bytes: int = 10 * 1024 * 1024,
+                 max_side: int = 2048, short_side: int = 768, quality: int = 85, max_entries: int = 1000,
+                 allowed_hosts: Optional[List[str]] = None, max_redirects: int = 3):
+        self.store = store
+        self.http_client = http_client
+        self.allowed_hosts = allowed_hosts
+        self.max_redirects = max_redirects
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.short_side = short_side
+        self.quality = quality
+        self._semaphore = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        self._by_url = _LRU(max_entries)
+        self._by_hash = _LRU(max_entries)
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.fetched = 0
+        self.uploaded = 0
+        self.url_hits = 0
+        self.hash_hits = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def prepare(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """input_image parts for urls, in order; an image that fails keeps its original URL"""
+        file_ids = await asyncio.gather(*(self.file_id(url) for url in urls), return_exceptions=True)
+        parts = []
+        for url, file_id in zip(urls, file_ids):
+            if isinstance(file_id, BaseException):
+                self.failures += 1
+                logger.warning(f"Image preprocessing failed for {url}, sending the URL instead: {str(file_id)}")
+                parts.append({"type": "input_image", "image_url": url})
+            else:
+                parts.append({"type": "input_image", "file_id": file_id})
+        return parts
+
+    async def file_id(self, url: str) -> str:
+        file_id = self._by_url.get(url)
+        if file_id is not None:
+            self.url_hits += 1
+            return file_id
+        task = self._pending.get(url)
+        if task is None:
+            task = asyncio.create_task(self._process(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _process(self, url: str) -> str:
+        async with self._semaphore:
+            data = await self._fetch(url)
+            digest = hashlib.sha256(data).hexdigest()
+            file_id = self._by_hash.get(digest)
+            if file_id is not None:
+                self.hash_hits += 1
+            else:
+                loop = asyncio.get_running_loop()
+                encoded, extension, content_type = await loop.run_in_executor(
+                    self._executor, reencode, data, self.max_side, self.short_side, self.quality)
+                file_id = await self.store.upload(encoded, f"{digest}.{extension}", content_type)
+                self._by_hash.put(digest, file_id)
+                self.uploaded += 1
+                self.bytes_in += len(data)
+                self.bytes_out += len(encoded)
+                logger.info(f"Uploaded image {digest[:8]} as {file_id} ({len(data)} -> {len(encoded)} bytes)")
+            self._by_url.put(url, file_id)
+            return file_id
+
+    async def _fetch(self, url: str) -> bytes:
+        try:
+            host = await check_url(url, self.allowed_hosts)
+        except UnsafeURLError as e:
+            raise ImageError(f"Refusing to fetch image: {str(e)}")
+        for _ in range(self.max_redirects + 1):
+            async with self.http_client.stream("GET", url) as response:
+                if response.is_redirect:
+                    # Redirects are followed by hand so every hop is checked like the first URL
+                    url = str(response.url.join(response.headers.get("location", "")))
+                    try:
+                        if await check_url(url, self.allowed_hosts) != host:
+                            raise UnsafeURLError(f"Redirect leaves {host}")
+                    except UnsafeURLError as e:
+                        raise ImageError(f"Refusing to follow image redirect: {str(e)}")
+                    continue
+                if response.status_code != 200:
+                    raise ImageError(f"Fetching image returned HTTP {response.status_code}")
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageError(f"Image larger than {self.max_bytes} bytes")
+                    chunks.append(chunk)
+            self.fetched += 1
+            return b"".join(chunks)
+        raise ImageError(f"More than {self.max_redirects} redirects")
+
+    async def close(self) -> None:
+        await self.http_client.aclose()
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'resizing': pillow() is not None,
+            'urls': len(self._by_url),
+            'images': len(self._by_hash),
+            'fetched': self.fetched,
+            'uploaded': self.uploaded,
+            'url_hits': self.url_hits,
+            'hash_hits': self.hash_hits,
+            'failures': self.failures,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out
+        }
+
+
+def create_image_pipeline(client: Any) -> Optional[ImagePipeline]:
+    """Create the image stage configured through environment variables, or None when disabled"""
+    if os.getenv("IMAGE_PREPROCESS", "false").lower() not in ("1", "true", "yes"):
+        return None
+    backend = os.getenv("IMAGE_STORE", "openai").lower()
+    if backend == "local":
+        store = LocalImageStore(os.getenv("IMAGE_STORE_PATH", "image-store"))
+    else:
+        store = OpenAIImageStore(client)
+    workers = int(os.getenv("IMAGE_WORKERS", "4"))
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=workers * 2, max_keepalive_connections=workers),
+        timeout=httpx.Timeout(float(os.getenv("IMAGE_FETCH_TIMEOUT", "20")))
+    )
+    allowed_hosts = parse_hosts(os.getenv("IMAGE_ALLOWED_HOSTS", "*.public.blob.vercel-storage.com"))
+    if pillow() is None:
+        logger.warning("Pillow is not installed; images are deduplicated and uploaded without resizing")
+    logger.info(f"Image preprocessing: store={backend}, workers={workers}, allowed hosts={','.join(allowed_hosts)}")
+    return ImagePipeline(
+        store,
+        http_client,
+        workers=workers,
+        max_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024))),
+        max_side=int(os.getenv("IMAGE_MAX_SIDE", "2048")),
+        short_side=int(os.getenv("IMAGE_SHORT_SIDE", "768")),
+        quality=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+        max_entries=int(os.getenv("IMAGE_CACHE_ENTRIES", "1000")),
+        allowed_hosts=allowed_hosts
+    )
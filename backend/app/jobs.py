@@ -0,0 +1,316 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from app.egress import UnsafeURLError, check_url, parse_hosts
+from app.shared import SharedStoreError
+from app.streams import ReplayStream
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('completed', 'failed')
+
+
+class JobQueueFull(Exception):
+    """Raised by JobRunner.submit when the queue is at its limit"""
+
+
+class Job:
+    """One background /v1/chat request: the request, its progress, frames and final result.
+
+    The frames go into a ReplayStream without a generation task, so attaching and detaching
+    readers never cancels the job.
+    """
+
+    def __init__(self, job_id: str, persona_id: str, request: Any, webhook_url: Optional[str] = None):
+        self.job_id = job_id
+        self.persona_id = persona_id
+        self.request = request
+        self.webhook_url = webhook_url
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.webhook: Optional[Dict[str, Any]] = None
+        self.stream = ReplayStream(job_id, "")
+
+    def as_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        record = {
+            'job_id': self.job_id,
+            'persona': self.persona_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'events': len(self.stream.frames)
+        }
+        if include_result and self.result is not None:
+            record['result'] = self.result
+        if self.webhook is not None:
+            record['webhook'] = self.webhook
+        return record
+
+
+class JobStore:
+    """In-memory job records; finished jobs are kept for ttl_seconds and at most max_jobs are held.
+
+    With a shared store client, each status change is also published there, so any worker
+    process can answer a poll; the frames stay with the worker running the job. The shared
+    store calls block, so the runner makes them off the event loop.
+    """
+
+    def __init__(self, ttl_seconds: float, max_jobs: int, shared_client: Any = None, prefix: str = "job"):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.shared_client = shared_client
+        self.prefix = prefix
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+            # Over the limit, drop the oldest finished jobs; queued and running ones are never evicted
+            for key in [key for key, stored in self._jobs.items() if stored.status in FINISHED]:
+                if len(self._jobs) <= self.max_jobs:
+                    break
+                del self._jobs[key]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def publish(self, job: Job) -> None:
+        """Copy the job's record to the shared store; a failure only costs other workers the update"""
+        if self.shared_client is None:
+            return
+        try:
+            self.shared_client.set(f"{self.prefix}:{job.job_id}", json.dumps(job.as_dict()), self.ttl_seconds)
+        except SharedStoreError as e:
+            logger.warning(f"Job {job.job_id}: Publishing to the shared store failed: {str(e)}")
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        if self.shared_client is not None:
+            try:
+                self.shared_client.delete(f"{self.prefix}:{job_id}")
+            except SharedStoreError as e:
+                logger.warning(f"Job {job_id}: Removing from the shared store failed: {str(e)}")
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job record as returned to pollers, from this process or, failing that, the shared store.
+
+        Raises SharedStoreError when the job is not local and the shared store is unreachable.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.as_dict()
+        if self.shared_client is not None:
+            data = self.shared_client.get(f"{self.prefix}:{job_id}")
+            return json.loads(data) if data else None
+        return None
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, job in self._jobs.items() if job.finished_at is not None and job.finished_at < cutoff]
+        for key in expired:
+            del self._jobs[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {'jobs': len(self._jobs), 'by_status': counts}
+
+
+class JobRunner:
+    """Fixed pool of worker tasks draining a bounded queue of jobs.
+
+    run(job) does the work and returns the result dict (status 'ok' or 'error'); the runner
+    tracks the job's status, closes its stream and delivers the completion webhook. Webhooks
+    only go to webhook_allowed_hosts, and only while the host resolves to public addresses.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        run: Callable[[Job], Awaitable[Dict[str, Any]]],
+        workers: int = 4,
+        max_queue: int = 100,
+        webhook_timeout: float = 10.0,
+        webhook_retries: int = 3,
+        webhook_secret: str = "",
+        webhook_allowed_hosts: Optional[List[str]] = None,
+        webhook_transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_retries: int = 3
+    ):
+        self.store = store
+        self.run = run
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self.webhook_secret = webhook_secret
+        self.webhook_allowed_hosts = webhook_allowed_hosts if webhook_allowed_hosts is not None else []
+        self.webhook_transport = webhook_transport
+        self.max_retries = max_retries
+        self.completed = 0
+        self.failed = 0
+        self.webhooks_failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        """Start the workers on the running loop (again, if the loop they ran on is gone)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: Job) -> None:
+        """Record a job and queue it; raises JobQueueFull when the queue is at its limit"""
+        self.start()
+        if self._queue.full():
+            raise JobQueueFull(f"{self.max_queue} jobs already queued")
+        self.store.add(job)
+        # Published before a worker can pick the job up, so 'queued' never overwrites a later status
+        await asyncio.to_thread(self.store.publish, job)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            await asyncio.to_thread(self.store.discard, job.job_id)
+            raise JobQueueFull(f"{self.max_queue} jobs already queued")
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.execute(job)
+            finally:
+                self._queue.task_done()
+
+    async def execute(self, job: Job) -> None:
+        job.status = 'running'
+        job.started_at = time.time()
+        await asyncio.to_thread(self.store.publish, job)
+        logger.info(f"Job {job.job_id}: Started after {job.started_at - job.created_at:.2f}s in the queue")
+        try:
+            job.result = await self.run(job)
+        except asyncio.CancelledError:
+            job.result = {'status': 'error', 'error': 'Job cancelled by shutdown'}
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.job_id}: Failed: {str(e)}", exc_info=True)
+            job.result = {'status': 'error', 'error': str(e)}
+        finally:
+            job.status = 'completed' if job.result and job.result.get('status') == 'ok' else 'failed'
+            job.finished_at = time.time()
+            job.stream.finish()
+            if job.status == 'completed':
+                self.completed += 1
+            else:
+                self.failed += 1
+            logger.info(f"Job {job.job_id}: {job.status} in {job.finished_at - job.started_at:.2f}s")
+        await asyncio.to_thread(self.store.publish, job)
+        if job.webhook_url:
+            await self.notify(job)
+            await asyncio.to_thread(self.store.publish, job)
+
+    async def check_webhook(self, url: str) -> None:
+        """Raise UnsafeURLError unless url is an http(s) URL on an allowed host with only public addresses"""
+        await check_url(url, self.webhook_allowed_hosts, schemes=("https", "http"))
+
+    async def notify(self, job: Job) -> None:
+        """POST the finished job to its webhook, retrying with backoff on errors and 5xx responses.
+
+        The URL is checked again first, since the host may resolve differently by now.
+        With a webhook secret, the body is signed in an X-Job-Signature header (hex HMAC-SHA256).
+        """
+        try:
+            await self.check_webhook(job.webhook_url)
+        except UnsafeURLError as e:
+            self.webhooks_failed += 1
+            logger.warning(f"Job {job.job_id}: Webhook refused: {str(e)}")
+            job.webhook = {'delivered': False, 'attempts': 0, 'error': str(e)}
+            return
+        body = json.dumps(job.as_dict()).encode('utf-8')
+        headers = {"Content-Type": "application/json", "X-Job-ID": job.job_id}
+        if self.webhook_secret:
+            headers["X-Job-Signature"] = hmac.new(self.webhook_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        outcome: Dict[str, Any] = {'delivered': False, 'attempts': 0}
+        async with httpx.AsyncClient(timeout=self.webhook_timeout, transport=self.webhook_transport) as http_client:
+            for attempt in range(self.webhook_retries + 1):
+                outcome['attempts'] = attempt + 1
+                try:
+                    response = await http_client.post(job.webhook_url, content=body, headers=headers)
+                    outcome['status_code'] = response.status_code
+                    if response.status_code < 500:
+                        outcome['delivered'] = response.status_code < 400
+                        break
+                except httpx.HTTPError as e:
+                    outcome['error'] = str(e) or type(e).__name__
+                if attempt < self.webhook_retries:
+                    await asyncio.sleep(2 ** attempt)
+        if not outcome['delivered']:
+            self.webhooks_failed += 1
+            logger.warning(f"Job {job.job_id}: Webhook delivery failed after {outcome['attempts']} attempts")
+        job.webhook = outcome
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.store.stats(),
+            'workers': self.workers,
+            'queued': self.queued(),
+            'max_queue': self.max_queue,
+            'completed': self.completed,
+            'failed': self.failed,
+            'webhooks_failed': self.webhooks_failed
+        }
+
+
+def create_job_runner(run: Callable[[Job], Awaitable[Dict[str, Any]]], shared_client: Any = None) -> JobRunner:
+    """Create the background job store and worker pool configured through environment variables"""
+    store = JobStore(
+        ttl_seconds=float(os.getenv("JOBS_TTL_SECONDS", "86400")),
+        max_jobs=int(os.getenv("JOBS_MAX_JOBS", "1000")),
+        shared_client=shared_client
+    )
+    runner = JobRunner(
+        store,
+        run,
+        workers=int(os.getenv("JOBS_WORKERS", "4")),
+        max_queue=int(os.getenv("JOBS_MAX_QUEUE", "100")),
+        webhook_timeout=float(os.getenv("JOBS_WEBHOOK_TIMEOUT_SECONDS", "10")),
+        webhook_retries=int(os.getenv("JOBS_WEBHOOK_RETRIES", "3")),
+        webhook_secret=os.getenv("JOBS_WEBHOOK_SECRET", ""),
+        webhook_allowed_hosts=parse_hosts(os.getenv("JOBS_WEBHOOK_ALLOWED_HOSTS", "")),
+        max_retries=int(os.getenv("JOBS_MAX_RETRIES", "3"))
+    )
+    logger.info(f"Background jobs: {runner.workers} workers, max_queue={runner.max_queue}, ttl={store.ttl_seconds}s")
+    return runner
@@ -0,0 +1,267 @@
+import os
+import copy
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import asyncio
+import random
+import logging
+import logging.handlers
+from typing import Any, AsyncIterator, Callable, List, Optional, Union
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+max_message_chars = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "4000"))
+max_field_chars = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+payload_sample_rate = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05"))
+
+log_file_path = 'app.log'
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def truncate(text: str, limit: int) -> str:
+    """Cut text to limit characters, noting how much was dropped"""
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...[truncated {len(text) - limit} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with size-capped message and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': truncate(record.getMessage(), max_message_chars)
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(str(value), max_field_chars)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = truncate(record.exc_text, max_field_chars * 4)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller; records are dropped (and counted) when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render the traceback now, while the exception is still alive;
+        # full formatting happens on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """Compress a rotated log segment"""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def create_file_handler(log_file: str) -> logging.handlers.RotatingFileHandler:
+    """Size-rotated log file; old segments are gzipped as app.log.1.gz, app.log.2.gz, ..."""
+    handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding='utf-8'
+    )
+    handler.namer = lambda name: f"{name}.gz"
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(level: str, log_file: str = 'app.log') -> DroppingQueueHandler:
+    """Route all logging through a bounded queue drained by a background writer thread"""
+    global _listener, log_file_path
+    log_file_path = log_file
+    log_format = os.getenv("LOG_FORMAT", "json").lower()
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.StreamHandler(), create_file_handler(log_file)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level))
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def worker_log_file(log_file: str, pid: int) -> str:
+    """Per-process log file name, app.log -> app.<pid>.log"""
+    base, extension = os.path.splitext(log_file)
+    return f"{base}.{pid}{extension}"
+
+
+def restart_after_fork() -> None:
+    """Give a forked worker its own queue, writer thread and log file.
+
+    The parent's thread does not survive fork, and processes sharing one rotating file would
+    each rotate it on their own; the master keeps app.log and each worker writes app.<pid>.log.
+    """
+    global _listener, log_file_path
+    if _listener is None:
+        return
+    handlers = []
+    for handler in _listener.handlers:
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            handler.close()
+            log_file_path = worker_log_file(handler.baseFilename, os.getpid())
+            worker_handler = create_file_handler(log_file_path)
+            worker_handler.setFormatter(handler.formatter)
+            handler = worker_handler
+        handlers.append(handler)
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.queue = queue.Queue(maxsize=handler.queue.maxsize)
+            _listener = logging.handlers.QueueListener(handler.queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            return
+
+
+@atexit.register
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_payload(logger: logging.Logger, request_id: str, label: str, payload: Union[Any, Callable[[], Any]]) -> None:
+    """Log a full request/response payload for a sampled fraction of requests (LOG_PAYLOAD_SAMPLE_RATE).
+
+    The payload may be a callable so nothing is serialized unless the record will be written.
+    """
+    if random.random() >= payload_sample_rate or not logger.isEnabledFor(logging.INFO):
+        return
+    value = payload() if callable(payload) else payload
+    serialized = truncate(json.dumps(value, default=str, ensure_ascii=False), max_field_chars)
+    logger.info(f"Request {request_id}: {label}: {serialized}", extra={'request_id': request_id, 'payload_log': True})
+
+
+def line_matches(line: str, request_id: Optional[str] = None, min_level: Optional[str] = None) -> bool:
+    """Whether a log line (JSON or text format) mentions request_id and is at least min_level"""
+    if request_id and request_id not in line:
+        return False
+    if min_level:
+        threshold = logging.getLevelName(min_level.upper())
+        if not isinstance(threshold, int):
+            return True
+        level_name = None
+        if line.startswith('{'):
+            try:
+                level_name = json.loads(line).get('level')
+            except ValueError:
+                pass
+        else:
+            parts = line.split(' - ')
+            level_name = parts[2] if len(parts) > 3 else None
+        level = logging.getLevelName(level_name) if level_name else None
+        if not isinstance(level, int) or level < threshold:
+            return False
+    return True
+
+
+def tail_lines(path: str, count: int, request_id: Optional[str] = None,
+               min_level: Optional[str] = None, block_size: int = 8192) -> List[str]:
+    """Return the last count matching lines, reading the file backwards only as far as needed"""
+    if count <= 0:
+        return []
+    matches: List[str] = []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0 and len(matches) < count:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            chunk = f.read(read_size) + remainder
+            lines = chunk.split(b'\n')
+            # The first piece may be a partial line; keep it for the next (earlier) block
+            remainder = lines.pop(0) if position > 0 else b''
+            for raw in reversed(lines):
+                line = raw.decode('utf-8', errors='replace')
+                if line and line_matches(line, request_id, min_level):
+                    matches.append(line)
+                    if len(matches) == count:
+                        break
+    matches.reverse()
+    return matches
+
+
+async def follow_lines(path: str, request_id: Optional[str] = None, min_level: Optional[str] = None,
+                       poll_interval: float = 0.5) -> AsyncIterator[str]:
+    """Yield lines appended to path as they are written, surviving rotation"""
+    f = None
+    inode = None
+    buffer = ''
+    seek_to_end = True
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(path, 'r', encoding='utf-8', errors='replace')
+                except FileNotFoundError:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if seek_to_end:
+                    f.seek(0, os.SEEK_END)
+                # After a rotation the new file is read from its start
+                seek_to_end = False
+            data = f.read()
+            if data:
+                buffer += data
+                *lines, buffer = buffer.split('\n')
+                for line in lines:
+                    if line and line_matches(line, request_id, min_level):
+                        yield line
+                continue
+            try:
+                rotated = os.stat(path).st_ino != inode
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                f.close()
+                f = None
+                continue
+            await asyncio.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
@@ -1,33 +1,49 @@
 import os
 import json
+import hashlib
 import uuid
 import time
 import logging
 import asyncio
-import hashlib
-from typing import List, Dict, Any, Optional
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 import openai
+import httpx
 from dotenv import load_dotenv
-# httpx import removed - no longer needed for image uploads
+from app.personas import DEFAULT_BUNDLE_PATH, PersonaLoader, watch_personas
+from app.conversations import create_conversation_store, trim_history
+from app.context import (SUMMARY_INSTRUCTIONS, create_summary_cache, create_token_estimator, plan_context,
+                         summary_input, summary_message)
+from app.cache import create_response_cache, make_cache_key
+from app.semantic import create_semantic_cache, semantic_scope
+from app.singleflight import SingleFlight
+from app.resilience import create_circuit_breakers, open_with_fallback
+from app.admission import AdmissionRejected, create_admission_controller
+from app.egress import UnsafeURLError
+from app.images import create_image_pipeline
+from app.shared import SharedStoreError, create_shared_client
+from app.routing import RouteDecision, create_router, supports_reasoning
+from app.tools import create_search_classifier, has_web_search, persona_tools
+from app.streams import ClosingStreamingResponse, ReplayStream, create_replay_buffer
+from app.batches import BatchItem, create_batch_store, item_error, parse_batch, response_output_text, run_batch
+from app.jobs import Job, JobQueueFull, create_job_runner
+from app import logs
+from app.logs import log_payload, setup_logging
+from app import metrics
 
-# Load environment variables
-load_dotenv(".env.local")
-load_dotenv()  # Fallback to .env
+# Load environment variables (explicit paths, so no directory walk looking for .env)
+for env_file in (".env.local", ".env"):
+    if os.path.exists(env_file):
+        load_dotenv(env_file)
 
-# Configure logging
+# Configure logging - records are queued and written by a background thread
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log')
-    ]
-)
+log_queue_handler = setup_logging(log_level)
 logger = logging.getLogger(__name__)
 
 # Log startup information
@@ -36,90 +52,52 @@ logger.info(f"OpenAI API Key configured: {'Yes' if os.getenv('OPENAI_API_KEY') e
 logger.info(f"Gateway Token configured: {'Yes' if os.getenv('GATEWAY_TOKEN') else 'No'}")
 logger.info(f"Allowed Origins: {os.getenv('ALLOWED_ORIGINS', 'Not set')}")
 
-# Persona system
-persona_cache: Dict[str, Dict[str, Any]] = {}
+# Offline token estimates; persona instructions are counted once when loaded
+token_estimator = create_token_estimator()
+
+# Store shared by all worker processes (SHARED_STORE_URL); None in single-process mode
+shared_client = create_shared_client()
+PERSONA_GENERATION_KEY = "personas:generation"
+
+# Persona system - requests read an immutable snapshot that reloads replace atomically
+persona_loader = PersonaLoader(token_counter=token_estimator.count)
+persona_cache: Mapping[str, Mapping[str, Any]] = MappingProxyType({})
+persona_generation: Optional[bytes] = None
 
 def load_personas():
-    """Load persona registry and instructions files into memory"""
+    """Load persona registry and instructions files into a new snapshot and swap it in"""
     global persona_cache
-    persona_cache.clear()
-    
     try:
-        # Load persona registry - try multiple possible paths
-        possible_paths = [
-            os.path.join(os.path.dirname(__file__), "..", "config", "personas.registry.json"),
-            os.path.join(os.getcwd(), "config", "personas.registry.json"),
-            os.path.join(os.getcwd(), "backend", "config", "personas.registry.json"),
-            "config/personas.registry.json",
-            "backend/config/personas.registry.json"
-        ]
-        
-        registry_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                registry_path = path
-                break
-        
-        if not registry_path:
-            logger.error(f"Persona registry not found in any of these locations: {possible_paths}")
-            logger.error(f"Current working directory: {os.getcwd()}")
-            logger.error(f"__file__ location: {__file__}")
-            logger.error(f"Directory listing: {os.listdir('.')}")
-            raise FileNotFoundError(f"Persona registry not found in any of these locations: {possible_paths}")
-        with open(registry_path, 'r', encoding='utf-8') as f:
-            registry = json.load(f)
-        
-        logger.info(f"Loading {len(registry['personas'])} personas from registry")
-        
-        for persona in registry['personas']:
-            persona_id = persona['id']
-            
-            # Load instructions file - try multiple possible paths
-            possible_instruction_paths = [
-                os.path.join(os.path.dirname(__file__), "..", persona['instructions_path']),
-                os.path.join(os.getcwd(), persona['instructions_path']),
-                os.path.join(os.getcwd(), "backend", persona['instructions_path']),
-                persona['instructions_path']
-            ]
-            
-            instructions_path = None
-            for path in possible_instruction_paths:
-                if os.path.exists(path):
-                    instructions_path = path
-                    break
-            
-            if not instructions_path:
-                raise FileNotFoundError(f"Instructions file not found for persona '{persona_id}' in any of these locations: {possible_instruction_paths}")
-            try:
-                with open(instructions_path, 'r', encoding='utf-8') as f:
-                    instructions_text = f.read()
-                
-                # Compute SHA256 hash
-                instructions_sha256 = hashlib.sha256(instructions_text.encode('utf-8')).hexdigest()
-                
-                # Store in cache
-                persona_cache[persona_id] = {
-                    'text': instructions_text,
-                    'sha256': instructions_sha256,
-                    **persona  # Include all registry fields
-                }
-                
-                logger.info(f"Loaded persona '{persona_id}' (v{persona['version']}) - SHA256: {instructions_sha256[:8]}...")
-                
-            except FileNotFoundError:
-                logger.error(f"Instructions file not found for persona '{persona_id}': {instructions_path}")
-            except Exception as e:
-                logger.error(f"Error loading persona '{persona_id}': {str(e)}")
-        
-        logger.info(f"Successfully loaded {len(persona_cache)} personas")
-        
-    except FileNotFoundError:
-        logger.error("Persona registry not found, no personas loaded")
+        persona_cache = persona_loader.load(persona_cache)
+    except FileNotFoundError as e:
+        logger.error(f"Persona registry not found, keeping {len(persona_cache)} loaded personas: {str(e)}")
     except Exception as e:
-        logger.error(f"Error loading persona registry: {str(e)}")
+        logger.error(f"Error loading persona registry, keeping {len(persona_cache)} loaded personas: {str(e)}")
+
+def read_persona_generation() -> Optional[bytes]:
+    """Reload counter in the shared store; bumped whenever any worker reloads personas"""
+    return shared_client.get(PERSONA_GENERATION_KEY) if shared_client else None
+
+# Precompiled registry + instructions written at image build time (python -m app.personas build)
+persona_bundle_path = os.getenv("PERSONA_BUNDLE", DEFAULT_BUNDLE_PATH)
 
-# Load personas on startup
-load_personas()
+def load_initial_personas():
+    """Load the persona bundle in one read when present, otherwise the registry and instructions files"""
+    global persona_cache
+    if persona_bundle_path and os.path.exists(persona_bundle_path):
+        try:
+            persona_cache = persona_loader.load_bundle(persona_bundle_path)
+            return
+        except Exception as e:
+            logger.error(f"Could not load persona bundle {persona_bundle_path}, reading the source files: {str(e)}")
+    load_personas()
+
+# Load personas on startup - under gunicorn --preload this runs once, before workers fork
+try:
+    persona_generation = read_persona_generation()
+except Exception as e:
+    logger.error(f"Could not read the persona generation from the shared store: {str(e)}")
+load_initial_personas()
 
 # Initialize FastAPI app
 app = FastAPI(title="AI Assistant Suite Backend", version="1.0.0")
@@ -155,6 +133,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Stream-Resumed"],  # Needed by the browser to resume a dropped stream
 )
 
 # Initialize OpenAI client
@@ -163,7 +142,248 @@ if not api_key:
     api_key = "dummy-key-for-testing"
     logger.warning("No OPENAI_API_KEY found, using dummy key for testing")
 
-client = openai.OpenAI(api_key=api_key)
+def create_openai_client() -> openai.AsyncOpenAI:
+    """Create the shared async OpenAI client with an explicitly sized HTTP connection pool"""
+    max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    max_keepalive = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    keepalive_expiry = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    request_timeout = float(os.getenv("OPENAI_TIMEOUT", "600"))
+    connect_timeout = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+    max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=httpx.Timeout(request_timeout, connect=connect_timeout)
+    )
+    logger.info(f"OpenAI connection pool: max_connections={max_connections}, keepalive={max_keepalive} ({keepalive_expiry}s), timeout={request_timeout}s, connect_timeout={connect_timeout}s, max_retries={max_retries}")
+    return openai.AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=max_retries)
+
+client = create_openai_client()
+
+@app.on_event("shutdown")
+async def close_openai_client():
+    """Close pooled upstream connections on shutdown"""
+    await client.close()
+
+# Optional image stage: fetch, downscale and upload each distinct image once, then reference it by file id
+image_pipeline = create_image_pipeline(client)
+
+@app.on_event("shutdown")
+async def close_image_pipeline():
+    """Close the image fetch pool on shutdown"""
+    if image_pipeline:
+        await image_pipeline.close()
+
+# Optional background watcher so instruction edits apply without an admin reload
+persona_watch_interval = float(os.getenv("PERSONA_WATCH_INTERVAL_SECONDS", "0"))
+persona_watch_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_persona_watcher():
+    """Start polling persona files when PERSONA_WATCH_INTERVAL_SECONDS is set"""
+    global persona_watch_task
+    if persona_watch_interval > 0:
+        persona_watch_task = asyncio.create_task(watch_personas(persona_loader, load_personas, persona_watch_interval))
+
+@app.on_event("shutdown")
+async def stop_persona_watcher():
+    """Stop the persona file watcher"""
+    if persona_watch_task:
+        persona_watch_task.cancel()
+
+# With several workers, a reload in one of them is broadcast through the shared store
+persona_sync_interval = float(os.getenv("PERSONA_SYNC_INTERVAL_SECONDS", "1"))
+persona_sync_task: Optional[asyncio.Task] = None
+
+async def sync_personas(interval: float) -> None:
+    """Reload personas whenever another worker has bumped the shared generation counter"""
+    global persona_generation
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            generation = await asyncio.to_thread(read_persona_generation)
+            if generation != persona_generation:
+                logger.info("Personas reloaded by another worker, reloading")
+                persona_generation = generation
+                await asyncio.to_thread(load_personas)
+        except Exception as e:
+            logger.error(f"Persona sync error: {str(e)}")
+
+@app.on_event("startup")
+async def start_persona_sync():
+    """Follow persona reloads from other workers when a shared store is configured"""
+    global persona_sync_task
+    if shared_client and persona_sync_interval > 0:
+        persona_sync_task = asyncio.create_task(sync_personas(persona_sync_interval))
+
+@app.on_event("shutdown")
+async def stop_persona_sync():
+    """Stop following persona reloads"""
+    if persona_sync_task:
+        persona_sync_task.cancel()
+
+# Event loop lag sampling for /metrics (0 disables)
+event_loop_lag_interval = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+event_loop_lag_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_event_loop_lag_monitor():
+    """Start sampling event loop lag"""
+    global event_loop_lag_task
+    if event_loop_lag_interval > 0:
+        event_loop_lag_task = asyncio.create_task(metrics.monitor_event_loop_lag(event_loop_lag_interval))
+
+@app.on_event("shutdown")
+async def stop_event_loop_lag_monitor():
+    """Stop sampling event loop lag"""
+    if event_loop_lag_task:
+        event_loop_lag_task.cancel()
+
+# Warm-up: open pooled upstream (and shared store) connections before traffic arrives.
+# /ready stays 503 until it has succeeded and personas are loaded.
+warmup_enabled = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+warmup_connections = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+warmup_timeout = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "5"))
+warmup_retry_interval = float(os.getenv("WARMUP_RETRY_INTERVAL_SECONDS", "2"))
+upstream_warm = not warmup_enabled
+warmup_task: Optional[asyncio.Task] = None
+
+async def open_upstream_connection(warm_client: openai.AsyncOpenAI) -> None:
+    """One cheap upstream call; any HTTP answer (even 401/404) leaves a pooled connection behind"""
+    try:
+        await warm_client.models.list()
+    except openai.APIStatusError:
+        pass
+
+async def warm_up() -> None:
+    """Open connections until the upstream answers, retrying while it is unreachable"""
+    global upstream_warm
+    started = time.time()
+    warm_client = client.with_options(max_retries=0, timeout=warmup_timeout)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if shared_client:
+                await asyncio.to_thread(shared_client.execute, "PING")
+            await asyncio.gather(*(open_upstream_connection(warm_client) for _ in range(max(1, warmup_connections))))
+            upstream_warm = True
+            logger.info(f"Warm-up done in {time.time() - started:.2f}s ({warmup_connections} upstream connections, attempt {attempt})")
+            return
+        except Exception as e:
+            logger.warning(f"Warm-up attempt {attempt} failed, retrying in {warmup_retry_interval}s: {str(e)}")
+            await asyncio.sleep(warmup_retry_interval)
+
+@app.on_event("startup")
+async def start_warm_up():
+    """Warm upstream connections in the background; runs in each worker after fork"""
+    global warmup_task
+    if warmup_enabled:
+        warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    """Stop a warm-up that is still retrying"""
+    if warmup_task:
+        warmup_task.cancel()
+
+# Per-model circuit breakers for the primary/fallback path
+circuit_breakers = create_circuit_breakers()
+
+# Bounded upstream concurrency per persona and per model
+admission = create_admission_controller()
+
+# Server-side conversation state
+conversation_store = create_conversation_store(shared_client)
+history_max_messages = int(os.getenv("CONVERSATION_MAX_HISTORY_MESSAGES", "20"))
+history_max_chars = int(os.getenv("CONVERSATION_MAX_HISTORY_CHARS", "48000"))
+
+# Input token budget (personas override with "max_input_tokens"; 0 falls back to plain trimming).
+# Older turns over the budget are folded into a rolling summary that later turns reuse.
+context_max_input_tokens = int(os.getenv("CONTEXT_MAX_INPUT_TOKENS", "32000"))
+context_summary_model = os.getenv("CONTEXT_SUMMARY_MODEL", "")
+summary_cache = create_summary_cache()
+
+# Exact-match response cache (personas opt in with "cache_responses") and
+# coalescing of identical in-flight requests onto one upstream call
+response_cache = create_response_cache(shared_client)
+single_flight = SingleFlight()
+# Similarity-based answer cache for reworded questions (personas opt in with "semantic_cache")
+semantic_cache = create_semantic_cache(client)
+
+# Bulk runs through /v1/chat/batch; records let an interrupted batch resume
+batch_store = create_batch_store()
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "4"))
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+batch_max_retries = int(os.getenv("BATCH_MAX_RETRIES", "3"))
+
+# Recent generations by X-Request-ID, so a dropped connection resumes with Last-Event-ID
+# instead of starting (and paying for) a new upstream call
+replay_buffer = create_replay_buffer()
+# A generation whose client went away is cancelled (upstream call, fallback/hedge attempts and
+# admission slot) once no reader has reattached for this long; immediately without a replay buffer
+stream_cancel_grace = float(os.getenv("STREAM_CANCEL_GRACE_SECONDS", "5")) if replay_buffer else 0.0
+
+# Background jobs: long requests run in a bounded worker pool instead of holding the client's connection
+job_runner = create_job_runner(lambda job: run_chat_job(job), shared_client)
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Stop the background job workers"""
+    await job_runner.stop()
+
+# Tools come from each persona's tool_whitelist. The optional local pre-classifier skips web
+# search for requests that show no sign of needing it (WEB_SEARCH_CLASSIFIER)
+search_classifier = create_search_classifier()
+
+# Per-request model, reasoning effort and verbosity for personas with a "routing" config
+router = create_router()
+
+def prompt_cache_key(persona: Mapping[str, Any]) -> str:
+    """Per-persona prompt cache key; changes whenever the instructions change"""
+    return f"persona-{persona['id']}-{persona['sha256'][:16]}"
+
+def sse_frame(data: Dict[str, Any]) -> str:
+    """Serialize one streaming frame in the data: {...} format the frontend reads"""
+    return f"data: {json.dumps(data)}\n\n"
+
+def record_usage(request_id: str, persona_id: str, model: str, usage: Any) -> Optional[Dict[str, int]]:
+    """Record input, cached-input and output token counts from a completed response"""
+    if usage is None:
+        return None
+    input_tokens = getattr(usage, 'input_tokens', 0) or 0
+    output_tokens = getattr(usage, 'output_tokens', 0) or 0
+    cached_tokens = getattr(getattr(usage, 'input_tokens_details', None), 'cached_tokens', 0) or 0
+    metrics.input_tokens_total.inc(persona_id, model, amount=input_tokens)
+    metrics.cached_input_tokens_total.inc(persona_id, model, amount=cached_tokens)
+    metrics.output_tokens_total.inc(persona_id, model, amount=output_tokens)
+    logger.info(f"Request {request_id}: Usage - input: {input_tokens} (cached: {cached_tokens}), output: {output_tokens}")
+    return {'input_tokens': input_tokens, 'output_tokens': output_tokens}
+
+async def summarize_turns(request_id: str, persona: Mapping[str, Any], plan: Any, messages: List[Dict[str, Any]]) -> str:
+    """Fold older turns (and the previous rolling summary) into a new summary and cache it"""
+    started = time.time()
+    response = await client.responses.create(
+        model=context_summary_model or persona.get('fallback_model', 'gpt-4o'),
+        instructions=SUMMARY_INSTRUCTIONS,
+        input=summary_input(plan, messages),
+        store=False,
+        max_output_tokens=800
+    )
+    summary = response.output_text
+    tokens = token_estimator.calibrated(token_estimator.count_messages([summary_message(summary)]))
+    summary_cache.put(plan.prefix_hash, summary, tokens)
+    logger.info(f"Request {request_id}: Summarized messages {plan.summarize_from}-{plan.keep_from} into {tokens} tokens in {time.time() - started:.2f}s")
+    return summary
+
+async def replay_frames(frames: List[Dict[str, Any]]):
+    """Yield stored frames through the same async interface as a live upstream stream"""
+    for frame in frames:
+        yield frame
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -174,14 +394,18 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     bot_id: str  # Required field
     model: str = "gpt-5"
-    verbosity: str = "medium"  # low, medium, high
-    reasoning_effort: str = "medium"  # minimal, medium, high
+    verbosity: Optional[str] = None  # low, medium, high; overrides routing, "medium" when not routed
+    reasoning_effort: Optional[str] = None  # minimal, low, medium, high; overrides routing, "medium" when not routed
+    route: Optional[str] = None  # Force a routing tier (light, standard, deep) or "off"
     temperature: float = 0.7
     max_tokens: Optional[int] = None
     format_mode: Optional[str] = None  # "brief" for concise responses
     previous_response_id: Optional[str] = None  # For Responses API conversation state
+    conversation_id: Optional[str] = None  # Server-side conversation state key (returned in metadata)
     image_url: Optional[str] = None  # Optional single image URL for backward compatibility
     image_urls: Optional[List[str]] = None  # Optional array of image URLs for multiple images
+    background: bool = False  # Run as a background job and return its id right away
+    webhook_url: Optional[str] = None  # Background jobs: POST the finished job here
 
 class HealthResponse(BaseModel):
     status: str
@@ -217,19 +441,54 @@ async def health_check():
     """Health check endpoint"""
     return HealthResponse(status="ok")
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once personas are loaded and upstream connections are warm, 503 before"""
+    checks = {"personas": len(persona_cache) > 0, "upstream": upstream_warm}
+    ready = all(checks.values())
+    return Response(
+        content=json.dumps({"status": "ready" if ready else "starting", "checks": checks}),
+        status_code=200 if ready else 503,
+        media_type="application/json"
+    )
+
 @app.get("/logs")
-async def get_logs(lines: int = 50):
-    """Get recent logs for debugging"""
+async def get_logs(
+    http_request: Request,
+    lines: int = 50,
+    request_id: Optional[str] = None,
+    level: Optional[str] = None,
+    follow: bool = False
+):
+    """Get recent logs for debugging, optionally filtered by request id or minimum level.
+
+    With follow=true the matching tail is sent first and new lines are streamed as they are written.
+    Only the tail of the file is read, so total_lines is kept for existing clients but now equals
+    returned_lines rather than the length of the whole file.
+    """
+    path = logs.log_file_path
     try:
-        with open('app.log', 'r') as f:
-            all_lines = f.readlines()
-            recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-            return {"logs": recent_lines, "total_lines": len(all_lines)}
+        recent_lines = await asyncio.to_thread(logs.tail_lines, path, lines, request_id, level)
     except FileNotFoundError:
-        return {"logs": ["No log file found"], "total_lines": 0}
+        if not follow:
+            return {"logs": ["No log file found"], "returned_lines": 0, "total_lines": 0}
+        recent_lines = []
     except Exception as e:
         logger.error(f"Error reading logs: {str(e)}")
         return {"error": str(e)}
+    
+    if not follow:
+        return {"logs": recent_lines, "returned_lines": len(recent_lines), "total_lines": len(recent_lines)}
+    
+    async def stream_logs():
+        for line in recent_lines:
+            yield line + "\n"
+        async for line in logs.follow_lines(path, request_id, level):
+            if await http_request.is_disconnected():
+                break
+            yield line + "\n"
+    
+    return StreamingResponse(stream_logs(), media_type="text/plain", headers={"Cache-Control": "no-cache"})
 
 @app.post("/api/auth/verify", response_model=PasscodeResponse)
 async def verify_passcode(request: PasscodeRequest):
@@ -248,9 +507,12 @@ async def verify_passcode(request: PasscodeRequest):
 
 @app.post("/admin/reload-personas")
 async def reload_personas(token: str = Depends(verify_gateway_token)):
-    """Hot-reload personas from registry and instructions files"""
+    """Hot-reload personas from registry and instructions files (in every worker when a shared store is configured)"""
+    global persona_generation
     try:
-        load_personas()
+        await asyncio.to_thread(load_personas)
+        if shared_client:
+            persona_generation = str(await asyncio.to_thread(shared_client.incr, PERSONA_GENERATION_KEY)).encode()
         return {
             "status": "success",
             "message": f"Reloaded {len(persona_cache)} personas",
@@ -260,29 +522,40 @@ async def reload_personas(token: str = Depends(verify_gateway_token)):
         logger.error(f"Error reloading personas: {str(e)}")
         return {"status": "error", "message": str(e)}
 
-@app.post("/v1/chat")
-async def chat(
-    request: ChatRequest,
-    token: str = Depends(verify_gateway_token)
-):
-    """Chat endpoint using GPT-5 Response API with persona support"""
-    request_id = str(uuid.uuid4())
-    start_time = time.time()
-    
-    # Debug: Log the incoming request
-    logger.info(f"Request {request_id}: Received request - bot_id: {request.bot_id}, image_url: {request.image_url}, image_urls: {request.image_urls}, messages count: {len(request.messages) if request.messages else 0}")
-    logger.info(f"Request {request_id}: Raw incoming request body: {request.dict()}")
-    
-    # Validate bot_id and get persona
-    if request.bot_id not in persona_cache:
+@app.get("/admin/stats")
+async def admin_stats(token: str = Depends(verify_gateway_token)):
+    """Runtime counters for caches and conversation state"""
+    return {
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "circuit_breakers": circuit_breakers.stats(),
+        "admission": admission.stats(),
+        "context": {**summary_cache.stats(), "token_calibration": round(token_estimator.factor, 3)},
+        "images": image_pipeline.stats() if image_pipeline else None,
+        "web_search": search_classifier.stats(),
+        "routing": router.stats(),
+        "streams": replay_buffer.stats() if replay_buffer else None,
+        "jobs": job_runner.stats(),
+        "logging": {"dropped_records": log_queue_handler.dropped}
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text-format metrics"""
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def resolve_persona(request: ChatRequest, request_id: str) -> Mapping[str, Any]:
+    """Return the enabled persona for a request, or raise the 404/501 the client sees"""
+    # Validate bot_id and get persona (a single read, so a concurrent reload cannot split it)
+    persona = persona_cache.get(request.bot_id)
+    if persona is None:
         logger.warning(f"Request {request_id}: Unknown bot_id '{request.bot_id}' requested")
         raise HTTPException(
             status_code=404, 
             detail=f"Bot '{request.bot_id}' not found"
         )
     
-    persona = persona_cache[request.bot_id]
-    
     # Check if persona is enabled
     if not persona.get('enabled', False):
         logger.warning(f"Request {request_id}: Disabled bot_id '{request.bot_id}' requested")
@@ -290,229 +563,647 @@ async def chat(
             status_code=501, 
             detail="Bot not enabled"
         )
+    return persona
+
+class PreparedChat:
+    """Upstream request parameters and conversation state derived from one chat request"""
+
+    def __init__(self, response_params: Dict[str, Any], input_data: Any, chain: Optional[Dict[str, Any]],
+                 conversation_id: str, sent_images: List[str], summarized_messages: int,
+                 estimated_input_tokens: Optional[int], fallback_model: str, web_search: Optional[str] = None,
+                 routing: Optional[RouteDecision] = None):
+        self.response_params = response_params
+        self.input_data = input_data
+        self.chain = chain
+        self.conversation_id = conversation_id
+        self.sent_images = sent_images
+        self.summarized_messages = summarized_messages
+        self.estimated_input_tokens = estimated_input_tokens
+        self.fallback_model = fallback_model
+        self.web_search = web_search
+        self.routing = routing
+
+async def prepare_chat(request: ChatRequest, request_id: str, persona: Mapping[str, Any]) -> PreparedChat:
+    """Build the Responses API parameters for a chat request: history or chain, images, budget and persona settings"""
+    logger.info(f"Request {request_id}: Starting persona processing for bot_id: {request.bot_id}")
     
-    try:
-        logger.info(f"Request {request_id}: Starting persona processing for bot_id: {request.bot_id}")
-        
-        # Prepare input for OpenAI Response API
-        # For Responses API, we need to modify the latest user message to include images
-        # and pass the full conversation context
+    # Input token budget for the conversation, after the persona instructions
+    input_budget = persona.get('max_input_tokens', context_max_input_tokens)
+    instructions_tokens = persona.get('instructions_tokens') or token_estimator.count(persona['text'])
+    message_budget = max(0, input_budget - token_estimator.calibrated(instructions_tokens))
+    
+    # Get the latest user message
+    latest_message = request.messages[-1] if request.messages else None
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    
+    # Prepare input for OpenAI Response API
+    # When the previous response is a known, unexpired chain the upstream already holds the
+    # history, so only the new user turn is sent. Otherwise a history is rebuilt from the
+    # client's messages and the stale previous_response_id is dropped. A chain that would
+    # overflow the input budget is also dropped so its history can be compacted.
+    chain = None
+    if request.previous_response_id:
+        chain = await asyncio.to_thread(conversation_store.get, request.previous_response_id)
+        if chain and chain.get('persona_id') != request.bot_id:
+            chain = None
+        if not chain:
+            logger.info(f"Request {request_id}: previous_response_id {request.previous_response_id} unknown or expired, rebuilding history")
+        elif input_budget > 0 and messages and chain.get('context_tokens', 0) + token_estimator.calibrated(token_estimator.count_messages(messages[-1:])) > input_budget:
+            logger.info(f"Request {request_id}: Chain {request.previous_response_id} holds {chain['context_tokens']} tokens, over the {input_budget} token budget; compacting history")
+            chain = None
+    conversation_id = request.conversation_id or (chain['conversation_id'] if chain else None) or str(uuid.uuid4())
+    
+    # Every image URL of the conversation, de-duplicated in order
+    conversation_images = list(dict.fromkeys(request.image_urls or ([request.image_url] if request.image_url else [])))
+    sent_images = list(dict.fromkeys((chain.get('image_urls', []) if chain else []) + conversation_images))
+    
+    summarized_messages = 0
+    images_to_process = []
+    if not latest_message:
+        input_data = ""
+    else:
+        if chain:
+            input_data = messages[-1:]
+        elif input_budget > 0:
+            plan = plan_context(messages, message_budget, token_estimator, summary_cache)
+            summary = plan.summary
+            if plan.needs_summary:
+                try:
+                    summary = await summarize_turns(request_id, persona, plan, messages)
+                    metrics.context_summaries_total.inc(request.bot_id, 'created')
+                except Exception as e:
+                    logger.error(f"Request {request_id}: Summarizing history failed, trimming instead: {str(e)}")
+                    metrics.context_summaries_total.inc(request.bot_id, 'failed')
+            elif plan.keep_from:
+                metrics.context_summaries_total.inc(request.bot_id, 'reused')
+            if plan.keep_from == 0:
+                input_data = list(messages)
+            elif summary is not None:
+                summarized_messages = plan.keep_from
+                input_data = [summary_message(summary)] + messages[plan.keep_from:]
+            else:
+                input_data = trim_history(messages, history_max_messages, history_max_chars)
+        else:
+            input_data = trim_history(messages, history_max_messages, history_max_chars)
+        logger.info(f"Request {request_id}: Sending {len(input_data)} of {len(messages)} messages (chained: {bool(chain)}, summarized: {summarized_messages})")
         
-        # Get the latest user message
-        latest_message = request.messages[-1] if request.messages else None
-        if not latest_message:
-            input_data = ""
+        # If we have images, modify the latest user message to include them. The frontend
+        # sends every image of the conversation on each turn; a chained turn attaches only
+        # the ones the chain has not sent yet, a broken chain resends all of them.
+        if chain:
+            already_sent = set(chain.get('image_urls', []))
+            images_to_process = [url for url in conversation_images if url not in already_sent]
+            if len(images_to_process) < len(conversation_images):
+                logger.info(f"Request {request_id}: {len(conversation_images) - len(images_to_process)} images already sent in this conversation, attaching {len(images_to_process)} new")
         else:
-            # Start with the conversation messages
-            input_data = request.messages.copy()
+            images_to_process = conversation_images
+        
+        if images_to_process:
+            # Create multimodal content for the latest user message
+            if len(images_to_process) == 1:
+                image_prompt = f"I have provided 1 image for you to analyze. Please examine it and respond to my question: {latest_message.content}"
+            else:
+                image_prompt = f"I have provided {len(images_to_process)} images for you to analyze. Please examine ALL of them and respond to my question: {latest_message.content}. When referring to specific images, please number them (e.g., 'In the first image...', 'In the second image...', etc.)."
             
-            # If we have images, modify the latest user message to include them
-            images_to_process = []
-            if request.image_urls and len(request.image_urls) > 0:
-                images_to_process = request.image_urls
-            elif request.image_url:
-                images_to_process = [request.image_url]
+            content = [{"type": "input_text", "text": image_prompt}]
             
-            if images_to_process:
-                # Create multimodal content for the latest user message
-                if len(images_to_process) == 1:
-                    image_prompt = f"I have provided 1 image for you to analyze. Please examine it and respond to my question: {latest_message.content}"
-                else:
-                    image_prompt = f"I have provided {len(images_to_process)} images for you to analyze. Please examine ALL of them and respond to my question: {latest_message.content}. When referring to specific images, please number them (e.g., 'In the first image...', 'In the second image...', etc.)."
-                
-                content = [{"type": "input_text", "text": image_prompt}]
-                
-                # Add all images to the content
+            # Add all images to the content
+            if image_pipeline:
+                content.extend(await image_pipeline.prepare(images_to_process))
+            else:
                 for image_url in images_to_process:
                     content.append({"type": "input_image", "image_url": image_url})
-                
-                # Replace the latest message with multimodal content
-                input_data[-1] = {
-                    "role": "user",
-                    "content": content
-                }
-                
-                logger.info(f"Request {request_id}: Input data prepared with {len(images_to_process)} images, text length: {len(latest_message.content)}")
-                logger.info(f"Request {request_id}: Image URLs: {images_to_process}")
-                logger.info(f"Request {request_id}: Full input data: {input_data}")
-            else:
-                # Text-only input
-                logger.info(f"Request {request_id}: Input data prepared, length: {len(str(input_data))}")
-        
-        # Add format mode instruction if requested
-        if request.format_mode == "brief":
-            if isinstance(input_data, str):
-                input_data = f"For this answer only, keep to concise bullets (≤100 words).\n\n{input_data}"
-            else:
-                # Add system message for brief mode
-                input_data.insert(0, {"role": "system", "content": "For this answer only, keep to concise bullets (≤100 words)."})
-        
-        # Use persona model and settings
-        model_to_use = persona.get('model', request.model)
-        fallback_model = persona.get('fallback_model', 'gpt-4o')
-        # Prioritize request temperature over persona temperature for mode switching
-        # Ensure temperature is always a valid float between 0 and 2
-        if request.temperature is not None and request.temperature > 0:
-            temperature = request.temperature
+            
+            # Replace the latest message with multimodal content
+            input_data[-1] = {
+                "role": "user",
+                "content": content
+            }
+            
+            logger.info(f"Request {request_id}: Input data prepared with {len(images_to_process)} images, text length: {len(latest_message.content)}")
+            log_payload(logger, request_id, "Image URLs", images_to_process)
         else:
-            temperature = persona.get('temperature', 0.7)
-        
-        # Ensure temperature is within valid range
-        temperature = max(0.0, min(2.0, temperature))
-        max_tokens = persona.get('max_output_tokens', request.max_tokens)
-        
-        # Initialize model_to_use for error handling
+            # Text-only input
+            logger.info(f"Request {request_id}: Input data prepared, messages: {len(input_data)}")
+    
+    # Add format mode instruction if requested. It goes after the conversation so the
+    # cacheable prompt prefix (instructions, tools, earlier turns) is the same with or without it.
+    if request.format_mode == "brief":
+        if isinstance(input_data, str):
+            input_data = f"{input_data}\n\nFor this answer only, keep to concise bullets (≤100 words)."
+        else:
+            # Add system message for brief mode
+            input_data.append({"role": "system", "content": "For this answer only, keep to concise bullets (≤100 words)."})
+    
+    # Uncalibrated estimate of the full input; compared with the reported usage to calibrate
+    # the estimator. Chained requests are skipped because upstream adds the stored history.
+    estimated_input_tokens = None
+    if not chain and input_data:
+        estimated_input_tokens = instructions_tokens + token_estimator.count_messages(
+            [{"content": input_data}] if isinstance(input_data, str) else input_data)
+    
+    # Use persona model and settings; routed personas pick model, effort and verbosity per request
+    model_to_use = persona.get('model', request.model)
+    routing = router.route(persona, latest_message.content if latest_message else "", len(images_to_process),
+                           request.route, request.reasoning_effort, request.verbosity)
+    if routing:
+        model_to_use = routing.model
+        logger.info(f"Request {request_id}: Routed to {routing.tier} ({routing.reason}): {routing.model}, effort {routing.reasoning_effort}, verbosity {routing.verbosity}")
+    reasoning_effort = routing.reasoning_effort if routing else (request.reasoning_effort or "medium")
+    verbosity = routing.verbosity if routing else (request.verbosity or "medium")
+    fallback_model = persona.get('fallback_model', 'gpt-4o')
+    # Prioritize request temperature over persona temperature for mode switching
+    # Ensure temperature is always a valid float between 0 and 2
+    if request.temperature is not None and request.temperature > 0:
+        temperature = request.temperature
+    else:
+        temperature = persona.get('temperature', 0.7)
+    
+    # Ensure temperature is within valid range
+    temperature = max(0.0, min(2.0, temperature))
+    max_tokens = persona.get('max_output_tokens', request.max_tokens)
+    
+    logger.info(f"Request {request_id}: Processing chat with persona '{request.bot_id}' (v{persona['version']}) using model {model_to_use}, temperature: {temperature}, verbosity: {verbosity}")
+    
+    # Tools from the persona's whitelist. When the pre-classifier finds no sign that the
+    # question needs the web, search is switched off through tool_choice rather than by
+    # dropping the tool, so the tools in the cached prompt prefix stay the same.
+    tools = persona_tools(persona)
+    web_search = None
+    tool_choice = None
+    if has_web_search(tools):
+        web_search = 'enabled'
+        if latest_message and search_classifier.applies(persona):
+            needed, reason = search_classifier.needs_search(latest_message.content)
+            if needed:
+                logger.info(f"Request {request_id}: Web search enabled ({reason})")
+            else:
+                web_search = 'skipped'
+                saved = search_classifier.record_skip()
+                metrics.web_search_skipped_total.inc(request.bot_id)
+                metrics.web_search_saved_seconds_total.inc(request.bot_id, amount=saved)
+                other_tools = [tool for tool in tools if not has_web_search([tool])]
+                tool_choice = {"type": "allowed_tools", "mode": "auto", "tools": other_tools} if other_tools else "none"
+                logger.info(f"Request {request_id}: Web search skipped by pre-classifier (~{saved:.1f}s saved)")
+    
+    if routing and reasoning_effort == "minimal" and web_search == 'enabled':
+        # Web search is not available with minimal reasoning
+        reasoning_effort = routing.reasoning_effort = "low"
+    
+    # Prepare Response API parameters with persona instructions
+    response_params = {
+        "model": model_to_use,
+        "input": input_data,
+        "instructions": persona['text'],  # Full markdown content from persona instructions
+        "store": True,  # Store response for conversation state management
+        "text": {
+            "verbosity": verbosity
+        },
+        "metadata": {
+            "persona_id": request.bot_id,
+            "persona_version": persona['version']
+        }
+    }
+    if tools:
+        response_params["tools"] = tools
+    if tool_choice:
+        response_params["tool_choice"] = tool_choice
+    
+    # Only add reasoning parameters for models that support them (like gpt-5)
+    if supports_reasoning(model_to_use):
+        response_params["reasoning"] = {
+            "effort": reasoning_effort
+        }
+    
+    # Add previous_response_id for conversation state management; an id minted for a replayed
+    # answer maps to the upstream response that produced it
+    if chain:
+        response_params["previous_response_id"] = chain.get('upstream_response_id') or request.previous_response_id
+    
+    # Add temperature if specified and valid
+    if temperature is not None and temperature > 0:
+        response_params["temperature"] = temperature
+        logger.info(f"Request {request_id}: Added temperature {temperature} to response_params")
+    
+    # Sent through extra_body so older SDK versions without the parameter still work
+    response_params["extra_body"] = {"prompt_cache_key": prompt_cache_key(persona)}
+    
+    return PreparedChat(response_params, input_data, chain, conversation_id, sent_images,
+                        summarized_messages, estimated_input_tokens, fallback_model, web_search, routing)
+
+
+def request_fingerprint(request: ChatRequest) -> str:
+    """Hash of the request body; a resume is only served to a request identical to the original"""
+    return hashlib.sha256(json.dumps(jsonable_encoder(request), sort_keys=True).encode('utf-8')).hexdigest()
+
+def resume_chat(request: ChatRequest, http_request: Optional[Request]) -> Tuple[Optional[StreamingResponse], bool]:
+    """Continue a buffered generation for a reconnect carrying X-Request-ID and Last-Event-ID.
+
+    Returns the resumed response, or None and whether a resume was asked for but not possible.
+    The replay buffer is per worker process: a reconnect routed to another worker misses.
+    """
+    if not replay_buffer or http_request is None:
+        return None, False
+    stream_id = http_request.headers.get("X-Request-ID")
+    last_event_id = http_request.headers.get("Last-Event-ID")
+    if not stream_id or last_event_id is None:
+        return None, False
+    stream = replay_buffer.resume(stream_id, request_fingerprint(request))
+    if stream is None:
+        logger.warning(f"Request {stream_id}: Nothing buffered to resume on worker {os.getpid()} (expired, different body, "
+                       f"or routed to another worker), starting a new generation")
+        metrics.stream_resumes_total.inc(request.bot_id, 'missed')
+        return None, True
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        last_event_id = 0
+    logger.info(f"Request {stream_id}: Resuming after event {last_event_id} ({len(stream.frames)} buffered, {'finished' if stream.done else 'in progress'})")
+    metrics.stream_resumes_total.inc(request.bot_id, 'resumed')
+    return ClosingStreamingResponse(
+        stream.events_after(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Request-ID": stream_id, "X-Stream-Resumed": "true"}
+    ), False
+
+@app.post("/v1/chat")
+async def chat(
+    request: ChatRequest,
+    token: str = Depends(verify_gateway_token),
+    http_request: Request = None
+):
+    """Chat endpoint using GPT-5 Response API with persona support.
+
+    Frames carry event ids. A reconnect that repeats the request with the original X-Request-ID
+    and a Last-Event-ID header resumes from the replay buffer without a new upstream call; when
+    nothing is buffered, a new generation answers with X-Stream-Resumed: false and a new id.
+    With "background": true the request is queued as a job and 202 with the job id is returned.
+    """
+    if request.background:
+        return await submit_job(request)
+    resumed, resume_missed = resume_chat(request, http_request)
+    if resumed is not None:
+        return resumed
+    request_id = str(uuid.uuid4())
+    start_time = time.time()
+    
+    # Debug: Log the incoming request
+    image_count = len(request.image_urls or []) or (1 if request.image_url else 0)
+    logger.info(f"Request {request_id}: Received request - bot_id: {request.bot_id}, images: {image_count}, messages count: {len(request.messages) if request.messages else 0}")
+    log_payload(logger, request_id, "Raw incoming request body", request.dict)
+    
+    persona = resolve_persona(request, request_id)
+    
+    try:
+        prepared = await prepare_chat(request, request_id, persona)
+        response_params = prepared.response_params
+        input_data = prepared.input_data
+        chain = prepared.chain
+        conversation_id = prepared.conversation_id
+        sent_images = prepared.sent_images
+        summarized_messages = prepared.summarized_messages
+        estimated_input_tokens = prepared.estimated_input_tokens
+        model_to_use = response_params["model"]
+        fallback_model = prepared.fallback_model
+        web_search = prepared.web_search
+        routing = prepared.routing
         final_model_used = model_to_use
         
-        logger.info(f"Request {request_id}: Processing chat with persona '{request.bot_id}' (v{persona['version']}) using model {model_to_use}, temperature: {temperature}, verbosity: {request.verbosity}")
+        # Exact-match response cache, opt-in per persona. The key includes the persona hash,
+        # so reloading changed instructions invalidates old entries automatically.
+        cache_key = None
+        if persona.get('cache_responses', False) and response_cache.enabled and input_data:
+            cache_key = make_cache_key(persona['sha256'], response_params)
+        # A shared cache is a socket round trip away; a store error reads as a miss
+        cached = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
         
-        # Prepare Response API parameters with persona instructions
-        response_params = {
-            "model": model_to_use,
-            "input": input_data,
-            "instructions": persona['text'],  # Full markdown content from persona instructions
-            "tools": [{"type": "web_search"}],  # Enable web search
-            "store": True,  # Store response for conversation state management
-            "text": {
-                "verbosity": request.verbosity
-            },
-            "metadata": {
-                "persona_id": request.bot_id,
-                "persona_version": persona['version']
-            }
-        }
+        # Semantic cache, opt-in per persona: a question close enough to one answered before gets
+        # that answer. Only a first turn without images qualifies; later answers depend on the history.
+        semantic_probe = None
+        if (not cached and semantic_cache.applies(persona) and len(request.messages) == 1
+                and not image_count and not response_params.get('previous_response_id')):
+            semantic_probe = await semantic_cache.lookup(persona, request.messages[-1].content, semantic_scope(response_params))
+            if semantic_probe is None:
+                metrics.semantic_cache_lookups_total.inc(request.bot_id, 'error')
+            elif semantic_probe.value:
+                cached = semantic_probe.value
+                metrics.semantic_cache_lookups_total.inc(request.bot_id, 'hit')
+            else:
+                metrics.semantic_cache_lookups_total.inc(request.bot_id, 'miss')
         
-        # Only add reasoning parameters for models that support them (like gpt-5)
-        if model_to_use == "gpt-5":
-            response_params["reasoning"] = {
-                "effort": request.reasoning_effort
-            }
+        # An identical upstream call already running is followed without a slot of its own
+        flight = single_flight.follow(cache_key) if cache_key and not cached else None
+        leader = False
         
-        # Add previous_response_id for conversation state management
-        if request.previous_response_id:
-            response_params["previous_response_id"] = request.previous_response_id
+        # Admission control - only requests that will start an upstream call need a slot.
+        # Saturation is reported right away with Retry-After instead of failing slowly upstream.
+        permit = None
+        if not cached and flight is None:
+            try:
+                permit = await admission.acquire(request.bot_id, model_to_use, persona.get('max_concurrency'))
+            except AdmissionRejected as e:
+                logger.warning(f"Request {request_id}: Rejected by admission control ({e.status_code}): {e.reason}")
+                metrics.rejections_total.inc(request.bot_id, str(e.status_code))
+                raise HTTPException(
+                    status_code=e.status_code,
+                    detail=e.reason,
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            metrics.queue_wait_seconds.observe(permit.queue_wait, request.bot_id, model_to_use)
+            if permit.queue_wait > 0:
+                logger.info(f"Request {request_id}: Admitted after {permit.queue_wait:.2f}s in queue")
         
-        # Add temperature if specified and valid
-        if temperature is not None and temperature > 0:
-            response_params["temperature"] = temperature
-            logger.info(f"Request {request_id}: Added temperature {temperature} to response_params")
+        response_id = None
+        context_tokens = None
+        first_token_latency = None
+        output_chars = 0
         
-        # Create streaming response (simulated since Response API doesn't support streaming yet)
-        async def generate_response():
-            nonlocal final_model_used
-            # Use the variables from the outer scope
+        async def upstream_frames():
+            """Call the Responses API (with model fallback) and yield frames as stream events arrive"""
+            nonlocal final_model_used, response_id, context_tokens
             current_model = model_to_use
             current_fallback = fallback_model
-            current_temperature = temperature
-            current_max_tokens = max_tokens
+            upstream_first_token = None
+            searches_started: Dict[str, float] = {}
+            # Tool calls (web search included) add their results to the reported input tokens
+            used_tools = False
+            
+            # Make the API call - the primary model first, then the fallback. Models with an open
+            # circuit are skipped, and personas with hedge_after_seconds race the fallback against
+            # a primary that is slow to produce its first token.
+            log_payload(logger, request_id, "OpenAI request params (instructions omitted)",
+                        lambda: {key: value for key, value in response_params.items() if key != 'instructions'})
+            attempts = [(current_model, response_params)]
+            if current_model != current_fallback:
+                fallback_params = response_params.copy()
+                fallback_params["model"] = current_fallback
+                # Remove reasoning parameters for fallback model if it doesn't support them
+                if not supports_reasoning(current_fallback) and "reasoning" in fallback_params:
+                    del fallback_params["reasoning"]
+                attempts.append((current_fallback, fallback_params))
+            upstream_started = time.time()
             try:
-                # Make the API call - try Response API with primary model first
-                logger.info(f"Request {request_id}: About to call OpenAI with params: {response_params}")
-                logger.info(f"Request {request_id}: Full input data being sent to OpenAI: {input_data}")
-                try:
-                    response = client.responses.create(**response_params)
-                    final_model_used = current_model
-                except (AttributeError, Exception) as e:
-                    # Try fallback model within Responses API if primary model fails
-                    if current_model != current_fallback:
-                        logger.warning(f"Primary model {current_model} failed ({str(e)}), trying fallback model {current_fallback} within Responses API")
-                        try:
-                            fallback_params = response_params.copy()
-                            fallback_params["model"] = current_fallback
-                            # Remove reasoning parameters for fallback model if it doesn't support them
-                            if current_fallback != "gpt-5" and "reasoning" in fallback_params:
-                                del fallback_params["reasoning"]
-                            response = client.responses.create(**fallback_params)
-                            current_model = current_fallback  # Update for logging
-                            final_model_used = current_fallback  # Update final model
-                            logger.info(f"Successfully used fallback model {current_fallback} within Responses API")
-                        except Exception as e2:
-                            logger.error(f"Both primary model {current_model} and fallback model {current_fallback} failed in Responses API: {str(e2)}")
-                            raise e2
-                    else:
-                        logger.error(f"Responses API failed for {current_model} and no fallback model available: {str(e)}")
-                        raise e
+                stream = await open_with_fallback(
+                    client.responses.create,
+                    attempts,
+                    circuit_breakers,
+                    hedge_after=persona.get('hedge_after_seconds'),
+                    log_prefix=f"Request {request_id}: "
+                )
+            except Exception as e:
+                logger.error(f"Request {request_id}: All models failed in Responses API ({[model for model, _ in attempts]}): {str(e)}")
+                if permit and isinstance(e, openai.RateLimitError):
+                    permit.observe(throttled=True)
+                raise
+            if permit:
+                permit.observe(latency=stream.first_token_latency)
+            current_model = stream.model
+            final_model_used = current_model
+            if current_model != model_to_use:
+                logger.info(f"Request {request_id}: Using fallback model {current_model} within Responses API")
+                metrics.fallbacks_total.inc(request.bot_id, model_to_use, current_model)
+            if stream.first_event_latency is not None:
+                metrics.upstream_ttfb_seconds.observe(stream.first_event_latency, request.bot_id, current_model)
+            
+            # Forward stream events into the data frames the frontend already understands.
+            # The stream is closed on every exit, so a cancelled request drops its upstream connection.
+            try:
+                async for event in stream:
+                    event_type = getattr(event, 'type', None)
+                    if event_type and "_call" in event_type:
+                        used_tools = True
                 
-                # Extract the output text
-                output_text = ""
-                reasoning_summary = None
+                    if event_type == "response.output_text.delta":
+                        if not event.delta:
+                            continue
+                        if upstream_first_token is None:
+                            upstream_first_token = time.time() - start_time
+                            logger.info(f"Request {request_id}: First token after {upstream_first_token:.2f}s from model {current_model}")
+                        yield {'content': event.delta}
+                    elif event_type == "response.web_search_call.in_progress":
+                        # Timed by arrival from upstream: events buffered while priming are replayed back to back
+                        searches_started[getattr(event, 'item_id', '')] = stream.received_at
+                    elif event_type == "response.web_search_call.completed":
+                        search_started = searches_started.pop(getattr(event, 'item_id', ''), None)
+                        if search_started is not None:
+                            search_seconds = stream.received_at - search_started
+                            search_classifier.observe_search(search_seconds)
+                            metrics.web_search_seconds.observe(search_seconds, request.bot_id)
+                    elif event_type == "response.reasoning_summary_text.delta":
+                        yield {'reasoning_summary_delta': event.delta}
+                    elif event_type == "response.reasoning_summary_text.done":
+                        yield {'reasoning_summary': event.text}
+                    elif event_type in ("response.created", "response.completed"):
+                        response_id = getattr(event.response, 'id', None) or response_id
+                        if event_type == "response.completed":
+                            usage = record_usage(request_id, request.bot_id, current_model, getattr(event.response, 'usage', None))
+                            if usage:
+                                # Size of the conversation held upstream once this response is stored
+                                context_tokens = usage['input_tokens'] + usage['output_tokens']
+                                # Only a response without tool calls measures the estimate; tool results
+                                # and tool-loop re-input would inflate the calibration factor
+                                if estimated_input_tokens and not used_tools:
+                                    token_estimator.observe(estimated_input_tokens, usage['input_tokens'])
+                    elif event_type in ("response.failed", "response.incomplete"):
+                        details = getattr(event.response, 'error', None) or getattr(event.response, 'incomplete_details', None)
+                        raise RuntimeError(f"Response {event_type.split('.')[-1]}: {details}")
+                    elif event_type == "error":
+                        raise RuntimeError(getattr(event, 'message', 'Unknown streaming error'))
+            finally:
+                await stream.close()
+            metrics.upstream_duration_seconds.observe(time.time() - upstream_started, request.bot_id, current_model)
+        
+        async def cached_upstream_frames():
+            """Run the upstream call and store the completed answer in the response cache"""
+            frames = []
+            async for frame in upstream_frames():
+                frames.append(frame)
+                yield frame
+            if any(frame.get('content') for frame in frames):
+                await asyncio.to_thread(response_cache.put, cache_key, {
+                    'frames': frames,
+                    'model': final_model_used,
+                    'response_id': response_id,
+                    'context_tokens': context_tokens
+                }, persona.get('cache_ttl_seconds'))
+        
+        # Create streaming response - events from the Responses API are forwarded as they arrive
+        async def generate_response():
+            nonlocal final_model_used, response_id, context_tokens, first_token_latency, output_chars
+            cache_status = None
+            first_frame_at = None
+            bytes_streamed = 0
+            metrics.in_flight.inc(request.bot_id)
+            try:
+                if cached:
+                    # Replay the cached answer through the same frame format
+                    cache_status = 'semantic' if semantic_probe and semantic_probe.value else 'hit'
+                    final_model_used = cached['model']
+                    response_id = cached['response_id']
+                    context_tokens = cached.get('context_tokens')
+                    frames = replay_frames(cached['frames'])
+                    if cache_status == 'semantic':
+                        logger.info(f"Request {request_id}: Served from semantic cache (similarity {semantic_probe.similarity:.3f})")
+                    else:
+                        logger.info(f"Request {request_id}: Served from response cache")
+                elif flight:
+                    # Identical in-flight requests share one upstream call
+                    cache_status = 'miss' if leader else 'coalesced'
+                    if not leader:
+                        logger.info(f"Request {request_id}: Joined in-flight upstream call ({len(flight.frames)} frames already produced)")
+                    frames = flight.subscribe()
+                else:
+                    frames = upstream_frames()
                 
-                # Debug: Log response structure
-                logger.debug(f"Request {request_id}: Response type: {type(response)}")
-                logger.debug(f"Request {request_id}: Response attributes: {dir(response)}")
+                answer_frames = []
+                async for frame in frames:
+                    if 'content' in frame:
+                        if first_token_latency is None:
+                            first_token_latency = time.time() - start_time
+                        output_chars += len(frame['content'])
+                    if semantic_probe and not cached:
+                        answer_frames.append(frame)
+                    if first_frame_at is None:
+                        first_frame_at = time.time()
+                    chunk = sse_frame(frame)
+                    bytes_streamed += len(chunk)
+                    yield chunk
                 
-                # Handle both Response API and MockResponse formats
-                if hasattr(response, 'output_text'):
-                    # Direct access to output_text (MockResponse)
-                    output_text = response.output_text or ""
-                    logger.info(f"Request {request_id}: Raw response text (MockResponse): {output_text[:200]}...")
-                elif hasattr(response, 'output') and response.output:
-                    # Response API format
-                    for item in response.output:
-                        if hasattr(item, "content") and item.content:
-                            for content in item.content:
-                                if hasattr(content, "text") and content.text:
-                                    output_text += content.text
-                        elif hasattr(item, "summary") and item.summary:
-                            reasoning_summary = item.summary[0].text if item.summary else None
-                    logger.info(f"Request {request_id}: Raw response text (Response API): {output_text[:200]}...")
-                    logger.info(f"Request {request_id}: Full raw response from OpenAI: {response}")
-                else:
-                    logger.error(f"Request {request_id}: No valid output found in response")
-                    output_text = "Sorry, I couldn't generate a response. Please try again."
+                if cache_status in ('miss', 'coalesced'):
+                    final_model_used = flight.result.get('model', final_model_used)
+                    response_id = flight.result.get('response_id')
+                    context_tokens = flight.result.get('context_tokens')
                 
-                # Simulate streaming by sending chunks
-                chunk_size = 50
-                for i in range(0, len(output_text), chunk_size):
-                    chunk = output_text[i:i + chunk_size]
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
-                    await asyncio.sleep(0.01)  # Small delay to simulate streaming
+                if semantic_probe and not cached and output_chars:
+                    await asyncio.to_thread(semantic_cache.put, persona, semantic_probe, {
+                        'frames': answer_frames,
+                        'model': final_model_used,
+                        'response_id': response_id,
+                        'context_tokens': context_tokens
+                    }, persona.get('cache_ttl_seconds'))
                 
-                # Send reasoning summary if available
-                if reasoning_summary:
-                    yield f"data: {json.dumps({'reasoning_summary': reasoning_summary})}\n\n"
+                if output_chars == 0:
+                    logger.error(f"Request {request_id}: No output text received in stream")
+                    yield sse_frame({'content': 'Sorry, I could not generate a response. Please try again.'})
                 
                 # Send response metadata
                 metadata = {
                     'persona_id': request.bot_id,
                     'persona_version': persona['version'],
                     'model': final_model_used,
-                    'instructions_sha256': persona['sha256']
+                    'instructions_sha256': persona['sha256'],
+                    'conversation_id': conversation_id
                 }
-                logger.info(f"Request {request_id}: Sending response back to frontend - output_text length: {len(output_text)}, metadata: {metadata}")
+                if cache_status:
+                    metadata['cache'] = cache_status
+                if cache_status == 'semantic':
+                    metadata['semantic_similarity'] = round(semantic_probe.similarity, 4)
+                if summarized_messages:
+                    metadata['summarized_messages'] = summarized_messages
+                if web_search:
+                    metadata['web_search'] = web_search
+                if routing:
+                    metadata['routing'] = routing.as_metadata()
+                if resume_missed:
+                    metadata['resume'] = 'missed'
                 
-                # Extract response_id from Responses API for conversation state
-                response_id = None
-                if hasattr(response, 'id'):
-                    response_id = response.id
+                # Response id from the stream is used by the frontend for conversation state.
+                # A replayed or shared answer gets an id of its own, so this conversation's record
+                # does not overwrite the record of the conversation that produced the answer
+                upstream_response_id = response_id
+                if response_id and cache_status in ('hit', 'semantic', 'coalesced'):
+                    response_id = f"resp_replay_{uuid.uuid4().hex}"
+                if response_id:
                     metadata['response_id'] = response_id
                     logger.info(f"Request {request_id}: Extracted response_id: {response_id}")
+                    await asyncio.to_thread(conversation_store.put, {
+                        'response_id': response_id,
+                        'conversation_id': conversation_id,
+                        'persona_id': request.bot_id,
+                        'previous_response_id': response_params.get('previous_response_id'),
+                        'upstream_response_id': upstream_response_id,
+                        'model': final_model_used,
+                        'context_tokens': context_tokens or 0,
+                        'image_urls': sent_images
+                    })
                 else:
-                    logger.warning(f"Request {request_id}: No response.id found in response object")
+                    logger.warning(f"Request {request_id}: No response id found in stream events")
                 
-                yield f"data: {json.dumps({'metadata': metadata})}\n\n"
+                yield sse_frame({'metadata': metadata})
                 
                 # Send completion signal
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                yield sse_frame({'done': True})
+                
+                # Log request completion - time to first token is the latency users actually feel
+                latency = time.time() - start_time
+                metrics.request_duration_seconds.observe(latency, request.bot_id, final_model_used)
+                metrics.stream_duration_seconds.observe(time.time() - (first_frame_at or start_time), request.bot_id, final_model_used)
+                metrics.requests_total.inc(request.bot_id, final_model_used, cache_status or 'none')
+                if routing:
+                    metrics.routed_requests_total.inc(request.bot_id, routing.tier, final_model_used)
+                    if cache_status not in ('hit', 'semantic'):
+                        router.observe(request.bot_id, routing.tier, latency, routing.probe)
+                ttft = f"{first_token_latency:.2f}s" if first_token_latency is not None else "n/a"
+                logger.info(f"Request {request_id}: Completed - TTFT: {ttft}, total: {latency:.2f}s, output_chars: {output_chars} - Persona: {request.bot_id} (v{persona['version']}), Model: {final_model_used}, SHA256: {persona['sha256'][:8]}...")
                 
+            except asyncio.CancelledError:
+                # The client went away; the upstream stream and any pending fallback attempt are closed on the way out
+                logger.info(f"Request {request_id}: Cancelled after {time.time() - start_time:.2f}s, output_chars: {output_chars}")
+                metrics.cancellations_total.inc(request.bot_id, final_model_used)
+                raise
             except Exception as e:
                 logger.error(f"Request {request_id}: OpenAI API error: {str(e)}", exc_info=True)
                 logger.error(f"Request {request_id}: Request details - Model: {request.model}, Messages: {len(request.messages)}")
-                yield f"data: {json.dumps({'error': f'Service error: {str(e)}'})}\n\n"
+                metrics.errors_total.inc(request.bot_id, type(e).__name__)
+                yield sse_frame({'error': f'Service error: {str(e)}'})
+            finally:
+                metrics.in_flight.dec(request.bot_id)
+                metrics.bytes_streamed_total.inc(request.bot_id, amount=bytes_streamed)
+                if request_permit:
+                    request_permit.release()
         
-        # Log request completion
-        latency = time.time() - start_time
-        logger.info(f"Request {request_id}: Completed in {latency:.2f}s - Persona: {request.bot_id} (v{persona['version']}), Model: {final_model_used}, SHA256: {persona['sha256'][:8]}...")
+        # Only a request holding a slot starts a shared upstream call, and the slot then belongs to
+        # that call: it keeps running for followers after the leader's client is gone. A request
+        # that finds the call started by someone else while it queued follows it and frees its slot.
+        request_permit = permit
+        if cache_key and not cached and flight is None:
+            flight, leader = single_flight.join(
+                cache_key,
+                cached_upstream_frames,
+                lambda: {'model': final_model_used, 'response_id': response_id, 'context_tokens': context_tokens}
+            )
+            request_permit = None
+            if leader:
+                flight.task.add_done_callback(lambda task: permit.release())
+            else:
+                permit.release()
         
-        return StreamingResponse(
-            generate_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Request-ID": request_id
-            }
-        )
+        # The generation runs in its own task and fills the buffer; this response and any
+        # resumed ones read from it, and it is cancelled when all of them are gone
+        if replay_buffer:
+            stream = replay_buffer.open(request_id, request_fingerprint(request), stream_cancel_grace)
+        else:
+            stream = ReplayStream(request_id, request_fingerprint(request), stream_cancel_grace)
+        stream.start(generate_response())
+        if request_permit:
+            # The slot is held for as long as the generation task runs, including the grace period
+            # after a disconnect; releasing is idempotent, and this covers a task cancelled before it started
+            stream.task.add_done_callback(lambda task: request_permit.release())
+        if leader:
+            def drop_unread_flight(task: asyncio.Task) -> None:
+                # A leader whose generation ended before it subscribed, with no followers, would
+                # otherwise leave the shared call running unread
+                if not flight.subscribers and not flight.done:
+                    flight.task.cancel()
+            stream.task.add_done_callback(drop_unread_flight)
+        headers = {
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Request-ID": request_id
+        }
+        if resume_missed:
+            headers["X-Stream-Resumed"] = "false"
+        return ClosingStreamingResponse(stream.events_after(), media_type="text/event-stream", headers=headers)
         
     except HTTPException:
         raise
@@ -520,6 +1211,291 @@ async def chat(
         logger.error(f"Request {request_id}: Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+async def collect_chat(request: ChatRequest, on_frame: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Run one request through /v1/chat and gather its streamed frames into a single result"""
+    response = await chat(request, token=None)
+    content = []
+    result: Dict[str, Any] = {'status': 'ok'}
+    try:
+        async for chunk in response.body_iterator:
+            for line in chunk.splitlines():
+                if not line.startswith("data: "):
+                    continue
+                frame = json.loads(line[6:])
+                if on_frame:
+                    on_frame(frame)
+                if 'content' in frame:
+                    content.append(frame['content'])
+                elif 'reasoning_summary' in frame:
+                    result['reasoning_summary'] = frame['reasoning_summary']
+                elif 'metadata' in frame:
+                    result['metadata'] = frame['metadata']
+                elif 'error' in frame:
+                    result = {'status': 'error', 'error': frame['error'], 'status_code': 502}
+    finally:
+        if response.background:
+            await response.background()
+    if result['status'] == 'ok':
+        result['content'] = "".join(content)
+    return result
+
+async def run_batch_item(item: BatchItem) -> Dict[str, Any]:
+    """Run one batch line through the chat pipeline, waiting out admission rejections"""
+    if item.error:
+        return item_error(item, item.error, 400)
+    try:
+        request = ChatRequest(**item.payload)
+    except ValidationError as e:
+        return item_error(item, str(e), 422)
+    for attempt in range(batch_max_retries + 1):
+        try:
+            result = await collect_chat(request)
+        except HTTPException as e:
+            if e.status_code in (429, 503) and attempt < batch_max_retries:
+                await asyncio.sleep(float((e.headers or {}).get("Retry-After", 1)))
+                continue
+            return item_error(item, str(e.detail), e.status_code)
+        return {'index': item.index, 'custom_id': item.custom_id, **result}
+
+async def submit_job(request: ChatRequest) -> JSONResponse:
+    """Queue a background request and answer 202 with its job id (unknown personas still fail here)"""
+    job_id = str(uuid.uuid4())
+    resolve_persona(request, job_id)
+    if request.webhook_url:
+        try:
+            await job_runner.check_webhook(request.webhook_url)
+        except UnsafeURLError as e:
+            raise HTTPException(status_code=400, detail=f"webhook_url is not allowed: {str(e)}")
+    # The job runs the same request in the foreground pipeline
+    job_request = ChatRequest(**{**jsonable_encoder(request), 'background': False, 'webhook_url': None})
+    job = Job(job_id, request.bot_id, job_request, request.webhook_url)
+    try:
+        await job_runner.submit(job)
+    except JobQueueFull as e:
+        logger.warning(f"Job {job_id}: Rejected, {str(e)}")
+        metrics.jobs_total.inc(request.bot_id, 'rejected')
+        raise HTTPException(status_code=503, detail="Job queue is full", headers={"Retry-After": "30"})
+    metrics.jobs_total.inc(request.bot_id, 'queued')
+    logger.info(f"Job {job_id}: Queued - bot_id: {request.bot_id}, webhook: {'yes' if request.webhook_url else 'no'}")
+    return JSONResponse(
+        status_code=202,
+        content={
+            'job_id': job_id,
+            'status': job.status,
+            'status_url': f"/v1/jobs/{job_id}",
+            'events_url': f"/v1/jobs/{job_id}/events"
+        },
+        headers={"Location": f"/v1/jobs/{job_id}"}
+    )
+
+async def run_chat_job(job: Job) -> Dict[str, Any]:
+    """Run a background request, copying its frames to the job stream and waiting out admission rejections"""
+    def on_frame(frame: Dict[str, Any]) -> None:
+        job.stream.append(sse_frame(frame))
+
+    metrics.job_queue_wait_seconds.observe(job.started_at - job.created_at, job.persona_id)
+    for attempt in range(job_runner.max_retries + 1):
+        try:
+            result = await collect_chat(job.request, on_frame)
+            break
+        except HTTPException as e:
+            if e.status_code in (429, 503) and attempt < job_runner.max_retries:
+                await asyncio.sleep(float((e.headers or {}).get("Retry-After", 1)))
+                continue
+            on_frame({'error': str(e.detail)})
+            result = {'status': 'error', 'error': str(e.detail), 'status_code': e.status_code}
+            break
+    metrics.jobs_total.inc(job.persona_id, 'completed' if result['status'] == 'ok' else 'failed')
+    return result
+
+async def submit_deferred_batch(record: Dict[str, Any], items: List[BatchItem]) -> None:
+    """Hand the pending items to the upstream Batch API, which runs them offline at a lower price"""
+    lines = []
+    for item in items:
+        try:
+            if item.error:
+                raise ValueError(item.error)
+            request = ChatRequest(**item.payload)
+            request_id = f"{record['batch_id']}-{item.index}"
+            prepared = await prepare_chat(request, request_id, resolve_persona(request, request_id))
+        except HTTPException as e:
+            batch_store.record_result(record['batch_id'], item_error(item, str(e.detail), e.status_code))
+            continue
+        except (ValueError, ValidationError) as e:
+            batch_store.record_result(record['batch_id'], item_error(item, str(e), 400))
+            continue
+        body = {key: value for key, value in prepared.response_params.items() if key != 'extra_body'}
+        body.update(prepared.response_params.get('extra_body', {}))
+        lines.append({"custom_id": str(item.index), "method": "POST", "url": "/v1/responses", "body": body})
+    record['custom_ids'] = {item.index: item.custom_id for item in items}
+    if not lines:
+        record['status'] = 'completed'
+        return
+    data = "".join(json.dumps(line) + "\n" for line in lines).encode('utf-8')
+    upload = await client.files.create(file=(f"{record['batch_id']}.jsonl", data, "application/jsonl"), purpose="batch")
+    job = await client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+        metadata={"batch_id": record['batch_id']}
+    )
+    record['upstream_batch_id'] = job.id
+    record['status'] = 'submitted'
+    logger.info(f"Batch {record['batch_id']}: Submitted {len(lines)} items as upstream batch {job.id}")
+
+async def refresh_deferred_batch(record: Dict[str, Any]) -> None:
+    """Poll the upstream batch and store its results once it has finished"""
+    if record['status'] != 'submitted':
+        return
+    job = await client.batches.retrieve(record['upstream_batch_id'])
+    if job.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        record['upstream_status'] = job.status
+        return
+    for file_id in (job.output_file_id, job.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            index = int(entry['custom_id'])
+            item = BatchItem(index, record['custom_ids'].get(index, str(index)))
+            response = entry.get('response') or {}
+            body = response.get('body') or {}
+            if response.get('status_code') == 200:
+                batch_store.record_result(record['batch_id'], {
+                    'index': index,
+                    'custom_id': item.custom_id,
+                    'status': 'ok',
+                    'content': response_output_text(body),
+                    'metadata': {'model': body.get('model'), 'response_id': body.get('id')}
+                })
+            else:
+                error = entry.get('error') or body.get('error') or 'Upstream batch item failed'
+                batch_store.record_result(record['batch_id'], item_error(item, json.dumps(error) if not isinstance(error, str) else error, response.get('status_code')))
+    record['status'] = 'completed' if job.status == 'completed' else job.status
+    logger.info(f"Batch {record['batch_id']}: Upstream batch {job.id} finished with status {job.status}")
+
+@app.post("/v1/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    batch_id: Optional[str] = None,
+    mode: str = "stream",
+    concurrency: Optional[int] = None,
+    token: str = Depends(verify_gateway_token)
+):
+    """Run a JSONL list of chat requests and stream one NDJSON result per item as each finishes.
+
+    Passing the batch_id of an earlier call with the same body resumes it: finished items are
+    replayed and only the rest run. mode=deferred submits the items to the upstream Batch API
+    instead; poll GET /v1/chat/batch/{batch_id} for the results.
+    """
+    items, digest = parse_batch(await http_request.body())
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch body must contain at least one JSON line")
+    if mode not in ("stream", "deferred"):
+        raise HTTPException(status_code=400, detail="mode must be 'stream' or 'deferred'")
+    
+    record = batch_store.get(batch_id) if batch_id else None
+    if record is not None:
+        if record['digest'] != digest or record['mode'] != mode:
+            raise HTTPException(status_code=409, detail=f"Batch '{batch_id}' exists with different items or mode")
+        if record['status'] == 'running' and record.get('active'):
+            raise HTTPException(status_code=409, detail=f"Batch '{batch_id}' is still running")
+    else:
+        record = batch_store.create(batch_id or str(uuid.uuid4()), digest, len(items), mode)
+    batch_id = record['batch_id']
+    
+    # Successful items are kept on resume; failed ones are retried
+    pending = [item for item in items if record['results'].get(item.index, {}).get('status') != 'ok']
+    logger.info(f"Batch {batch_id}: {len(items)} items, {len(pending)} to run, mode: {mode}")
+    
+    if mode == "deferred":
+        if record['status'] == 'running':
+            try:
+                await submit_deferred_batch(record, pending)
+            except Exception as e:
+                logger.error(f"Batch {batch_id}: Submitting to the upstream Batch API failed: {str(e)}")
+                raise HTTPException(status_code=502, detail="Could not submit the deferred batch")
+        return batch_store.summary(record)
+    
+    limit = max(1, min(concurrency or batch_concurrency, batch_max_concurrency))
+    
+    async def stream_results():
+        record['active'] = True
+        record['status'] = 'running'
+        try:
+            yield json.dumps({'batch_id': batch_id, 'items': len(items), 'resumed': len(items) - len(pending)}) + "\n"
+            for index in sorted(record['results']):
+                if record['results'][index]['status'] == 'ok':
+                    yield json.dumps(record['results'][index]) + "\n"
+            async for result in run_batch(pending, run_batch_item, limit):
+                batch_store.record_result(batch_id, result)
+                yield json.dumps(result) + "\n"
+            record['status'] = 'completed'
+            yield json.dumps({'done': True, **batch_store.summary(record)}) + "\n"
+        finally:
+            record['active'] = False
+    
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Batch-ID": batch_id}
+    )
+
+@app.get("/v1/chat/batch/{batch_id}")
+async def chat_batch_status(batch_id: str, results: bool = True, token: str = Depends(verify_gateway_token)):
+    """Progress of a batch, with its stored results; deferred batches are refreshed from upstream"""
+    record = batch_store.get(batch_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+    if record['mode'] == 'deferred':
+        try:
+            await refresh_deferred_batch(record)
+        except Exception as e:
+            logger.error(f"Batch {batch_id}: Polling upstream batch failed: {str(e)}")
+    status = batch_store.summary(record)
+    if results:
+        status['results'] = [record['results'][index] for index in sorted(record['results'])]
+    return status
+
+@app.get("/v1/jobs/{job_id}")
+async def job_status(job_id: str, token: str = Depends(verify_gateway_token)):
+    """Status of a background job, with its result (content, reasoning_summary, metadata) once finished"""
+    try:
+        status = await asyncio.to_thread(job_runner.store.status, job_id)
+    except SharedStoreError:
+        raise HTTPException(status_code=503, detail="Job status is temporarily unavailable", headers={"Retry-After": "5"})
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return status
+
+@app.get("/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request, token: str = Depends(verify_gateway_token)):
+    """Attach to a background job: the /v1/chat frames it has produced so far, then live ones until it ends.
+
+    Detaching does not affect the job. A Last-Event-ID header skips the frames already received.
+    """
+    job = job_runner.store.get(job_id)
+    if job is None:
+        try:
+            elsewhere = await asyncio.to_thread(job_runner.store.status, job_id)
+        except SharedStoreError:
+            elsewhere = None
+        if elsewhere is not None:
+            raise HTTPException(status_code=409, detail=f"Job '{job_id}' runs on another worker; poll GET /v1/jobs/{job_id} instead")
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    try:
+        last_event_id = int(http_request.headers.get("Last-Event-ID", "0"))
+    except ValueError:
+        last_event_id = 0
+    return ClosingStreamingResponse(
+        job.stream.events_after(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Job-ID": job_id}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,170 @@
+import bisect
+import asyncio
+from typing import Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds, wide enough for long gpt-5 reasoning calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Event loop lag is normally well under a millisecond; anything in the upper buckets stalls every stream
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with labels; inc() is a dict update, nothing more"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. requests in flight"""
+
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels in the Prometheus exposition format"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Ordered set of metrics rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+queue_wait_seconds = registry.register(Histogram(
+    "chat_queue_wait_seconds", "Time spent waiting for an admission slot", ("persona", "model")))
+upstream_ttfb_seconds = registry.register(Histogram(
+    "chat_upstream_ttfb_seconds", "Time from the upstream call to its first stream event", ("persona", "model")))
+upstream_duration_seconds = registry.register(Histogram(
+    "chat_upstream_duration_seconds", "Time from the upstream call to the end of its stream", ("persona", "model")))
+stream_duration_seconds = registry.register(Histogram(
+    "chat_stream_duration_seconds", "Time from the first frame sent to the client to the done frame", ("persona", "model")))
+request_duration_seconds = registry.register(Histogram(
+    "chat_request_duration_seconds", "End-to-end /v1/chat time until the done frame", ("persona", "model")))
+requests_total = registry.register(Counter(
+    "chat_requests_total", "Completed chat requests by cache outcome", ("persona", "model", "cache")))
+fallbacks_total = registry.register(Counter(
+    "chat_fallbacks_total", "Requests served by the fallback model", ("persona", "primary", "fallback")))
+errors_total = registry.register(Counter(
+    "chat_errors_total", "Chat errors by exception type", ("persona", "type")))
+rejections_total = registry.register(Counter(
+    "chat_rejections_total", "Requests rejected by admission control", ("persona", "status")))
+in_flight = registry.register(Gauge(
+    "chat_requests_in_flight", "Chat responses currently streaming", ("persona",)))
+bytes_streamed_total = registry.register(Counter(
+    "chat_bytes_streamed_total", "Bytes of frames streamed to clients", ("persona",)))
+input_tokens_total = registry.register(Counter(
+    "chat_input_tokens_total", "Upstream input tokens", ("persona", "model")))
+cached_input_tokens_total = registry.register(Counter(
+    "chat_cached_input_tokens_total", "Upstream input tokens served from the prompt cache", ("persona", "model")))
+output_tokens_total = registry.register(Counter(
+    "chat_output_tokens_total", "Upstream output tokens", ("persona", "model")))
+context_summaries_total = registry.register(Counter(
+    "chat_context_summaries_total", "History compactions by outcome (created, reused, failed)", ("persona", "outcome")))
+routed_requests_total = registry.register(Counter(
+    "chat_routed_requests_total", "Completed requests by routing tier", ("persona", "tier", "model")))
+web_search_seconds = registry.register(Histogram(
+    "chat_web_search_seconds", "Time spent in upstream web search calls", ("persona",)))
+web_search_skipped_total = registry.register(Counter(
+    "chat_web_search_skipped_total", "Requests answered without web search by the pre-classifier", ("persona",)))
+web_search_saved_seconds_total = registry.register(Counter(
+    "chat_web_search_saved_seconds_total", "Estimated latency saved by skipped web searches", ("persona",)))
+cancellations_total = registry.register(Counter(
+    "chat_cancellations_total", "Generations cancelled because the client disconnected", ("persona", "model")))
+stream_resumes_total = registry.register(Counter(
+    "chat_stream_resumes_total", "Reconnects with Last-Event-ID by outcome (resumed, missed)", ("persona", "outcome")))
+semantic_cache_lookups_total = registry.register(Counter(
+    "chat_semantic_cache_lookups_total", "Semantic cache lookups by outcome (hit, miss, error)", ("persona", "outcome")))
+jobs_total = registry.register(Counter(
+    "chat_jobs_total", "Background jobs by outcome (queued, rejected, completed, failed)", ("persona", "outcome")))
+job_queue_wait_seconds = registry.register(Histogram(
+    "chat_job_queue_wait_seconds", "Time background jobs waited for a worker", ("persona",)))
+event_loop_lag_seconds = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a periodic timer", (), LAG_BUCKETS))
+
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """Sleep for interval in a loop and record how much later than requested each wake-up came"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
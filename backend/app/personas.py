@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(__file__)
+
+PersonaSnapshot = Mapping[str, Mapping[str, Any]]
+
+BUNDLE_FORMAT = 1
+DEFAULT_BUNDLE_PATH = os.path.join(APP_DIR, "..", "config", "personas.bundle.json")
+
+
+def registry_candidates() -> List[str]:
+    """Locations probed for the persona registry, in priority order"""
+    return [
+        os.path.join(APP_DIR, "..", "config", "personas.registry.json"),
+        os.path.join(os.getcwd(), "config", "personas.registry.json"),
+        os.path.join(os.getcwd(), "backend", "config", "personas.registry.json"),
+        "config/personas.registry.json",
+        "backend/config/personas.registry.json"
+    ]
+
+
+def instruction_candidates(instructions_path: str) -> List[str]:
+    """Locations probed for a persona instructions file, in priority order"""
+    return [
+        os.path.join(APP_DIR, "..", instructions_path),
+        os.path.join(os.getcwd(), instructions_path),
+        os.path.join(os.getcwd(), "backend", instructions_path),
+        instructions_path
+    ]
+
+
+def _first_existing(candidates: List[str]) -> Optional[str]:
+    for path in candidates:
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return None
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PersonaLoader:
+    """Builds immutable persona snapshots, re-reading only files whose mtime/size or hash changed.
+
+    Resolved paths and file contents are remembered between loads, so a reload with nothing
+    changed costs one stat() per file. With a token_counter, each persona's instruction token
+    count is computed once per file change and kept in the snapshot as instructions_tokens.
+    """
+
+    def __init__(self, token_counter: Optional[Callable[[str], int]] = None):
+        self.token_counter = token_counter
+        self.registry_path: Optional[str] = None
+        self._resolved: Dict[str, str] = {}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._from_bundle = False
+        self._lock = threading.Lock()
+
+    def load(self, previous: Optional[PersonaSnapshot] = None) -> PersonaSnapshot:
+        """Return a new snapshot; personas that fail to load keep their previous version"""
+        with self._lock:
+            previous = previous or {}
+            registry_path = self._resolve_registry()
+            registry_file = self._read(registry_path)
+            registry = json.loads(registry_file['text'])
+            logger.info(f"Loading {len(registry['personas'])} personas from registry")
+
+            personas: Dict[str, Mapping[str, Any]] = {}
+            changed = 0
+            for persona in registry['personas']:
+                persona_id = persona['id']
+                try:
+                    path = self._resolve_instructions(persona_id, persona['instructions_path'])
+                    instructions = self._read(path)
+                except Exception as e:
+                    logger.error(f"Error loading persona '{persona_id}': {str(e)}")
+                    if persona_id in previous:
+                        personas[persona_id] = previous[persona_id]
+                    continue
+
+                entry = {
+                    'text': instructions['text'],
+                    'sha256': instructions['sha256'],
+                    'instructions_tokens': instructions.get('tokens'),
+                    **persona  # Include all registry fields
+                }
+                old_entry = previous.get(persona_id)
+                if old_entry is not None and dict(old_entry) == entry:
+                    personas[persona_id] = old_entry
+                    continue
+                personas[persona_id] = MappingProxyType(entry)
+                changed += 1
+                logger.info(f"Loaded persona '{persona_id}' (v{persona['version']}) - SHA256: {entry['sha256'][:8]}...")
+
+            logger.info(f"Successfully loaded {len(personas)} personas ({changed} changed)")
+            self._from_bundle = False
+            return MappingProxyType(personas)
+
+    def load_bundle(self, path: str) -> PersonaSnapshot:
+        """Return the snapshot stored in a bundle written by build_bundle, in a single file read.
+
+        Entries are identical to the ones load() builds, so the first reload from the source
+        files afterwards keeps every unchanged persona.
+        """
+        with self._lock:
+            with open(path, 'rb') as f:
+                bundle = json.loads(f.read())
+            if bundle.get('format') != BUNDLE_FORMAT:
+                raise ValueError(f"Unsupported persona bundle format: {bundle.get('format')}")
+            personas = {persona_id: MappingProxyType(entry) for persona_id, entry in bundle['personas'].items()}
+            self._from_bundle = True
+            logger.info(f"Loaded {len(personas)} personas from bundle {path} (built {bundle.get('built_at')})")
+            return MappingProxyType(personas)
+
+    def changed(self) -> bool:
+        """Whether the registry or any instructions file changed since the last load.
+
+        After a bundle load the source files have not been compared yet, so this is True
+        until the next load().
+        """
+        with self._lock:
+            if self._from_bundle:
+                return True
+            for path, cached in self._files.items():
+                try:
+                    if _file_signature(path) != cached['signature']:
+                        return True
+                except FileNotFoundError:
+                    return True
+            return False
+
+    def _resolve_registry(self) -> str:
+        if self.registry_path and os.path.exists(self.registry_path):
+            return self.registry_path
+        candidates = registry_candidates()
+        self.registry_path = _first_existing(candidates)
+        if not self.registry_path:
+            logger.error(f"Current working directory: {os.getcwd()}")
+            raise FileNotFoundError(f"Persona registry not found in any of these locations: {candidates}")
+        return self.registry_path
+
+    def _resolve_instructions(self, persona_id: str, instructions_path: str) -> str:
+        resolved = self._resolved.get(instructions_path)
+        if resolved and os.path.exists(resolved):
+            return resolved
+        candidates = instruction_candidates(instructions_path)
+        resolved = _first_existing(candidates)
+        if not resolved:
+            raise FileNotFoundError(f"Instructions file not found for persona '{persona_id}' in any of these locations: {candidates}")
+        self._resolved[instructions_path] = resolved
+        return resolved
+
+    def _read(self, path: str) -> Dict[str, Any]:
+        """Return the cached file entry, re-reading and re-hashing only if the file changed"""
+        signature = _file_signature(path)
+        cached = self._files.get(path)
+        if cached and cached['signature'] == signature:
+            return cached
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        sha256 = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        entry = {'signature': signature, 'text': text, 'sha256': sha256}
+        if self.token_counter:
+            entry['tokens'] = self.token_counter(text)
+        self._files[path] = entry
+        return entry
+
+
+def build_bundle(loader: PersonaLoader, output: str) -> Dict[str, Any]:
+    """Load the registry and every instructions file and write them as one precompiled bundle"""
+    snapshot = loader.load()
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'built_at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'personas': {persona_id: dict(entry) for persona_id, entry in snapshot.items()}
+    }
+    temporary = f"{output}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(bundle, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temporary, output)
+    logger.info(f"Wrote {len(snapshot)} personas to {output}")
+    return bundle
+
+
+async def watch_personas(loader: PersonaLoader, reload: Callable[[], Any], interval: float) -> None:
+    """Poll the registry and instructions files and call reload when any of them changes"""
+    logger.info(f"Watching persona files every {interval}s")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await asyncio.to_thread(loader.changed):
+                logger.info("Persona files changed, reloading")
+                await asyncio.to_thread(reload)
+        except Exception as e:
+            logger.error(f"Persona watcher error: {str(e)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Persona registry tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Write the registry and instructions into a single bundle file")
+    build.add_argument("--output", default=os.getenv("PERSONA_BUNDLE") or DEFAULT_BUNDLE_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from app.context import create_token_estimator
+
+    try:
+        bundle = build_bundle(PersonaLoader(token_counter=create_token_estimator().count), args.output)
+    except Exception as e:
+        logger.error(f"Could not build the persona bundle: {str(e)}")
+        sys.exit(1)
+    print(f"{os.path.abspath(args.output)}: {', '.join(bundle['personas'])}")
+
+
+if __name__ == "__main__":
+    main()
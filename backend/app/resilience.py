@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Per-model breaker that opens after repeated errors or first-token SLO violations"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, latency_slo: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_slo = latency_slo
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a request may be sent to this model now (half-open allows one probe at a time)"""
+        now = time.time()
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and now - self.opened_at < self.reset_timeout:
+            return False
+        if self.state == 'half_open' and now - self.probe_started_at < self.reset_timeout:
+            return False
+        self.state = 'half_open'
+        self.probe_started_at = now
+        return True
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        if self.latency_slo and latency is not None and latency > self.latency_slo:
+            logger.warning(f"Circuit {self.name}: first token after {latency:.2f}s exceeds SLO {self.latency_slo}s")
+            self.record_failure()
+            return
+        self.consecutive_failures = 0
+        if self.state != 'closed':
+            logger.info(f"Circuit {self.name}: closed")
+        self.state = 'closed'
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.times_opened += 1
+                logger.warning(f"Circuit {self.name}: opened after {self.consecutive_failures} consecutive failures")
+            self.state = 'open'
+            self.opened_at = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened
+        }
+
+
+class CircuitBreakers:
+    """Lazily created circuit breakers, one per model"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, latency_slo: Optional[float]):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_slo = latency_slo
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model, self.failure_threshold, self.reset_timeout, self.latency_slo)
+        return self._breakers[model]
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: breaker.stats() for model, breaker in self._breakers.items()}
+
+
+def create_circuit_breakers() -> CircuitBreakers:
+    """Create the breaker registry configured through environment variables"""
+    failure_threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    reset_timeout = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+    latency_slo = float(os.getenv("CIRCUIT_TTFT_SLO_SECONDS", "0")) or None
+    logger.info(f"Circuit breakers: failure_threshold={failure_threshold}, reset={reset_timeout}s, ttft_slo={latency_slo}")
+    return CircuitBreakers(failure_threshold, reset_timeout, latency_slo)
+
+
+# Events that carry content for the client; a stream is primed, and the fallback decided, on the
+# first of these, and only the lifecycle events before it are buffered
+CONTENT_EVENTS = ("response.output_text.delta", "response.reasoning_summary_text.delta")
+
+
+class PrimedStream:
+    """An upstream stream that has been read up to its first content delta (output text or reasoning summary).
+
+    The buffered events are replayed back to back, so received_at holds the time the event
+    last yielded actually arrived from upstream; use it to time anything between events.
+    """
+
+    def __init__(self, stream: Any, buffered: List[Any], model: str,
+                 first_token_latency: Optional[float], first_event_latency: Optional[float] = None,
+                 arrivals: Optional[List[float]] = None):
+        self.stream = stream
+        self.buffered = buffered
+        self.model = model
+        self.first_token_latency = first_token_latency
+        self.first_event_latency = first_event_latency
+        self.arrivals = arrivals if arrivals is not None else [time.time()] * len(buffered)
+        self.received_at: Optional[float] = None
+
+    async def __aiter__(self):
+        for event, received_at in zip(self.buffered, self.arrivals):
+            self.received_at = received_at
+            yield event
+        if self.first_token_latency is None:
+            return  # The stream ended before producing content
+        async for event in self.stream:
+            self.received_at = time.time()
+            yield event
+
+    async def close(self) -> None:
+        await close_stream(self.stream)
+
+
+async def close_stream(stream: Any) -> None:
+    """Close an upstream stream, releasing its HTTP connection before the response is complete"""
+    close = getattr(stream, 'close', None)
+    if close:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+async def open_stream(create: Callable[..., Awaitable[Any]], model: str, params: Dict[str, Any]) -> PrimedStream:
+    """Open a stream and wait for its first content delta, raising if the response fails before it"""
+    start = time.time()
+    stream = await create(**params, stream=True)
+    buffered = []
+    arrivals = []
+    first_event_latency = None
+    try:
+        async for event in stream:
+            arrivals.append(time.time())
+            if first_event_latency is None:
+                first_event_latency = arrivals[-1] - start
+            buffered.append(event)
+            event_type = getattr(event, 'type', None)
+            if event_type in CONTENT_EVENTS and event.delta:
+                return PrimedStream(stream, buffered, model, arrivals[-1] - start, first_event_latency, arrivals)
+            if event_type in ("response.failed", "error"):
+                details = getattr(getattr(event, 'response', None), 'error', None) or getattr(event, 'message', None)
+                raise RuntimeError(f"Model {model} failed before first token: {details}")
+    except BaseException:
+        # Cancelled (client gone, or a losing hedge) or failed: do not leave the response open
+        await close_stream(stream)
+        raise
+    return PrimedStream(stream, buffered, model, None, first_event_latency, arrivals)
+
+
+async def _cancel(task: asyncio.Task) -> None:
+    """Cancel a losing attempt and close its stream if it had already opened"""
+    if not task.done():
+        task.cancel()
+    try:
+        primed = await task
+        await primed.close()
+    except BaseException:
+        pass
+
+
+async def open_with_fallback(
+    create: Callable[..., Awaitable[Any]],
+    attempts: List[Tuple[str, Dict[str, Any]]],
+    breakers: CircuitBreakers,
+    hedge_after: Optional[float] = None,
+    log_prefix: str = ""
+) -> PrimedStream:
+    """Open the first healthy stream from (model, params) attempts in priority order.
+
+    Attempts whose breaker is open are skipped while another is available. Without hedging, a
+    failed attempt falls through to the next one. With hedge_after set, the next attempt is also
+    started when the current one has not produced a first token within that many seconds; the
+    first to produce a token wins and the other is cancelled.
+    """
+    pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+    remaining = list(attempts)
+    last_error: Optional[BaseException] = None
+
+    def launch(model: str, params: Dict[str, Any]) -> None:
+        task = asyncio.create_task(open_stream(create, model, params))
+        pending[task] = (model, time.time())
+
+    def start_next() -> bool:
+        # A breaker is only asked when its attempt would start: allow() takes the half-open
+        # probe slot, which an attempt that never runs would hold until the reset timeout
+        skipped = []
+        while remaining:
+            model, params = remaining.pop(0)
+            if not breakers.get(model).allow():
+                skipped.append(model)
+                continue
+            if skipped:
+                logger.warning(f"{log_prefix}Circuit open for {skipped}, routing to {model}")
+            launch(model, params)
+            return True
+        return False
+
+    if not start_next():
+        # Every circuit is open: try the first model rather than failing without a request
+        launch(*attempts[0])
+    try:
+        while pending:
+            timeout = hedge_after if (hedge_after is not None and remaining) else None
+            done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.warning(f"{log_prefix}No first token within {hedge_after}s, hedging with {remaining[0][0]}")
+                start_next()
+                continue
+            for task in done:
+                model, started = pending.pop(task)
+                breaker = breakers.get(model)
+                try:
+                    primed = task.result()
+                except Exception as e:
+                    breaker.record_failure()
+                    last_error = e
+                    logger.warning(f"{log_prefix}Model {model} failed: {str(e)}")
+                    if remaining and not pending:
+                        start_next()
+                    continue
+                breaker.record_success(primed.first_token_latency)
+                for loser, (loser_model, loser_started) in list(pending.items()):
+                    pending.pop(loser)
+                    logger.info(f"{log_prefix}Cancelling hedged attempt on {loser_model}")
+                    if breakers.get(loser_model).latency_slo and time.time() - loser_started > breakers.get(loser_model).latency_slo:
+                        breakers.get(loser_model).record_failure()
+                    await _cancel(loser)
+                return primed
+    finally:
+        for task in pending:
+            await _cancel(task)
+    raise last_error or RuntimeError("No model attempts available")
@@ -0,0 +1,203 @@
+import os
+import re
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIER_ORDER = ("light", "standard", "deep")
+
+# Tier settings; a persona's "routing.tiers" entries are merged over these and a tier without
+# a model uses the persona's model. The standard tier matches the unrouted default ("medium"),
+# so opting a persona in never lowers the effort of an ordinary question
+DEFAULT_TIERS: Dict[str, Dict[str, str]] = {
+    "light": {"reasoning_effort": "minimal", "verbosity": "low"},
+    "standard": {"reasoning_effort": "medium", "verbosity": "medium"},
+    "deep": {"reasoning_effort": "high", "verbosity": "medium"}
+}
+
+ACKNOWLEDGEMENT = re.compile(
+    r"^\W*(thanks?( you| a lot| so much)?|thx|ty|ok(ay)?|great|cool|nice|perfect|awesome|got it|sounds good|"
+    r"hi|hello|hey|good (morning|afternoon|evening)|takk( fyrir)?|frábært|flott|hæ|halló)\W*$",
+    re.IGNORECASE
+)
+# Explicit requests for planning or analysis; everyday marketing words ("campaign", "plan", "why")
+# appear in most questions to a marketing persona and say nothing about their depth
+DEEP_QUESTION = re.compile(
+    r"\b(go-to-market|gtm|roadmap|swot|trade-?offs?|step[- ]by[- ]step|compare|comparison|competitive analysis|"
+    r"analy[sz]e|prioriti[sz]e|audit|(marketing|communications?|brand|content|launch|media) (strategy|plan)|"
+    r"(strategy|plan) for)\b",
+    re.IGNORECASE
+)
+
+
+def supports_reasoning(model: str) -> bool:
+    """Whether the model takes reasoning parameters (the gpt-5 family and o-series)"""
+    return model.startswith("gpt-5") or bool(re.match(r"o\d", model))
+
+
+class RouteDecision:
+    """Model, reasoning effort and verbosity chosen for one request, and why"""
+
+    def __init__(self, tier: str, reason: str, model: str, reasoning_effort: str, verbosity: str):
+        self.tier = tier
+        self.reason = reason
+        self.model = model
+        self.reasoning_effort = reasoning_effort
+        self.verbosity = verbosity
+        self.overrides: List[str] = []
+        self.downgraded_from: Optional[str] = None
+        self.probe = False
+
+    def as_metadata(self) -> Dict[str, Any]:
+        metadata = {
+            'tier': self.tier,
+            'reason': self.reason,
+            'model': self.model,
+            'reasoning_effort': self.reasoning_effort,
+            'verbosity': self.verbosity
+        }
+        if self.overrides:
+            metadata['overrides'] = self.overrides
+        if self.downgraded_from:
+            metadata['downgraded_from'] = self.downgraded_from
+        if self.probe:
+            metadata['probe'] = True
+        return metadata
+
+
+class Router:
+    """Picks a tier per request from cheap local features of the input and the persona's latency SLO.
+
+    Personas opt in with a "routing" object in the registry:
+    light_max_chars, deep_min_chars, latency_slo_seconds and per-tier overrides under "tiers".
+    When a tier's observed end-to-end latency for the persona is above the SLO, the next
+    lighter tier is used instead. A skipped tier gets no new observations, so once every
+    probe_interval seconds (persona "probe_interval_seconds") one request is let through to it
+    as a probe and its latency refreshes the average.
+    """
+
+    def __init__(self, enabled: bool = True, smoothing: float = 0.2, probe_interval: float = 60.0):
+        self.enabled = enabled
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self._latency: Dict[Tuple[str, str], float] = {}
+        self._checked_at: Dict[Tuple[str, str], float] = {}
+        self.decisions: Dict[str, int] = {tier: 0 for tier in TIER_ORDER}
+        self.downgrades = 0
+        self.probes = 0
+        self._lock = threading.Lock()
+
+    def tiers(self, persona: Mapping[str, Any]) -> Dict[str, Dict[str, str]]:
+        configured = (persona.get('routing') or {}).get('tiers') or {}
+        return {tier: {**DEFAULT_TIERS[tier], **configured.get(tier, {})} for tier in TIER_ORDER}
+
+    def classify(self, config: Mapping[str, Any], text: str, images: int) -> Tuple[str, str]:
+        """Tier and reason from message length, images and the kind of question"""
+        text = (text or "").strip()
+        if not images and ACKNOWLEDGEMENT.match(text):
+            return "light", "acknowledgement"
+        if DEEP_QUESTION.search(text):
+            return "deep", "complex_question"
+        if len(text) >= config.get('deep_min_chars', 800):
+            return "deep", "long_input"
+        if images:
+            return "standard", "images"
+        if len(text) <= config.get('light_max_chars', 60) and "?" not in text:
+            return "light", "short_input"
+        return "standard", "default"
+
+    def route(
+        self,
+        persona: Mapping[str, Any],
+        text: str,
+        images: int = 0,
+        forced_tier: Optional[str] = None,
+        reasoning_effort: Optional[str] = None,
+        verbosity: Optional[str] = None
+    ) -> Optional[RouteDecision]:
+        """Decision for a request, or None when the persona is not routed.
+
+        forced_tier picks a tier directly; explicit reasoning_effort and verbosity from the
+        request win over the tier's values.
+        """
+        config = persona.get('routing')
+        if not self.enabled or not config or forced_tier == "off":
+            return None
+        tiers = self.tiers(persona)
+        if forced_tier in tiers:
+            tier, reason = forced_tier, "forced"
+        else:
+            tier, reason = self.classify(config, text, images)
+
+        downgraded_from = None
+        probe = False
+        slo = config.get('latency_slo_seconds')
+        if slo and reason != "forced":
+            probe_interval = config.get('probe_interval_seconds', self.probe_interval)
+            now = time.time()
+            index = TIER_ORDER.index(tier)
+            with self._lock:
+                while index > 0 and self._latency.get((persona['id'], TIER_ORDER[index]), 0) > slo:
+                    key = (persona['id'], TIER_ORDER[index])
+                    if now - self._checked_at.get(key, 0) >= probe_interval:
+                        # Stale average: send this request to the slow tier to measure it again
+                        self._checked_at[key] = now
+                        probe = True
+                        break
+                    downgraded_from = downgraded_from or tier
+                    index -= 1
+            tier = TIER_ORDER[index]
+
+        settings = tiers[tier]
+        decision = RouteDecision(tier, reason, settings.get('model') or persona.get('model', 'gpt-5'),
+                                 settings['reasoning_effort'], settings['verbosity'])
+        decision.downgraded_from = downgraded_from
+        decision.probe = probe
+        if reasoning_effort and reasoning_effort != decision.reasoning_effort:
+            decision.reasoning_effort = reasoning_effort
+            decision.overrides.append('reasoning_effort')
+        if verbosity and verbosity != decision.verbosity:
+            decision.verbosity = verbosity
+            decision.overrides.append('verbosity')
+        with self._lock:
+            self.decisions[tier] += 1
+            if downgraded_from:
+                self.downgrades += 1
+            if probe:
+                self.probes += 1
+        return decision
+
+    def observe(self, persona_id: str, tier: str, seconds: float, probe: bool = False) -> None:
+        """Fold one end-to-end latency into the persona's average for the tier.
+
+        A probe's latency replaces the average, which only held stale measurements.
+        """
+        key = (persona_id, tier)
+        with self._lock:
+            previous = self._latency.get(key)
+            if previous is None or probe:
+                self._latency[key] = seconds
+            else:
+                self._latency[key] = (1 - self.smoothing) * previous + self.smoothing * seconds
+            self._checked_at[key] = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'decisions': dict(self.decisions),
+                'downgrades': self.downgrades,
+                'probes': self.probes,
+                'latency_seconds': {f"{persona}:{tier}": round(value, 3) for (persona, tier), value in self._latency.items()}
+            }
+
+
+def create_router() -> Router:
+    """Create the router configured through environment variables (ROUTING_ENABLED=false turns it off)"""
+    enabled = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+    probe_interval = float(os.getenv("ROUTING_PROBE_INTERVAL_SECONDS", "60"))
+    logger.info(f"Model routing: {'enabled for personas with a routing config' if enabled else 'disabled'}")
+    return Router(enabled, probe_interval=probe_interval)
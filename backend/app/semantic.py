@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+_numpy: Any = False  # Imported on first use; without NumPy the index falls back to plain Python
+
+logger = logging.getLogger(__name__)
+
+
+def numpy() -> Any:
+    """The numpy module, or None when NumPy is not installed"""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else list(vector)
+
+
+class HashingEmbedder:
+    """Deterministic local embedder: hashed word and character trigram features, L2-normalized.
+
+    Catches rewordings that share most of their words; used in tests and when no embedding
+    model should be called.
+    """
+
+    name = "local"
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    async def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            features = [(word, 1.0)]
+            padded = f" {word} "
+            features += [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+            for feature, weight in features:
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dimensions
+                vector[bucket] += weight if digest[4] & 1 else -weight
+        return normalize(vector)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the upstream embeddings endpoint"""
+
+    name = "openai"
+
+    def __init__(self, client: Any, model: str = "text-embedding-3-small", dimensions: Optional[int] = None):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+
+    async def embed(self, text: str) -> List[float]:
+        params: Dict[str, Any] = {'model': self.model, 'input': text}
+        if self.dimensions:
+            params['dimensions'] = self.dimensions
+        response = await self.client.embeddings.create(**params)
+        return normalize(response.data[0].embedding)
+
+
+class VectorIndex:
+    """Unit vectors searched by cosine similarity; one matrix product with NumPy, a plain loop without"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._rows: List[List[float]] = []
+        self._matrix: Any = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, entry_id: str, vector: Sequence[float]) -> None:
+        np = numpy()
+        if np is not None:
+            if self._matrix is None:
+                self._matrix = np.zeros((16, len(vector)), dtype=np.float32)
+            elif len(self.ids) == len(self._matrix):
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._matrix[len(self.ids)] = vector
+        else:
+            self._rows.append(list(vector))
+        self._positions[entry_id] = len(self.ids)
+        self.ids.append(entry_id)
+
+    def remove(self, entry_id: str) -> None:
+        """Drop a vector by moving the last one into its slot"""
+        position = self._positions.pop(entry_id)
+        last = len(self.ids) - 1
+        if position != last:
+            moved = self.ids[last]
+            self.ids[position] = moved
+            self._positions[moved] = position
+            if self._matrix is not None:
+                self._matrix[position] = self._matrix[last]
+            else:
+                self._rows[position] = self._rows[last]
+        self.ids.pop()
+        if self._matrix is None:
+            self._rows.pop()
+
+    def search(self, vector: Sequence[float], threshold: float) -> List[Tuple[str, float]]:
+        """Ids with similarity of at least threshold, most similar first"""
+        if not self.ids:
+            return []
+        if self._matrix is not None:
+            np = numpy()
+            scores = self._matrix[:len(self.ids)] @ np.asarray(vector, dtype=np.float32)
+            found = [(self.ids[i], float(scores[i])) for i in np.flatnonzero(scores >= threshold)]
+        else:
+            found = []
+            for entry_id, row in zip(self.ids, self._rows):
+                score = sum(a * b for a, b in zip(row, vector))
+                if score >= threshold:
+                    found.append((entry_id, score))
+        return sorted(found, key=lambda item: item[1], reverse=True)
+
+
+def semantic_scope(response_params: Dict[str, Any]) -> str:
+    """Key of the request settings besides the question that shape the answer; matches need the same scope"""
+    material = {
+        'model': response_params.get('model'),
+        'verbosity': response_params.get('text', {}).get('verbosity'),
+        'reasoning_effort': response_params.get('reasoning', {}).get('effort'),
+        'temperature': response_params.get('temperature'),
+        'tools': response_params.get('tools'),
+        'tool_choice': response_params.get('tool_choice')
+    }
+    encoded = json.dumps(material, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class SemanticProbe:
+    """Result of a lookup: the question's embedding, kept to store the answer, and any match"""
+
+    def __init__(self, vector: List[float], scope: str, value: Optional[Dict[str, Any]] = None, similarity: Optional[float] = None):
+        self.vector = vector
+        self.scope = scope
+        self.value = value
+        self.similarity = similarity
+
+
+class _PersonaIndex:
+    def __init__(self, sha256: str):
+        self.sha256 = sha256
+        self.vectors = VectorIndex()
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+class SemanticCache:
+    """Per-persona cache of answers looked up by similarity of the question.
+
+    Each persona has its own index of at most max_entries answers (least recently used are
+    evicted first). The index is dropped when the persona's instructions sha256 changes.
+    Personas opt in with "semantic_cache": true, or an object with a "threshold" override.
+    Searches scan the whole index, so lookup runs them in a thread; call put from one too.
+    """
+
+    def __init__(self, embedder: Any, threshold: float = 0.92, max_entries: int = 500, ttl_seconds: float = 3600):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._indexes: Dict[str, _PersonaIndex] = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def applies(self, persona: Mapping[str, Any]) -> bool:
+        return self.enabled and bool(persona.get('semantic_cache'))
+
+    def threshold_for(self, persona: Mapping[str, Any]) -> float:
+        config = persona.get('semantic_cache')
+        return config.get('threshold', self.threshold) if isinstance(config, Mapping) else self.threshold
+
+    async def lookup(self, persona: Mapping[str, Any], text: str, scope: str) -> Optional[SemanticProbe]:
+        """Closest stored answer above the persona's threshold; None when the question could not be embedded"""
+        try:
+            vector = await self.embedder.embed(" ".join(text.split()))
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"Semantic cache: embedding failed, skipping lookup: {str(e)}")
+            return None
+        return await asyncio.to_thread(self._search, persona, vector, scope)
+
+    def _search(self, persona: Mapping[str, Any], vector: List[float], scope: str) -> SemanticProbe:
+        now = time.time()
+        with self._lock:
+            index = self._index(persona)
+            for entry_id, similarity in index.vectors.search(vector, self.threshold_for(persona)):
+                entry = index.entries[entry_id]
+                if entry['expires_at'] < now:
+                    self._remove(index, entry_id)
+                    continue
+                if entry['scope'] != scope:
+                    continue
+                index.entries.move_to_end(entry_id)
+                self.hits += 1
+                return SemanticProbe(vector, scope, entry['value'], similarity)
+            self.misses += 1
+        return SemanticProbe(vector, scope)
+
+    def put(self, persona: Mapping[str, Any], probe: SemanticProbe, value: Dict[str, Any], ttl_seconds: Optional[float] = None) -> None:
+        """Store the answer to a probed question, evicting the persona's least recently used answers"""
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self._lock:
+            index = self._index(persona)
+            self._sequence += 1
+            entry_id = str(self._sequence)
+            index.entries[entry_id] = {'scope': probe.scope, 'value': value, 'expires_at': time.time() + ttl}
+            index.vectors.add(entry_id, probe.vector)
+            while len(index.entries) > self.max_entries:
+                self._remove(index, next(iter(index.entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def _index(self, persona: Mapping[str, Any]) -> _PersonaIndex:
+        index = self._indexes.get(persona['id'])
+        if index is None or index.sha256 != persona['sha256']:
+            if index is not None:
+                self.invalidations += 1
+                logger.info(f"Semantic cache: instructions of '{persona['id']}' changed, dropping {len(index.entries)} answers")
+            index = self._indexes[persona['id']] = _PersonaIndex(persona['sha256'])
+        return index
+
+    def _remove(self, index: _PersonaIndex, entry_id: str) -> None:
+        del index.entries[entry_id]
+        index.vectors.remove(entry_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'embedder': getattr(self.embedder, 'name', type(self.embedder).__name__),
+                'index': 'numpy' if numpy() is not None else 'python',
+                'entries': {persona_id: len(index.entries) for persona_id, index in self._indexes.items()},
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_semantic_cache(client: Any) -> SemanticCache:
+    """Create the semantic cache configured through environment variables (SEMANTIC_CACHE_MAX_ENTRIES=0 disables)"""
+    max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+    threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+    ttl_seconds = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+    dimensions = int(os.getenv("SEMANTIC_CACHE_DIMENSIONS", "256"))
+    if os.getenv("SEMANTIC_CACHE_EMBEDDER", "openai").lower() == "local":
+        embedder: Any = HashingEmbedder(dimensions)
+    else:
+        embedder = OpenAIEmbedder(client, os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"), dimensions)
+    if max_entries > 0:
+        logger.info(f"Semantic cache: {embedder.name} embedder, threshold={threshold}, max_entries={max_entries} per persona, "
+                    f"ttl={ttl_seconds}s, index={'numpy' if numpy() is not None else 'python'}")
+    return SemanticCache(embedder, threshold, max_entries, ttl_seconds)
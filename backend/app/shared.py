@@ -0,0 +1,258 @@
+import os
+import time
+import socket
+import fnmatch
+import logging
+import threading
+import socketserver
+from collections import OrderedDict
+from typing import Any, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStoreError(Exception):
+    """The shared store returned an error or could not be reached"""
+
+
+def _encode(*args: Any) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+
+def _read_reply(stream) -> Any:
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Shared store closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode('utf-8')
+    if kind == b"-":
+        raise SharedStoreError(rest.decode('utf-8'))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [_read_reply(stream) for _ in range(length)]
+    raise SharedStoreError(f"Unexpected reply from shared store: {line!r}")
+
+
+class SharedStoreClient:
+    """Minimal blocking client for the Redis protocol (RESP2), used by all workers of one deployment.
+
+    Works with Redis (redis://[:password@]host:port/db) and with the LocalSharedStore below
+    (unix:///path/to/socket). Connections are opened lazily and re-opened after a fork, so an
+    instance created before gunicorn forks its workers is safe to use in each of them.
+    """
+
+    def __init__(self, url: str, timeout: float = 1.0):
+        self.url = url
+        self.timeout = timeout
+        self._parsed = urlparse(url)
+        self._socket: Optional[socket.socket] = None
+        self._stream = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def execute(self, *args: Any) -> Any:
+        """Send one command and return its reply, reconnecting once if the connection dropped"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._socket is None or self._pid != os.getpid():
+                        self._connect()
+                    self._socket.sendall(_encode(*args))
+                    return _read_reply(self._stream)
+                except (OSError, ConnectionError) as e:
+                    self._close()
+                    if attempt:
+                        raise SharedStoreError(f"Shared store unavailable: {str(e)}") from e
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        if ttl_seconds:
+            self.execute("SET", key, value, "PX", max(1, int(ttl_seconds * 1000)))
+        else:
+            self.execute("SET", key, value)
+
+    def delete(self, *keys: str) -> int:
+        return self.execute("DEL", *keys) if keys else 0
+
+    def incr(self, key: str) -> int:
+        return self.execute("INCR", key)
+
+    def scan_iter(self, pattern: str) -> Iterator[str]:
+        cursor = "0"
+        while True:
+            cursor, keys = self.execute("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+            for key in keys:
+                yield key.decode('utf-8')
+            if cursor == "0":
+                return
+
+    def _connect(self) -> None:
+        if self._parsed.scheme == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self._parsed.path)
+        else:
+            sock = socket.create_connection((self._parsed.hostname or "localhost", self._parsed.port or 6379), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        self._stream = sock.makefile('rb')
+        self._pid = os.getpid()
+        if self._parsed.password:
+            self._socket.sendall(_encode("AUTH", self._parsed.password))
+            _read_reply(self._stream)
+        database = self._parsed.path.strip("/") if self._parsed.scheme != "unix" else parse_qs(self._parsed.query).get("db", [""])[0]
+        if database:
+            self._socket.sendall(_encode("SELECT", database))
+            _read_reply(self._stream)
+
+    def _close(self) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._stream = None
+
+
+class _Data:
+    """Key space of the local store: LRU-ordered values with optional expiry"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.values: "OrderedDict[bytes, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.time():
+            del self.values[key]
+            return None
+        self.values.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: bytes, value: bytes, expires_at: Optional[float]) -> None:
+        self.values[key] = (value, expires_at)
+        self.values.move_to_end(key)
+        while len(self.values) > self.max_keys:
+            self.values.popitem(last=False)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        data: _Data = self.server.data
+        while True:
+            try:
+                args = _read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            except SharedStoreError:
+                return
+            if not isinstance(args, list) or not args:
+                self.wfile.write(b"-ERR protocol error\r\n")
+                continue
+            with data.lock:
+                reply = self._dispatch(data, [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args])
+            self.wfile.write(reply)
+
+    def _dispatch(self, data: _Data, args: List[bytes]) -> bytes:
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if command == b"GET" and len(args) == 2:
+            value = data.get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET" and len(args) >= 3:
+            expires_at = None
+            options = [arg.upper() for arg in args[3:]]
+            if b"EX" in options:
+                expires_at = time.time() + float(args[3 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                expires_at = time.time() + float(args[3 + options.index(b"PX") + 1]) / 1000
+            if b"NX" in options and data.get(args[1]) is not None:
+                return b"$-1\r\n"
+            data.set(args[1], args[2], expires_at)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            removed = sum(1 for key in args[1:] if data.get(key) is not None and data.values.pop(key, None))
+            return b":%d\r\n" % removed
+        if command == b"INCR" and len(args) == 2:
+            entry = data.values.get(args[1])
+            try:
+                value = int(data.get(args[1]) or 0) + 1
+            except ValueError:
+                return b"-ERR value is not an integer\r\n"
+            data.set(args[1], str(value).encode(), entry[1] if entry else None)
+            return b":%d\r\n" % value
+        if command == b"SCAN":
+            pattern = "*"
+            if b"MATCH" in [arg.upper() for arg in args]:
+                pattern = args[[arg.upper() for arg in args].index(b"MATCH") + 1].decode('utf-8')
+            keys = [key for key in list(data.values) if data.get(key) is not None and fnmatch.fnmatchcase(key.decode('utf-8'), pattern)]
+            body = b"".join(b"$%d\r\n%s\r\n" % (len(key), key) for key in keys)
+            return b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys) + body
+        if command == b"FLUSHDB":
+            data.values.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown or malformed command '" + command + b"'\r\n"
+
+
+class LocalSharedStore(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Redis-compatible stand-in serving a small command subset over a Unix socket.
+
+    Run in the gunicorn master so every forked worker shares one key space without an external
+    Redis. Keys are evicted least-recently-used beyond max_keys.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, max_keys: int = 100000):
+        if os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.data = _Data(max_keys)
+        super().__init__(path, _Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "LocalSharedStore":
+        self._thread = threading.Thread(target=self.serve_forever, name="shared-store", daemon=True)
+        self._thread.start()
+        logger.info(f"Local shared store listening on {self.path}")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def create_shared_client() -> Optional[SharedStoreClient]:
+    """Client for SHARED_STORE_URL, or None when no shared store is configured"""
+    url = os.getenv("SHARED_STORE_URL", "")
+    if not url:
+        return None
+    parsed = urlparse(url)
+    logger.info(f"Shared store: {parsed.scheme}://{parsed.hostname or parsed.path}")
+    return SharedStoreClient(url, timeout=float(os.getenv("SHARED_STORE_TIMEOUT", "1.0")))
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One shared upstream call; subscribers get the frames produced so far plus the live tail"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.frames = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.result: Dict[str, Any] = {}
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, frame: Dict[str, Any]) -> None:
+        self.frames.append(frame)
+        self._wake()
+
+    def finish(self, result: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None) -> None:
+        self.result = result or {}
+        self.error = error
+        self.done = True
+        self._wake()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every frame from the start of the call, then wait for new ones until it finishes"""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.frames):
+                    yield self.frames[index]
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            # The last reader went away (its client disconnected): stop paying for the upstream call
+            if not self.subscribers and not self.done and self.task is not None:
+                self.task.cancel()
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalesces concurrent requests with the same key onto one upstream call"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def join(
+        self,
+        key: str,
+        producer: Callable[[], AsyncIterator[Dict[str, Any]]],
+        result: Callable[[], Dict[str, Any]]
+    ) -> Tuple[Flight, bool]:
+        """Return the in-flight call for key, starting producer in the background if there is none.
+
+        The boolean is True when this caller started the call.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.followers += 1
+            return flight, False
+
+        flight = Flight(key)
+        self._flights[key] = flight
+        self.leaders += 1
+
+        async def run():
+            try:
+                async for frame in producer():
+                    flight.publish(frame)
+                flight.finish(result=result())
+            except asyncio.CancelledError:
+                flight.finish(error=RuntimeError("Upstream call cancelled"))
+                raise
+            except Exception as e:
+                flight.finish(error=e)
+            finally:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+        flight.task = asyncio.create_task(run())
+        return flight, True
+
+    def follow(self, key: str) -> Optional[Flight]:
+        """The in-flight call for key, if any, without starting one.
+
+        The flight stays readable after it finishes, so a caller holding it can still subscribe.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.followers += 1
+        return flight
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': len(self._flights),
+            'leaders': self.leaders,
+            'followers': self.followers
+        }
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayStream:
+    """Frames of one /v1/chat generation, numbered with event ids so a reconnect can resume.
+
+    The generation runs in its own task and appends every serialized frame here; responses
+    (the original one and any resumed ones) read from the buffer instead of from the generator.
+    When the last reader leaves before the generation ends and nobody reattaches within
+    cancel_grace seconds, the generation task is cancelled.
+    """
+
+    def __init__(self, stream_id: str, fingerprint: str, cancel_grace: float = 0.0):
+        self.stream_id = stream_id
+        self.fingerprint = fingerprint
+        self.cancel_grace = cancel_grace
+        self.frames: List[str] = []
+        self.done = False
+        self.cancelled = False
+        self.readers = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._abandoned: Optional[asyncio.TimerHandle] = None
+
+    def append(self, frame: str) -> None:
+        self.frames.append(f"id: {len(self.frames) + 1}\n{frame}")
+        self._wake()
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.time()
+        self._wake()
+
+    def start(self, chunks: AsyncIterator[str]) -> "ReplayStream":
+        """Drain chunks into the buffer in the background"""
+        async def fill():
+            try:
+                async for chunk in chunks:
+                    self.append(chunk)
+            finally:
+                self.finish()
+
+        self.task = asyncio.create_task(fill())
+        return self
+
+    async def events_after(self, last_event_id: int = 0) -> AsyncIterator[str]:
+        """Yield frames with an id above last_event_id, then wait for new ones until the generation ends"""
+        index = max(0, last_event_id)
+        self.readers += 1
+        if self._abandoned is not None:
+            self._abandoned.cancel()
+            self._abandoned = None
+        try:
+            while True:
+                while index < len(self.frames):
+                    yield self.frames[index]
+                    index += 1
+                if self.done:
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            self.readers -= 1
+            if not self.readers and not self.done and self._abandoned is None:
+                self._abandoned = asyncio.get_running_loop().call_later(self.cancel_grace, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self) -> None:
+        self._abandoned = None
+        if self.readers or self.done or self.task is None:
+            return
+        logger.info(f"Request {self.stream_id}: No reader for {self.cancel_grace}s, cancelling the generation")
+        self.cancelled = True
+        self.task.cancel()
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class ReplayBuffer:
+    """Bounded index of recent generations by request id; finished ones are kept for ttl_seconds"""
+
+    def __init__(self, ttl_seconds: float, max_streams: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, ReplayStream]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.resumed = 0
+        self.missed = 0
+
+    def open(self, stream_id: str, fingerprint: str, cancel_grace: float = 0.0) -> ReplayStream:
+        stream = ReplayStream(stream_id, fingerprint, cancel_grace)
+        with self._lock:
+            self._prune()
+            self._streams[stream_id] = stream
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+        return stream
+
+    def resume(self, stream_id: str, fingerprint: str) -> Optional[ReplayStream]:
+        """The buffered generation for stream_id, if it is still kept and came from the same request body"""
+        with self._lock:
+            self._prune()
+            stream = self._streams.get(stream_id)
+            if stream is None or stream.cancelled or stream.fingerprint != fingerprint:
+                self.missed += 1
+                return None
+            self.resumed += 1
+            return stream
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, stream in self._streams.items() if stream.finished_at is not None and stream.finished_at < cutoff]
+        for key in expired:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'streams': len(self._streams),
+                'in_progress': sum(1 for stream in self._streams.values() if not stream.done),
+                'resumed': self.resumed,
+                'missed': self.missed
+            }
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body iterator as soon as the response ends.
+
+    On a client disconnect Starlette stops iterating but leaves the generator to the garbage
+    collector; closing it here runs its cleanup (and so the upstream cancellation) right away.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, 'aclose', None)
+            if aclose:
+                await aclose()
+
+
+def create_replay_buffer() -> Optional[ReplayBuffer]:
+    """Create the replay buffer configured through environment variables, or None when disabled"""
+    ttl_seconds = float(os.getenv("STREAM_REPLAY_TTL_SECONDS", "300"))
+    if ttl_seconds <= 0:
+        return None
+    max_streams = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", "1000"))
+    logger.info(f"Stream replay buffer: ttl={ttl_seconds}s, max_streams={max_streams}")
+    return ReplayBuffer(ttl_seconds, max_streams)
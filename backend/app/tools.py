@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Responses API tool definitions a persona can name in its tool_whitelist
+TOOL_DEFINITIONS: Dict[str, Dict[str, Any]] = {
+    "web_search": {"type": "web_search"},
+    "code_interpreter": {"type": "code_interpreter", "container": {"type": "auto"}},
+    "image_generation": {"type": "image_generation"}
+}
+
+_tool_sets: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def persona_tools(persona: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Tool definitions for a persona's tool_whitelist, built once per distinct whitelist.
+
+    Entries are tool names from TOOL_DEFINITIONS or full tool definitions. The same list object
+    is returned for every request, so the tools part of the cached prompt prefix never varies.
+    """
+    whitelist = persona.get('tool_whitelist') or []
+    key = json.dumps(whitelist, sort_keys=True)
+    tools = _tool_sets.get(key)
+    if tools is None:
+        tools = []
+        for entry in whitelist:
+            if isinstance(entry, Mapping):
+                tools.append(dict(entry))
+            elif entry in TOOL_DEFINITIONS:
+                tools.append(TOOL_DEFINITIONS[entry])
+            else:
+                logger.warning(f"Persona '{persona.get('id')}' whitelists unknown tool '{entry}', ignoring it")
+        _tool_sets[key] = tools
+    return tools
+
+
+def has_web_search(tools: List[Dict[str, Any]]) -> bool:
+    return any(str(tool.get('type', '')).startswith("web_search") for tool in tools)
+
+
+# Cues that an answer depends on information the model cannot have: the first matching rule
+# names the reason. A request matching none of them is answered without search.
+SEARCH_RULES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("url", re.compile(r"https?://|www\.|\b[\w-]+\.(com|is|io|org|net|co|ai)\b", re.IGNORECASE)),
+    ("explicit", re.compile(r"\b(search|look up|google|browse|find (me )?(sources|articles|examples|data|stats|statistics)|sources?|citations?|cite|links?|references?)\b", re.IGNORECASE)),
+    ("recency", re.compile(r"\b(today|tonight|yesterday|tomorrow|this (week|month|quarter|year)|latest|current(ly)?|recent(ly)?|news|trending|upcoming|right now|20[2-9]\d)\b", re.IGNORECASE)),
+    ("facts", re.compile(r"\b(prices?|pricing|stock|share price|market share|statistics|stats|figures|benchmarks?|competitors?|who (is|are)|what happened|when (is|was|did)|how (much|many))\b", re.IGNORECASE)),
+    ("recency_is", re.compile(r"(í dag|nýjust|fréttir|leita|núna|núverandi)", re.IGNORECASE))
+]
+
+
+class SearchClassifier:
+    """Local rule-based check of whether a request is worth a web search.
+
+    Skipped searches are credited with the average time searches take, measured from the
+    web_search_call events of requests that did search (starting from estimated_seconds).
+    """
+
+    def __init__(self, enabled: bool = False, estimated_seconds: float = 3.0):
+        self.enabled = enabled
+        self.search_seconds = estimated_seconds
+        self.decisions = {'search': 0, 'skip': 0}
+        self.reasons: Dict[str, int] = {}
+        self.saved_seconds = 0.0
+        self.searches_observed = 0
+        self._lock = threading.Lock()
+
+    def applies(self, persona: Mapping[str, Any]) -> bool:
+        """Whether requests of this persona are classified (personas override with web_search_classifier)"""
+        return bool(persona.get('web_search_classifier', self.enabled))
+
+    def needs_search(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Whether to allow web search for this message, and the rule that asked for it"""
+        for reason, pattern in SEARCH_RULES:
+            if pattern.search(text or ""):
+                with self._lock:
+                    self.decisions['search'] += 1
+                    self.reasons[reason] = self.reasons.get(reason, 0) + 1
+                return True, reason
+        with self._lock:
+            self.decisions['skip'] += 1
+        return False, None
+
+    def record_skip(self) -> float:
+        """Credit one skipped search with the current average search time; returns the seconds credited"""
+        with self._lock:
+            self.saved_seconds += self.search_seconds
+            return self.search_seconds
+
+    def observe_search(self, seconds: float) -> None:
+        """Fold the duration of a search that ran into the average"""
+        with self._lock:
+            self.searches_observed += 1
+            self.search_seconds = 0.8 * self.search_seconds + 0.2 * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'decisions': dict(self.decisions),
+                'reasons': dict(self.reasons),
+                'avg_search_seconds': round(self.search_seconds, 3),
+                'searches_observed': self.searches_observed,
+                'latency_saved_seconds': round(self.saved_seconds, 3)
+            }
+
+
+def create_search_classifier() -> SearchClassifier:
+    """Create the search pre-classifier configured through environment variables"""
+    enabled = os.getenv("WEB_SEARCH_CLASSIFIER", "false").lower() == "true"
+    estimated_seconds = float(os.getenv("WEB_SEARCH_ESTIMATED_SECONDS", "3"))
+    if enabled:
+        logger.info(f"Web search pre-classifier enabled (initial search estimate {estimated_seconds}s)")
+    return SearchClassifier(enabled, estimated_seconds)
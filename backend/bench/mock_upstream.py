@@ -0,0 +1,214 @@
+"""Local stand-in for the OpenAI Responses API, for benchmarks and load tests.
+
+Streams synthetic responses with configurable first-token latency, token rate, error rate and
+429 behavior, or replays responses recorded from the real API. Point the backend at it with
+OPENAI_BASE_URL=http://127.0.0.1:9100/v1.
+
+    python -m bench.mock_upstream --port 9100 --ttft 0.8 --tokens-per-second 60
+    python -m bench.mock_upstream --record recordings.jsonl   # proxy to api.openai.com and save
+    python -m bench.mock_upstream --replay recordings.jsonl   # serve the saved streams
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("positioning", "audience", "message", "brand", "channel", "offer", "value", "market",
+         "segment", "campaign", "insight", "story", "the", "and", "for", "with", "a", "to", "of", "our")
+
+
+class MockConfig:
+    """Behavior of the stand-in; every field can be changed at runtime through POST /mock/config"""
+
+    def __init__(self, ttft: float = 0.5, tokens_per_second: float = 50.0, output_tokens: int = 200,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: int = 1,
+                 jitter: float = 0.1, record: Optional[str] = None, replay: Optional[str] = None,
+                 replay_speed: float = 1.0, upstream: str = "https://api.openai.com/v1"):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.jitter = jitter
+        self.record = record
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.upstream = upstream
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+config = MockConfig()
+counters = {'requests': 0, 'streamed': 0, 'errors': 0, 'rate_limited': 0, 'replayed': 0, 'recorded': 0}
+_recordings: List[List[Dict[str, Any]]] = []
+_replay_cycle = None
+
+app = FastAPI(title="Mock Responses API")
+
+
+def sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def _jittered(seconds: float) -> float:
+    return max(0.0, seconds * (1 + random.uniform(-config.jitter, config.jitter)))
+
+
+def _response(response_id: str, model: str, status: str, usage: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "output": [],
+        "usage": usage
+    }
+
+
+async def synthetic_stream(params: Dict[str, Any]) -> AsyncIterator[str]:
+    """Events shaped like a real Responses stream: created, text deltas at the configured rate, completed"""
+    response_id = f"resp_mock_{uuid.uuid4().hex[:16]}"
+    item_id = f"msg_mock_{uuid.uuid4().hex[:16]}"
+    model = params.get("model", "gpt-5")
+    sequence = itertools.count()
+    yield sse({"type": "response.created", "sequence_number": next(sequence), "response": _response(response_id, model, "in_progress")})
+    await asyncio.sleep(_jittered(config.ttft))
+    interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+    for index in range(config.output_tokens):
+        word = WORDS[index % len(WORDS)]
+        yield sse({"type": "response.output_text.delta", "sequence_number": next(sequence), "item_id": item_id,
+                   "output_index": 0, "content_index": 0, "delta": word + " ", "logprobs": []})
+        if interval:
+            await asyncio.sleep(interval)
+    input_tokens = len(json.dumps(params.get("input", ""))) // 4 + len(params.get("instructions") or "") // 4
+    usage = {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": config.output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + config.output_tokens
+    }
+    yield sse({"type": "response.completed", "sequence_number": next(sequence), "response": _response(response_id, model, "completed", usage)})
+    counters['streamed'] += 1
+
+
+async def replay_stream() -> AsyncIterator[str]:
+    """Re-emit a recorded stream, keeping its original timing scaled by replay_speed"""
+    recording = next(_replay_cycle)
+    started = time.monotonic()
+    for entry in recording:
+        delay = entry['t'] / config.replay_speed - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield entry['block']
+    counters['replayed'] += 1
+
+
+async def recording_stream(request: Request, body: bytes) -> AsyncIterator[str]:
+    """Proxy to the real API and append the stream (with event timings) to the recording file"""
+    headers = {"Authorization": request.headers.get("Authorization") or f"Bearer {os.getenv('OPENAI_API_KEY', '')}",
+               "Content-Type": "application/json"}
+    entries = []
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(600, connect=10)) as client:
+        async with client.stream("POST", f"{config.upstream}/responses", content=body, headers=headers) as upstream:
+            buffer = ""
+            async for text in upstream.aiter_text():
+                buffer += text
+                *blocks, buffer = buffer.split("\n\n")
+                for block in blocks:
+                    entries.append({'t': round(time.monotonic() - started, 4), 'block': block + "\n\n"})
+                    yield block + "\n\n"
+    with open(config.record, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entries) + "\n")
+    counters['recorded'] += 1
+
+
+def load_recordings(path: str) -> None:
+    global _replay_cycle
+    with open(path, 'r', encoding='utf-8') as f:
+        _recordings[:] = [json.loads(line) for line in f if line.strip()]
+    if not _recordings:
+        raise ValueError(f"No recordings in {path}")
+    _replay_cycle = itertools.cycle(_recordings)
+
+
+@app.post("/v1/responses")
+async def create_response(request: Request):
+    counters['requests'] += 1
+    body = await request.body()
+    params = json.loads(body or b"{}")
+    if random.random() < config.rate_limit_rate:
+        counters['rate_limited'] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(config.retry_after)},
+            content={"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}
+        )
+    if random.random() < config.error_rate:
+        counters['errors'] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Internal error (mock)", "type": "server_error"}})
+    if config.record:
+        stream = recording_stream(request, body)
+    elif config.replay:
+        stream = replay_stream()
+    else:
+        stream = synthetic_stream(params)
+    return StreamingResponse(stream, media_type="text/event-stream")
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return {'config': config.as_dict(), 'counters': counters}
+
+
+@app.post("/mock/config")
+async def update_config(changes: Dict[str, Any]):
+    for key, value in changes.items():
+        if hasattr(config, key):
+            setattr(config, key, value)
+    if changes.get('replay'):
+        load_recordings(config.replay)
+    return config.as_dict()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=config.ttft, help="Seconds before the first text delta")
+    parser.add_argument("--tokens-per-second", type=float, default=config.tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=config.output_tokens)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="Fraction of calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=config.rate_limit_rate, help="Fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=config.retry_after)
+    parser.add_argument("--jitter", type=float, default=config.jitter, help="Relative random variation of delays")
+    parser.add_argument("--record", help="Proxy to the real API and append streams to this JSONL file")
+    parser.add_argument("--replay", help="Serve streams recorded with --record")
+    parser.add_argument("--replay-speed", type=float, default=config.replay_speed)
+    args = parser.parse_args()
+
+    for key, value in vars(args).items():
+        if hasattr(config, key):
+            setattr(config, key, value)
+    if config.replay:
+        load_recordings(config.replay)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Drive /v1/chat at a fixed concurrency and report throughput, TTFT, latency percentiles and event loop lag.
+
+    # Against a running backend
+    python -m bench.run --target http://127.0.0.1:8000 --token $GATEWAY_TOKEN --concurrency 16 --requests 200
+
+    # Start the mock upstream and a backend pointed at it, then run
+    python -m bench.run --spawn --mock-ttft 0.8 --mock-tokens-per-second 60 --concurrency 32 --requests 500
+
+    # Compare two saved results; exits 1 if a latency or throughput metric regressed by more than 10%
+    python -m bench.run --compare bench/results/baseline.json bench/results/current.json --threshold 0.1
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Linearly interpolated percentile; None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': max(values) if values else None
+    }
+
+
+def parse_histogram(text: str, name: str) -> Tuple[List[Tuple[float, float]], float, float]:
+    """Cumulative buckets, sum and count of an unlabelled histogram in Prometheus text format"""
+    buckets, total, count = [], 0.0, 0.0
+    for line in text.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((float("inf") if bound == "+Inf" else float(bound), float(line.rsplit(" ", 1)[1])))
+        elif line.startswith(f"{name}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+
+def histogram_delta(before: str, after: str, name: str) -> Dict[str, Optional[float]]:
+    """Mean and bucket-bound p50/p99 of the observations made between two /metrics scrapes"""
+    buckets_after, sum_after, count_after = parse_histogram(after, name)
+    buckets_before, sum_before, count_before = parse_histogram(before, name)
+    before_counts = dict(buckets_before)
+    count = count_after - count_before
+    if count <= 0:
+        return {'count': 0, 'mean': None, 'p50': None, 'p99': None}
+    deltas = [(bound, cumulative - before_counts.get(bound, 0)) for bound, cumulative in buckets_after]
+
+    def bound_at(fraction: float) -> Optional[float]:
+        for bound, cumulative in deltas:
+            if cumulative >= count * fraction:
+                return None if bound == float("inf") else bound
+        return None
+
+    return {'count': int(count), 'mean': (sum_after - sum_before) / count, 'p50': bound_at(0.5), 'p99': bound_at(0.99)}
+
+
+async def sample_loop_lag(samples: List[float], interval: float = 0.05) -> None:
+    """Lag of the harness's own event loop; a busy harness makes client-side numbers unreliable"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+async def one_request(client: httpx.AsyncClient, args: argparse.Namespace, index: int) -> Dict[str, Any]:
+    """Send one chat request and time its first content frame and its done frame"""
+    payload = {
+        "bot_id": args.bot_id,
+        # A unique question per request so the response cache does not short-circuit the run
+        "messages": [{"role": "user", "content": f"{args.prompt} (request {index} of run {args.run_id})"}]
+    }
+    started = time.perf_counter()
+    result: Dict[str, Any] = {'ok': False, 'ttft': None, 'latency': None, 'status': None, 'output_chars': 0}
+    try:
+        async with client.stream("POST", f"{args.target}/v1/chat", json=payload,
+                                 headers={"Authorization": f"Bearer {args.token}"}) as response:
+            result['status'] = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                frame = json.loads(line[6:])
+                if 'content' in frame:
+                    if result['ttft'] is None:
+                        result['ttft'] = time.perf_counter() - started
+                    result['output_chars'] += len(frame['content'])
+                elif 'error' in frame:
+                    result['error'] = frame['error']
+                elif frame.get('done'):
+                    result['ok'] = 'error' not in result
+        result['latency'] = time.perf_counter() - started
+    except httpx.HTTPError as e:
+        result['error'] = f"{type(e).__name__}: {str(e)}"
+    return result
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run args.requests requests with args.concurrency in flight and summarize them"""
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(args.timeout)) as client:
+        for _ in range(args.warmup):
+            await one_request(client, args, -1)
+        metrics_before = (await client.get(f"{args.target}/metrics")).text
+        harness_lag: List[float] = []
+        lag_task = asyncio.create_task(sample_loop_lag(harness_lag))
+        next_index = iter(range(args.requests))
+        results: List[Dict[str, Any]] = []
+
+        async def worker():
+            for index in next_index:
+                results.append(await one_request(client, args, index))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        lag_task.cancel()
+        metrics_after = (await client.get(f"{args.target}/metrics")).text
+
+    succeeded = [result for result in results if result['ok']]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        if not result['ok']:
+            key = str(result['status'] or 'connection')
+            statuses[key] = statuses.get(key, 0) + 1
+    return {
+        'requests': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'failures_by_status': statuses,
+        'duration_seconds': elapsed,
+        'throughput_rps': len(succeeded) / elapsed if elapsed else None,
+        'output_chars_per_second': sum(result['output_chars'] for result in succeeded) / elapsed if elapsed else None,
+        'ttft_seconds': distribution([result['ttft'] for result in succeeded if result['ttft'] is not None]),
+        'latency_seconds': distribution([result['latency'] for result in succeeded]),
+        'server_event_loop_lag_seconds': histogram_delta(metrics_before, metrics_after, "event_loop_lag_seconds"),
+        'harness_event_loop_lag_seconds': distribution(harness_lag)
+    }
+
+
+def wait_healthy(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+def spawn(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """Start the mock upstream and a backend that talks to it; returns the processes to stop afterwards"""
+    mock_command = [sys.executable, "-m", "bench.mock_upstream", "--port", str(args.mock_port),
+                    "--ttft", str(args.mock_ttft), "--tokens-per-second", str(args.mock_tokens_per_second),
+                    "--output-tokens", str(args.mock_output_tokens), "--error-rate", str(args.mock_error_rate),
+                    "--rate-limit-rate", str(args.mock_rate_limit_rate)]
+    if args.mock_replay:
+        mock_command += ["--replay", args.mock_replay]
+    env = dict(os.environ,
+               OPENAI_BASE_URL=f"http://127.0.0.1:{args.mock_port}/v1",
+               OPENAI_API_KEY="mock",
+               GATEWAY_TOKEN=args.token,
+               LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    backend_command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.backend_port), "--log-level", "warning"]
+    processes = [
+        subprocess.Popen(mock_command, cwd=BACKEND_DIR),
+        subprocess.Popen(backend_command, cwd=BACKEND_DIR, env=env)
+    ]
+    wait_healthy(f"http://127.0.0.1:{args.mock_port}/mock/stats")
+    wait_healthy(f"http://127.0.0.1:{args.backend_port}/ready")
+    args.target = f"http://127.0.0.1:{args.backend_port}"
+    return processes
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+# Metrics compared between runs, and whether a larger value is better
+COMPARED = (
+    ('throughput_rps', None, True),
+    ('ttft_seconds', 'p50', False),
+    ('ttft_seconds', 'p95', False),
+    ('ttft_seconds', 'p99', False),
+    ('latency_seconds', 'p50', False),
+    ('latency_seconds', 'p95', False),
+    ('latency_seconds', 'p99', False),
+    ('server_event_loop_lag_seconds', 'mean', False)
+)
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """Print metric changes between two result files; returns 1 if any moved the wrong way by more than threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    with open(current_path) as f:
+        current = json.load(f)['results']
+    regressed = False
+    for metric, field, higher_is_better in COMPARED:
+        old = baseline[metric][field] if field else baseline[metric]
+        new = current[metric][field] if field else current[metric]
+        label = f"{metric}.{field}" if field else metric
+        if not old or new is None:
+            print(f"{label:40} {old!s:>12} -> {new!s:>12}")
+            continue
+        change = (new - old) / old
+        worse = change < -threshold if higher_is_better else change > threshold
+        regressed = regressed or worse
+        print(f"{label:40} {old:12.4f} -> {new:12.4f} {change:+8.1%}{'  REGRESSION' if worse else ''}")
+    return 1 if regressed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.getenv("GATEWAY_TOKEN", "bench"))
+    parser.add_argument("--bot-id", default="mktg_strategist")
+    parser.add_argument("--prompt", default="Write a one-paragraph positioning statement for a B2B analytics tool")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="Result file (default: bench/results/bench-<timestamp>.json)")
+    parser.add_argument("--spawn", action="store_true", help="Start the mock upstream and a backend for the run")
+    parser.add_argument("--backend-port", type=int, default=8100)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-ttft", type=float, default=0.5)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=50)
+    parser.add_argument("--mock-output-tokens", type=int, default=200)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--mock-replay", help="Replay recorded upstream streams instead of synthetic ones")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    args.run_id = time.strftime("%Y%m%d-%H%M%S")
+    processes = spawn(args) if args.spawn else []
+    try:
+        results = asyncio.run(run_load(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('token', 'compare', 'output')}
+    report = {
+        'run_id': args.run_id,
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"bench-{args.run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"Saved {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+# Multi-worker serving: gunicorn -c gunicorn.conf.py app.main:app
+#
+# The app (and with it the persona registry) is loaded once in the master and the workers are
+# forked from it. With more than one worker and no SHARED_STORE_URL, the master runs a local
+# Redis-compatible store on a Unix socket so the response cache, conversation state and persona
+# reloads are shared by all workers. Set SHARED_STORE_URL=redis://... to use Redis instead.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Streams can run for minutes; uvicorn workers keep their heartbeat while streaming
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+_local_store = None
+
+if workers > 1 and not os.getenv("SHARED_STORE_URL"):
+    from app.shared import LocalSharedStore
+
+    _socket_path = os.getenv("SHARED_STORE_SOCKET", "/tmp/datera-shared-store.sock")
+    _local_store = LocalSharedStore(_socket_path, max_keys=int(os.getenv("SHARED_STORE_MAX_KEYS", "100000"))).start()
+    os.environ["SHARED_STORE_URL"] = f"unix://{_socket_path}"
+
+if os.getenv("SHARED_STORE_URL"):
+    os.environ.setdefault("CONVERSATION_STORE", "shared")
+    os.environ.setdefault("RESPONSE_CACHE_STORE", "shared")
+
+
+def post_fork(server, worker):
+    """Restart per-process resources that do not survive fork"""
+    from app import logs, main
+
+    logs.restart_after_fork()
+    main.conversation_store.after_fork()
+
+
+def on_exit(server):
+    if _local_store is not None:
+        _local_store.stop()
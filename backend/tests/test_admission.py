@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from app.admission import AdaptiveLimiter, AdmissionController, AdmissionRejected
+
+def make_limiter(**overrides):
+    options = dict(limit=1, min_limit=1, max_limit=8, max_queue=1, max_wait=0.05, latency_target=1.0)
+    options.update(overrides)
+    return AdaptiveLimiter("test", **options)
+
+def test_queue_full_rejects_with_429_and_timeout_with_503():
+    """Test that a full queue is rejected immediately and a slow queue times out"""
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await queued
+        return full.value, timed_out.value, limiter.stats()
+
+    full, timed_out, stats = asyncio.run(scenario())
+    assert full.status_code == 429 and full.retry_after >= 1
+    assert timed_out.status_code == 503
+    assert (stats['rejected'], stats['timed_out'], stats['queued'], stats['in_use']) == (1, 1, 0, 1)
+
+def test_release_hands_slot_to_queued_request():
+    """Test that releasing a slot admits the next queued request"""
+    async def scenario():
+        limiter = make_limiter(max_wait=1.0)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        limiter.release(latency=0.1)
+        waited = await queued
+        return waited, limiter.stats()
+
+    waited, stats = asyncio.run(scenario())
+    assert waited > 0
+    assert stats['in_use'] == 1 and stats['admitted'] == 2
+
+def test_limit_adapts_to_latency_and_throttling():
+    """Test AIMD adjustment of the concurrency limit"""
+    limiter = make_limiter(limit=4)
+    limiter.in_use = 3
+    limiter.release(throttled=True)
+    assert limiter.stats()['limit'] == 2
+    limiter.release(latency=5.0)
+    assert limiter.stats()['limit'] == 1
+    for _ in range(10):
+        limiter.in_use = 1
+        limiter.release(latency=0.1)
+    assert limiter.stats()['limit'] > 1
+
+def test_persona_slot_is_returned_when_model_is_saturated():
+    """Test that a model rejection does not leak the persona slot"""
+    async def scenario():
+        controller = AdmissionController(model_limit=1, persona_limit=4, min_limit=1, max_limit=8,
+                                         max_queue=0, max_wait=0.05, latency_target=1.0)
+        permit = await controller.acquire("p", "gpt-5")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("p", "gpt-5")
+        permit.release()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["persona:p"]["in_use"] == 0
+    assert stats["model:gpt-5"]["in_use"] == 0
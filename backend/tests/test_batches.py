@@ -0,0 +1,43 @@
+import asyncio
+from app.batches import BatchStore, parse_batch, response_output_text, run_batch
+
+def test_parse_batch_keeps_bad_lines_as_item_errors():
+    """Test that invalid lines become per-item errors and custom_id is taken from each line"""
+    items, digest = parse_batch(b'{"custom_id": "a", "bot_id": "x"}\n\n[1]\n{broken\n')
+    assert [item.custom_id for item in items] == ["a", "1", "2"]
+    assert items[0].payload == {"bot_id": "x"}
+    assert items[1].error and items[2].error
+    assert parse_batch(b'{"custom_id": "a", "bot_id": "x"}\n')[1] != digest
+
+def test_run_batch_bounds_concurrency_and_yields_in_finish_order():
+    """Test that no more than the limit run at once and results arrive as they finish"""
+    items, _ = parse_batch(b"\n".join(b'{"delay": %d}' % delay for delay in (3, 1, 2, 1)))
+    running = []
+    peak = []
+    async def run_item(item):
+        running.append(item.index)
+        peak.append(len(running))
+        await asyncio.sleep(item.payload["delay"] / 100)
+        running.remove(item.index)
+        if item.index == 2:
+            raise RuntimeError("boom")
+        return {"index": item.index, "custom_id": item.custom_id, "status": "ok"}
+    async def collect():
+        return [result async for result in run_batch(items, run_item, 2)]
+    results = asyncio.run(collect())
+    assert max(peak) == 2
+    assert results[0]["index"] == 1
+    assert sorted(result["index"] for result in results) == [0, 1, 2, 3]
+    assert {result["index"]: result["status"] for result in results}[2] == "error"
+
+def test_batch_store_summary_and_output_text():
+    """Test batch progress counts and extracting text from a Responses body"""
+    store = BatchStore(ttl_seconds=60, max_batches=1)
+    record = store.create("b1", "digest", 2, "stream")
+    store.record_result("b1", {"index": 0, "status": "ok"})
+    store.record_result("b1", {"index": 1, "status": "error"})
+    assert store.summary(record)["succeeded"] == 1 and store.summary(record)["failed"] == 1
+    store.create("b2", "digest", 1, "stream")
+    assert store.get("b1") is None
+    body = {"output": [{"type": "reasoning"}, {"type": "message", "content": [{"type": "output_text", "text": "Hi"}]}]}
+    assert response_output_text(body) == "Hi"
@@ -0,0 +1,42 @@
+import json
+import httpx
+import openai
+from fastapi.testclient import TestClient
+from app import main
+from bench import mock_upstream
+from bench.run import histogram_delta, percentile
+
+def test_percentile_interpolates():
+    """Test interpolated percentiles used in benchmark reports"""
+    assert percentile([], 0.5) is None
+    assert percentile([1, 2, 3, 4], 0.5) == 2.5
+    assert percentile([5], 0.99) == 5
+
+def test_histogram_delta_covers_only_new_observations():
+    """Test that lag statistics come from the difference between two /metrics scrapes"""
+    before = 'lag_bucket{le="0.001"} 10\nlag_bucket{le="0.01"} 10\nlag_bucket{le="+Inf"} 10\nlag_sum 0.005\nlag_count 10\n'
+    after = 'lag_bucket{le="0.001"} 10\nlag_bucket{le="0.01"} 14\nlag_bucket{le="+Inf"} 14\nlag_sum 0.025\nlag_count 14\n'
+    delta = histogram_delta(before, after, "lag")
+    assert delta["count"] == 4
+    assert abs(delta["mean"] - 0.005) < 1e-9
+    assert delta["p50"] == 0.01
+
+def test_chat_streams_through_mock_upstream(monkeypatch):
+    """Test that the mock upstream speaks the Responses streaming protocol the SDK and /v1/chat expect"""
+    monkeypatch.setenv("GATEWAY_TOKEN", "test_token")
+    monkeypatch.setattr(mock_upstream, "config", mock_upstream.MockConfig(ttft=0, tokens_per_second=0, output_tokens=5))
+    upstream = openai.AsyncOpenAI(
+        api_key="mock",
+        base_url="http://mock/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_upstream.app))
+    )
+    monkeypatch.setattr(main, "client", upstream)
+    main.response_cache.clear()
+    response = TestClient(main.app).post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json={
+        "bot_id": "mktg_strategist",
+        "messages": [{"role": "user", "content": "Mock upstream question"}]
+    })
+    frames = [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert "".join(frame.get("content", "") for frame in frames) == "positioning audience message brand channel "
+    assert frames[-2]["metadata"]["response_id"].startswith("resp_mock_")
+    assert frames[-1] == {"done": True}
@@ -0,0 +1,30 @@
+from app.cache import ResponseCache, make_cache_key
+
+def test_cache_key_covers_persona_hash_and_params():
+    """Test that the key changes with the persona hash and request parameters but not whitespace"""
+    params = {"model": "gpt-5", "input": [{"role": "user", "content": "Hi  there"}], "text": {"verbosity": "low"}}
+    key = make_cache_key("sha-a", params)
+    assert key == make_cache_key("sha-a", {**params, "input": [{"role": "user", "content": " Hi there "}]})
+    assert key != make_cache_key("sha-b", params)
+    assert key != make_cache_key("sha-a", {**params, "text": {"verbosity": "high"}})
+    assert key != make_cache_key("sha-a", {**params, "temperature": 0.4})
+
+def test_cache_evicts_lru_and_counts_hits():
+    """Test LRU eviction by entry count and hit/miss counters"""
+    cache = ResponseCache(max_entries=2, max_bytes=10_000, ttl_seconds=60)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 1, 1, 2)
+
+def test_cache_enforces_ttl_and_size():
+    """Test that expired and oversized entries are not served"""
+    cache = ResponseCache(max_entries=10, max_bytes=50, ttl_seconds=60)
+    cache.put("big", {"v": "x" * 100})
+    assert cache.get("big") is None
+    cache.put("short", {"v": 1}, ttl_seconds=-1)
+    assert cache.get("short") is None
+    assert cache.stats()["bytes"] == 0
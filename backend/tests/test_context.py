@@ -0,0 +1,65 @@
+from app.context import SummaryCache, TokenEstimator, plan_context, prefix_hashes, summary_input
+
+def turns(count, words=20):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "word " * words} for i in range(count)]
+
+def test_estimator_counts_text_and_images():
+    """Test that the estimate grows with text and charges a fixed cost per image"""
+    estimator = TokenEstimator(image_tokens=500)
+    assert estimator.count("Hello, world!") == 6
+    assert estimator.count("internationalization") == 5
+    image = [{"role": "user", "content": [{"type": "input_text", "text": "Look"}, {"type": "input_image", "image_url": "u"}]}]
+    assert estimator.count_messages(image) == estimator.message_overhead + 1 + 500
+
+def test_estimator_calibrates_towards_observed_usage():
+    """Test that reported input tokens move the calibration factor"""
+    estimator = TokenEstimator()
+    estimator.observe(100, 130)
+    assert estimator.calibrated(100) == 130
+    estimator.observe(100, 130)
+    assert abs(estimator.factor - 1.3) < 1e-9
+    estimator.observe(100, 1000)
+    assert estimator.factor < 1.5
+
+def test_plan_fits_without_compaction():
+    """Test that a conversation under budget is sent unchanged"""
+    plan = plan_context(turns(4), 10_000, TokenEstimator(), SummaryCache(10))
+    assert plan.keep_from == 0 and not plan.needs_summary
+
+def test_plan_compacts_then_reuses_and_rolls_summary():
+    """Test that a new summary is requested once, reused while it fits, and rolled forward later"""
+    estimator, cache = TokenEstimator(), SummaryCache(10)
+    messages = turns(10)
+    budget = estimator.count_messages(messages) // 2
+    plan = plan_context(messages, budget, estimator, cache)
+    assert plan.needs_summary and plan.summarize_from == 0 and plan.keep_from > 0
+    assert estimator.count_messages(messages[plan.keep_from:]) <= budget * 0.5
+    cache.put(plan.prefix_hash, "summary one", 10)
+
+    longer = messages + turns(2)
+    reused = plan_context(longer, budget, estimator, cache)
+    assert reused.summary == "summary one" and reused.keep_from == plan.keep_from
+    assert cache.hits == 1
+
+    longest = longer + turns(12)
+    rolled = plan_context(longest, budget, estimator, cache)
+    assert rolled.needs_summary
+    assert rolled.summarize_from == plan.keep_from and rolled.previous_summary == "summary one"
+    assert "summary one" in summary_input(rolled, longest)
+
+def test_prefix_hashes_depend_on_content():
+    """Test that a prefix hash changes when an earlier message is edited"""
+    messages = turns(3)
+    edited = [dict(messages[0], content="edited")] + messages[1:]
+    assert prefix_hashes(messages)[0] == prefix_hashes(edited)[0]
+    assert prefix_hashes(messages)[3] != prefix_hashes(edited)[3]
+    assert len(prefix_hashes(messages)) == 4
+
+def test_summary_cache_evicts_least_recently_used():
+    """Test that the summary cache stays within max_entries"""
+    cache = SummaryCache(2)
+    cache.put("a", "A", 1)
+    cache.put("b", "B", 1)
+    cache.get("a")
+    cache.put("c", "C", 1)
+    assert cache.get("b") is None and cache.get("a") is not None
@@ -0,0 +1,33 @@
+import time
+from app.conversations import MemoryConversationStore, SqliteConversationStore, trim_history
+
+def test_memory_store_evicts_least_recently_used():
+    """Test that the memory store stays bounded and evicts the oldest record"""
+    store = MemoryConversationStore(ttl_seconds=60, max_entries=2)
+    store.put({'response_id': 'r1', 'conversation_id': 'c1'})
+    store.put({'response_id': 'r2', 'conversation_id': 'c1'})
+    store.get('r1')
+    store.put({'response_id': 'r3', 'conversation_id': 'c2'})
+    assert store.get('r2') is None
+    assert store.get('r1')['conversation_id'] == 'c1'
+    assert store.get('r3')['conversation_id'] == 'c2'
+
+def test_memory_store_expires_records():
+    """Test that records older than the TTL are not returned"""
+    store = MemoryConversationStore(ttl_seconds=60, max_entries=10)
+    store.put({'response_id': 'r1', 'conversation_id': 'c1', 'created_at': time.time() - 120})
+    assert store.get('r1') is None
+
+def test_sqlite_store_survives_reopen(tmp_path):
+    """Test that the SQLite store keeps state across instances"""
+    path = str(tmp_path / "conversations.db")
+    SqliteConversationStore(path, ttl_seconds=60, max_entries=10).put({'response_id': 'r1', 'conversation_id': 'c1', 'persona_id': 'p'})
+    reopened = SqliteConversationStore(path, ttl_seconds=60, max_entries=10)
+    assert reopened.get('r1')['persona_id'] == 'p'
+
+def test_trim_history_keeps_latest_within_budget():
+    """Test that trimming keeps the newest messages within both budgets"""
+    messages = [{'role': 'user', 'content': 'x' * 10} for _ in range(6)]
+    assert len(trim_history(messages, max_messages=4, max_chars=1000)) == 4
+    assert len(trim_history(messages, max_messages=10, max_chars=25)) == 2
+    assert trim_history(messages, max_messages=10, max_chars=1) == messages[-1:]
@@ -0,0 +1,87 @@
+import io
+import base64
+import asyncio
+import httpx
+import pytest
+from app.images import ImagePipeline, LocalImageStore, fit_size, reencode
+
+# An 8x8 white PNG, decodable with and without Pillow
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAgAAAAICAIAAABLbSncAAAAFUlEQVR4nGP8//8/AzbAhFV00EoAAFbUAw037MyjAAAAAElFTkSuQmCC")
+ADDRESSES = {"blob": "93.184.216.34", "other": "93.184.216.35", "metadata": "169.254.169.254", "internal": "10.0.0.5"}
+
+@pytest.fixture(autouse=True)
+def fake_dns(monkeypatch):
+    async def resolve_host(host, port):
+        return [ADDRESSES[host]]
+    monkeypatch.setattr("app.egress.resolve_host", resolve_host)
+
+def make_pipeline(tmp_path, responses, **options):
+    requests = []
+    def handler(request):
+        requests.append(str(request.url))
+        response = responses.get(str(request.url), (404, b""))
+        if isinstance(response, str):
+            return httpx.Response(302, headers={"Location": response})
+        status, body = response
+        return httpx.Response(status, content=body)
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    store = LocalImageStore(str(tmp_path / "store"))
+    return ImagePipeline(store, http_client, workers=2, **options), requests
+
+def test_fit_size_matches_model_resolution():
+    """Test that images are scaled to fit 2048 on the long side and 768 on the short side"""
+    assert fit_size(4000, 3000, 2048, 768) == (1024, 768)
+    assert fit_size(500, 400, 2048, 768) == (500, 400)
+    assert fit_size(10000, 500, 2048, 768) == (2048, 102)
+
+def test_same_url_and_same_content_upload_once(tmp_path):
+    """Test that repeated URLs are fetched once and identical content is uploaded once"""
+    pipeline, requests = make_pipeline(tmp_path, {"https://blob/a.png": (200, PNG), "https://blob/copy.png": (200, PNG)})
+    async def run():
+        first = await pipeline.prepare(["https://blob/a.png", "https://blob/a.png"])
+        second = await pipeline.prepare(["https://blob/copy.png", "https://blob/a.png"])
+        return first, second
+    first, second = asyncio.run(run())
+    file_id = first[0]["file_id"]
+    assert file_id.startswith("file-local-")
+    assert [part["file_id"] for part in first + second] == [file_id] * 4
+    assert requests == ["https://blob/a.png", "https://blob/copy.png"]
+    assert pipeline.stats()["uploaded"] == 1
+    assert pipeline.stats()["hash_hits"] == 1
+    assert len(list((tmp_path / "store").iterdir())) == 1
+
+def test_failed_images_fall_back_to_url(tmp_path):
+    """Test that missing or oversized images are sent by URL instead of failing the request"""
+    pipeline, _ = make_pipeline(tmp_path, {"https://blob/big.png": (200, PNG * 10)}, max_bytes=100)
+    parts = asyncio.run(pipeline.prepare(["https://blob/missing.png", "https://blob/big.png"]))
+    assert parts == [
+        {"type": "input_image", "image_url": "https://blob/missing.png"},
+        {"type": "input_image", "image_url": "https://blob/big.png"}
+    ]
+    assert pipeline.stats()["failures"] == 2
+
+def test_reencode_downscales_large_images():
+    """Test that a large image is resized and re-encoded as JPEG"""
+    Image = pytest.importorskip("PIL.Image")
+    source = io.BytesIO()
+    Image.new("RGB", (3000, 2000), "white").save(source, format="PNG")
+    encoded, extension, content_type = reencode(source.getvalue(), 2048, 768, 85)
+    assert (extension, content_type) == ("jpg", "image/jpeg")
+    assert Image.open(io.BytesIO(encoded)).size == (1152, 768)
+
+def test_fetch_refuses_private_hosts_and_redirects_off_host(tmp_path):
+    """Test that only allowed public hosts are fetched and redirects must stay on the same host"""
+    responses = {
+        "https://blob/moved.png": "/a.png",
+        "https://blob/a.png": (200, PNG),
+        "https://blob/away.png": "https://other/a.png",
+        "https://blob/sneaky.png": "https://internal/a.png",
+        "https://other/a.png": (200, PNG)
+    }
+    pipeline, requests = make_pipeline(tmp_path, responses, allowed_hosts=["blob", "internal", "metadata"])
+    urls = ["https://blob/moved.png", "https://blob/away.png", "https://blob/sneaky.png",
+            "https://other/a.png", "https://metadata/latest", "http://blob/a.png"]
+    parts = asyncio.run(pipeline.prepare(urls))
+    assert "file_id" in parts[0]
+    assert parts[1:] == [{"type": "input_image", "image_url": url} for url in urls[1:]]
+    assert requests == ["https://blob/moved.png", "https://blob/a.png", "https://blob/away.png", "https://blob/sneaky.png"]
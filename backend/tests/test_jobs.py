@@ -0,0 +1,124 @@
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import httpx
+import pytest
+from app.egress import UnsafeURLError
+from app.jobs import Job, JobQueueFull, JobRunner, JobStore
+
+@pytest.fixture(autouse=True)
+def fake_dns(monkeypatch):
+    async def resolve_host(host, port):
+        return {"hooks.example.com": ["93.184.216.34"], "internal.example.com": ["10.0.0.5"]}[host]
+    monkeypatch.setattr("app.egress.resolve_host", resolve_host)
+
+def test_runner_runs_jobs_and_keeps_frames_for_late_readers():
+    """Test that a job's frames stay readable after it finishes and its result and status are recorded"""
+    async def run():
+        async def work(job):
+            job.stream.append("data: 1\n\n")
+            await asyncio.sleep(0)
+            job.stream.append("data: 2\n\n")
+            return {'status': 'ok', 'content': 'answer'}
+        runner = JobRunner(JobStore(ttl_seconds=60, max_jobs=10), work, workers=2)
+        job = Job("job-1", "bot", None)
+        await runner.submit(job)
+        assert runner.store.get("job-1").status == 'queued'
+        while job.status not in ('completed', 'failed'):
+            await asyncio.sleep(0.01)
+        frames = [frame async for frame in job.stream.events_after(1)]
+        await runner.stop()
+        return job, frames, runner
+    job, frames, runner = asyncio.run(run())
+    assert job.status == 'completed' and job.as_dict()['result'] == {'status': 'ok', 'content': 'answer'}
+    assert frames == ["id: 2\ndata: 2\n\n"]
+    assert runner.stats()['completed'] == 1
+
+def test_runner_records_failures_and_rejects_when_queue_is_full():
+    """Test that an exception fails the job and submitting past max_queue raises JobQueueFull"""
+    async def run():
+        release = asyncio.Event()
+        async def work(job):
+            await release.wait()
+            raise RuntimeError("upstream exploded")
+        runner = JobRunner(JobStore(ttl_seconds=60, max_jobs=10), work, workers=1, max_queue=1)
+        first, second = Job("job-1", "bot", None), Job("job-2", "bot", None)
+        await runner.submit(first)
+        await asyncio.sleep(0)  # the worker takes job-1, freeing the queue slot
+        await runner.submit(second)
+        with pytest.raises(JobQueueFull):
+            await runner.submit(Job("job-3", "bot", None))
+        release.set()
+        while second.status != 'failed':
+            await asyncio.sleep(0.01)
+        await runner.stop()
+        return first, runner
+    first, runner = asyncio.run(run())
+    assert first.status == 'failed' and first.result['error'] == "upstream exploded"
+    assert runner.store.get("job-3") is None
+    assert runner.stats()['failed'] == 2
+
+def test_store_evicts_only_finished_jobs():
+    """Test that the job limit drops the oldest finished jobs and never queued ones"""
+    store = JobStore(ttl_seconds=60, max_jobs=2)
+    old, pending = Job("old", "bot", None), Job("pending", "bot", None)
+    old.status, old.finished_at = 'completed', time.time()
+    store.add(old)
+    store.add(pending)
+    store.add(Job("new", "bot", None))
+    assert store.get("old") is None
+    assert store.get("pending") is not None and store.get("new") is not None
+    expired = Job("expired", "bot", None)
+    expired.status, expired.finished_at = 'failed', time.time() - 120
+    store.add(expired)
+    assert store.get("expired") is None
+
+def test_webhook_is_signed_and_retried_on_server_errors(monkeypatch):
+    """Test that the completion webhook retries 5xx responses and signs the body with the secret"""
+    requests = []
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503 if len(requests) == 1 else 204)
+    async def no_sleep(seconds):
+        pass
+    monkeypatch.setattr("app.jobs.asyncio.sleep", no_sleep)
+    async def run():
+        async def work(job):
+            return {'status': 'ok', 'content': 'done'}
+        runner = JobRunner(JobStore(ttl_seconds=60, max_jobs=10), work, webhook_secret="s3cret",
+                           webhook_allowed_hosts=["hooks.example.com"], webhook_transport=httpx.MockTransport(handler))
+        job = Job("job-1", "bot", None, webhook_url="https://hooks.example.com/jobs")
+        await runner.execute(job)
+        return job
+    job = asyncio.run(run())
+    assert job.webhook == {'delivered': True, 'attempts': 2, 'status_code': 204}
+    body = requests[-1].content
+    assert json.loads(body)['result']['content'] == 'done'
+    assert requests[-1].headers["X-Job-Signature"] == hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+
+def test_webhooks_only_reach_allowed_public_hosts():
+    """Test that webhook URLs off the allowlist or resolving to private addresses are refused, also at delivery"""
+    requests = []
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(204)
+    async def run():
+        async def work(job):
+            return {'status': 'ok'}
+        runner = JobRunner(JobStore(ttl_seconds=60, max_jobs=10), work,
+                           webhook_allowed_hosts=["*.example.com"], webhook_transport=httpx.MockTransport(handler))
+        refused = []
+        for url in ("https://hooks.example.com/jobs", "https://evil.test/jobs", "https://internal.example.com/jobs", "ftp://hooks.example.com/jobs"):
+            try:
+                await runner.check_webhook(url)
+            except UnsafeURLError:
+                refused.append(url)
+        job = Job("job-1", "bot", None, webhook_url="https://internal.example.com/jobs")
+        await runner.execute(job)
+        return refused, job
+    refused, job = asyncio.run(run())
+    assert refused == ["https://evil.test/jobs", "https://internal.example.com/jobs", "ftp://hooks.example.com/jobs"]
+    assert job.status == 'completed' and job.webhook['delivered'] is False and job.webhook['attempts'] == 0
+    assert requests == []
@@ -0,0 +1,102 @@
+import json
+import asyncio
+import queue
+import logging
+from app import logs
+from app.logs import DroppingQueueHandler, JsonFormatter, log_payload, truncate
+
+def make_record(message, **extra):
+    record = logging.LogRecord("app.test", logging.INFO, __file__, 1, message, None, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+def test_json_formatter_caps_message_and_fields(monkeypatch):
+    """Test that records are single JSON objects with truncated large fields"""
+    monkeypatch.setattr(logs, "max_message_chars", 10)
+    monkeypatch.setattr(logs, "max_field_chars", 5)
+    entry = json.loads(JsonFormatter().format(make_record("x" * 50, request_id="abcdefgh", attempt=2)))
+    assert entry["level"] == "INFO" and entry["logger"] == "app.test"
+    assert entry["message"].startswith("x" * 10) and "truncated 40 chars" in entry["message"]
+    assert entry["request_id"] == truncate("abcdefgh", 5)
+    assert entry["attempt"] == 2
+
+def test_queue_handler_drops_instead_of_blocking():
+    """Test that a full queue drops records and counts them"""
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.emit(make_record("first"))
+    handler.emit(make_record("second"))
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().msg == "first"
+
+def test_log_payload_is_sampled_and_lazy(monkeypatch, caplog):
+    """Test that payloads are only serialized for sampled requests"""
+    logger = logging.getLogger("app.test.payload")
+    calls = []
+    def payload():
+        calls.append(1)
+        return {"input": "y" * 10}
+
+    monkeypatch.setattr(logs, "payload_sample_rate", 0.0)
+    with caplog.at_level(logging.INFO, logger="app.test.payload"):
+        log_payload(logger, "req-1", "Params", payload)
+        assert calls == [] and not caplog.records
+        monkeypatch.setattr(logs, "payload_sample_rate", 1.0)
+        log_payload(logger, "req-1", "Params", payload)
+    assert calls == [1]
+    assert caplog.records[0].request_id == "req-1"
+    assert '"input": "yyyyyyyyyy"' in caplog.records[0].getMessage()
+
+def write_log(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            level = "ERROR" if i % 10 == 0 else "INFO"
+            f.write(json.dumps({"level": level, "message": f"Request req-{i % 3}: line {i}"}) + "\n")
+
+def test_tail_reads_backwards_with_filters(tmp_path):
+    """Test reverse-seek tail across block boundaries with request id and level filters"""
+    path = str(tmp_path / "app.log")
+    write_log(path, 500)
+    tail = logs.tail_lines(path, 3, block_size=64)
+    assert [json.loads(line)["message"] for line in tail] == ["Request req-2: line 497", "Request req-0: line 498", "Request req-1: line 499"]
+    errors = logs.tail_lines(path, 2, min_level="warning", block_size=64)
+    assert [json.loads(line)["message"] for line in errors] == ["Request req-0: line 480", "Request req-1: line 490"]
+    assert len(logs.tail_lines(path, 1000, request_id="req-1")) == 167
+
+def test_rotated_segments_are_compressed(tmp_path, monkeypatch):
+    """Test that size-based rotation gzips old segments"""
+    monkeypatch.setenv("LOG_MAX_BYTES", "200")
+    handler = logs.create_file_handler(str(tmp_path / "app.log"))
+    logger = logging.getLogger("app.test.rotation")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(20):
+            logger.warning("rotation line %d %s", i, "x" * 40)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    assert (tmp_path / "app.log.1.gz").exists()
+    assert not (tmp_path / "app.log.1").exists()
+
+def test_follow_yields_new_lines(tmp_path):
+    """Test that follow mode streams lines appended after it starts"""
+    path = tmp_path / "app.log"
+    path.write_text("old line\n")
+
+    async def scenario():
+        lines = logs.follow_lines(str(path), poll_interval=0.01)
+        pending = asyncio.ensure_future(lines.__anext__())
+        await asyncio.sleep(0.05)
+        with open(path, "a") as f:
+            f.write("new line\n")
+        line = await asyncio.wait_for(pending, 1)
+        await lines.aclose()
+        return line
+
+    assert asyncio.run(scenario()) == "new line"
+
+def test_worker_log_file_names():
+    """Test that forked workers get their own log file next to the master's"""
+    assert logs.worker_log_file("app.log", 4242) == "app.4242.log"
+    assert logs.worker_log_file("/var/log/backend/app.log", 7) == "/var/log/backend/app.7.log"
@@ -1,6 +1,20 @@
+import json
+import time
+import asyncio
+import httpx
+import openai
 import pytest
+from types import MappingProxyType, SimpleNamespace
 from fastapi.testclient import TestClient
+from app import logs, main
 from app.main import app
+from app.admission import AdmissionController
+from app.tools import SearchClassifier
+from app.jobs import JobRunner, JobStore
+from app.cache import SharedResponseCache
+from app.shared import SharedStoreError
+from app.semantic import HashingEmbedder, SemanticCache
+from app.context import SummaryCache, TokenEstimator, prefix_hashes, summary_message
 
 client = TestClient(app)
 
@@ -42,3 +56,623 @@ def test_chat_disabled_bot():
     )
     # Should return 501 for disabled bot (when properly configured)
     assert response.status_code in [403, 501]  # 403 for missing token, 501 for disabled bot
+
+class FakeEvent:
+    def __init__(self, type, **fields):
+        self.type = type
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+class FakeResponse:
+    def __init__(self, id, usage=None):
+        self.id = id
+        self.usage = usage
+
+class FakeResponses:
+    def __init__(self, events, fail_models=()):
+        self.events = events
+        self.fail_models = fail_models
+        self.calls = []
+
+    async def create(self, **params):
+        self.calls.append(params)
+        if params["model"] in self.fail_models:
+            raise RuntimeError(f"model {params['model']} unavailable")
+        return self._iterate()
+
+    async def _iterate(self):
+        for event in self.events:
+            yield event
+
+class FakeClient:
+    def __init__(self, events, fail_models=()):
+        self.responses = FakeResponses(events, fail_models)
+
+    async def close(self):
+        pass
+
+def stream_events(text="Hello there", response_id="resp_123"):
+    events = [FakeEvent("response.created", response=FakeResponse(response_id))]
+    events += [FakeEvent("response.output_text.delta", delta=text[i:i + 5]) for i in range(0, len(text), 5)]
+    events.append(FakeEvent("response.completed", response=FakeResponse(response_id)))
+    return events
+
+def parse_frames(body):
+    return [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: ")]
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    monkeypatch.setenv("GATEWAY_TOKEN", "test_token")
+    def install(events=None, fail_models=()):
+        fake = FakeClient(events if events is not None else stream_events(), fail_models)
+        monkeypatch.setattr(main, "client", fake)
+        main.response_cache.clear()
+        return fake
+    return install
+
+def chat_payload(**overrides):
+    payload = {
+        "messages": [{"role": "user", "content": "What is a positioning statement?"}],
+        "bot_id": "mktg_strategist"
+    }
+    payload.update(overrides)
+    return payload
+
+def test_chat_streams_upstream_deltas(fake_openai):
+    """Test that stream deltas are forwarded as content frames followed by metadata and done"""
+    fake = fake_openai()
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json=chat_payload())
+    assert response.status_code == 200
+    frames = parse_frames(response.text)
+    assert "".join(f["content"] for f in frames if "content" in f) == "Hello there"
+    assert [f for f in frames if "content" in f][0] == {"content": "Hello"}
+    assert frames[-2]["metadata"]["response_id"] == "resp_123"
+    assert frames[-1] == {"done": True}
+    assert fake.responses.calls[0]["stream"] is True
+
+def test_chat_stream_falls_back_on_primary_failure(fake_openai):
+    """Test that the fallback model is streamed when the primary model fails"""
+    fake = fake_openai(fail_models=("gpt-5",))
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json=chat_payload())
+    frames = parse_frames(response.text)
+    assert frames[-2]["metadata"]["model"] == "gpt-4o-mini"
+    assert "reasoning" not in fake.responses.calls[-1]
+
+def test_chat_chained_turn_sends_only_new_message(fake_openai):
+    """Test that a known previous_response_id sends only the latest turn"""
+    fake = fake_openai(stream_events(response_id="resp_first"))
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json=chat_payload())
+    history = [
+        {"role": "user", "content": "What is a positioning statement?"},
+        {"role": "assistant", "content": "Hello there"},
+        {"role": "user", "content": "Give me an example"}
+    ]
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=history, previous_response_id="resp_first"))
+    second_call = fake.responses.calls[-1]
+    assert second_call["previous_response_id"] == "resp_first"
+    assert second_call["input"] == [{"role": "user", "content": "Give me an example"}]
+    assert parse_frames(response.text)[-2]["metadata"]["conversation_id"]
+
+def test_chat_unknown_chain_rebuilds_history(fake_openai):
+    """Test that an unknown previous_response_id falls back to the full history"""
+    fake = fake_openai()
+    history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}, {"role": "user", "content": "More"}]
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=history, previous_response_id="resp_expired"))
+    call = fake.responses.calls[-1]
+    assert "previous_response_id" not in call
+    assert len(call["input"]) == 3
+
+def test_chat_replays_cached_response(fake_openai):
+    """Test that an identical request is replayed from the response cache"""
+    fake = fake_openai()
+    first = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json=chat_payload())
+    second = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                         json=chat_payload(messages=[{"role": "user", "content": "  What is a positioning   statement? "}]))
+    assert len(fake.responses.calls) == 1
+    first_frames, second_frames = parse_frames(first.text), parse_frames(second.text)
+    assert [f for f in second_frames if "content" in f] == [f for f in first_frames if "content" in f]
+    assert first_frames[-2]["metadata"]["cache"] == "miss"
+    assert second_frames[-2]["metadata"]["cache"] == "hit"
+    assert second_frames[-1] == {"done": True}
+
+def test_cached_answers_get_their_own_response_ids(fake_openai):
+    """Test that conversations served the same cached answer chain separately, through the upstream response"""
+    fake = fake_openai(stream_events(response_id="resp_origin"))
+    headers = {"Authorization": "Bearer test_token"}
+    question = [{"role": "user", "content": "Cached chain question"}]
+    first = parse_frames(client.post("/v1/chat", headers=headers, json=chat_payload(messages=question)).text)[-2]["metadata"]
+    second = parse_frames(client.post("/v1/chat", headers=headers, json=chat_payload(messages=question)).text)[-2]["metadata"]
+    assert second["cache"] == "hit"
+    assert first["response_id"] == "resp_origin" and second["response_id"] not in ("resp_origin", first["response_id"])
+    assert main.conversation_store.get("resp_origin")["conversation_id"] == first["conversation_id"]
+    follow_up = question + [{"role": "assistant", "content": "Hello there"}, {"role": "user", "content": "And then?"}]
+    third = parse_frames(client.post("/v1/chat", headers=headers,
+                                     json=chat_payload(messages=follow_up, previous_response_id=second["response_id"])).text)[-2]["metadata"]
+    assert fake.responses.calls[-1]["previous_response_id"] == "resp_origin"
+    assert fake.responses.calls[-1]["input"] == [{"role": "user", "content": "And then?"}]
+    assert third["conversation_id"] == second["conversation_id"] != first["conversation_id"]
+
+def test_chat_saturated_returns_retry_after(fake_openai, monkeypatch):
+    """Test that a saturated model is rejected with 429 and Retry-After"""
+    fake = fake_openai()
+    controller = AdmissionController(model_limit=1, persona_limit=4, min_limit=1, max_limit=8,
+                                     max_queue=0, max_wait=0.05, latency_target=1.0)
+    controller.limiter("model:gpt-5", 1).in_use = 1
+    monkeypatch.setattr(main, "admission", controller)
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=[{"role": "user", "content": "Uncached question"}]))
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert fake.responses.calls == []
+    assert controller.stats()["persona:mktg_strategist"]["in_use"] == 0
+
+def test_metrics_record_chat_stages(fake_openai):
+    """Test that a chat request shows up in the /metrics histograms"""
+    fake_openai()
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "Metrics question"}]))
+    body = client.get("/metrics").text
+    assert 'chat_request_duration_seconds_count{persona="mktg_strategist",model="gpt-5"}' in body
+    assert 'chat_upstream_ttfb_seconds_count{persona="mktg_strategist",model="gpt-5"}' in body
+    assert 'chat_queue_wait_seconds_count{persona="mktg_strategist",model="gpt-5"}' in body
+    assert 'chat_requests_in_flight{persona="mktg_strategist"} 0' in body
+
+def test_chat_keeps_stable_prompt_prefix(fake_openai, monkeypatch):
+    """Test the prompt cache key per persona version, brief mode after the turns and an unchanged instructions/tools prefix"""
+    usage = SimpleNamespace(input_tokens=1200, output_tokens=40, input_tokens_details=SimpleNamespace(cached_tokens=1024))
+    events = stream_events()
+    events[-1] = FakeEvent("response.completed", response=FakeResponse("resp_123", usage))
+    fake = fake_openai(events)
+    headers = {"Authorization": "Bearer test_token"}
+    history = [
+        {"role": "user", "content": "What is a positioning statement?"},
+        {"role": "assistant", "content": "A one-line summary of who the product is for."},
+        {"role": "user", "content": "Write one for a bike shop"}
+    ]
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=history))
+    plain = fake.responses.calls[-1]
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=history[:2] + [{"role": "user", "content": "Brief question"}], format_mode="brief"))
+    brief = fake.responses.calls[-1]
+    assert [message["content"] for message in brief["input"][:-1]] == [message["content"] for message in history[:2]] + ["Brief question"]
+    assert brief["input"][-1]["role"] == "system" and "concise" in brief["input"][-1]["content"]
+    assert json.dumps(brief["instructions"]) == json.dumps(plain["instructions"])
+    assert json.dumps(brief["tools"]) == json.dumps(plain["tools"])
+    assert brief["extra_body"]["prompt_cache_key"] == plain["extra_body"]["prompt_cache_key"]
+
+    persona = {**main.persona_cache["mktg_strategist"], "sha256": "0" * 64, "version": "next"}
+    monkeypatch.setattr(main, "persona_cache", MappingProxyType({**main.persona_cache, "mktg_strategist": persona}))
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=[{"role": "user", "content": "After the instructions changed"}]))
+    assert fake.responses.calls[-1]["extra_body"]["prompt_cache_key"] != plain["extra_body"]["prompt_cache_key"]
+    body = client.get("/metrics").text
+    assert 'chat_cached_input_tokens_total{persona="mktg_strategist",model="gpt-5"}' in body
+
+def test_chat_reuses_rolling_summary_over_budget(fake_openai, monkeypatch):
+    """Test that history over the input budget is replaced by a cached rolling summary"""
+    fake = fake_openai()
+    estimator = TokenEstimator()
+    persona = main.persona_cache["mktg_strategist"]
+    monkeypatch.setattr(main, "token_estimator", estimator)
+    monkeypatch.setattr(main, "context_max_input_tokens", estimator.calibrated(persona["instructions_tokens"]) + 60)
+    history = [
+        {"role": "user", "content": "Tell me about our brand positioning in the Nordic market " * 3},
+        {"role": "assistant", "content": "The brand sits between premium and mainstream offerings " * 3},
+        {"role": "user", "content": "How should we price the new product line against competitors " * 3},
+        {"role": "user", "content": "Summarize next steps"}
+    ]
+    monkeypatch.setattr(main, "summary_cache", SummaryCache(10))
+    main.summary_cache.put(prefix_hashes(history)[3], "Nordic positioning and pricing discussed.", 12)
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"}, json=chat_payload(messages=history))
+    assert len(fake.responses.calls) == 1
+    assert fake.responses.calls[0]["input"] == [
+        summary_message("Nordic positioning and pricing discussed."),
+        {"role": "user", "content": "Summarize next steps"}
+    ]
+    assert parse_frames(response.text)[-2]["metadata"]["summarized_messages"] == 3
+
+def test_chat_attaches_only_new_images_on_chained_turns(fake_openai):
+    """Test that images already sent in a conversation are not re-attached to chained turns"""
+    def attached(call):
+        content = call["input"][-1]["content"]
+        return [part["image_url"] for part in content if part["type"] == "input_image"] if isinstance(content, list) else []
+    fake = fake_openai(stream_events(response_id="resp_img1"))
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "Describe this"}], image_urls=["https://blob/a.png"]))
+    assert attached(fake.responses.calls[-1]) == ["https://blob/a.png"]
+
+    fake.responses.events = stream_events(response_id="resp_img2")
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "And this one?"}], previous_response_id="resp_img1",
+                                  image_urls=["https://blob/a.png", "https://blob/b.png"]))
+    assert attached(fake.responses.calls[-1]) == ["https://blob/b.png"]
+
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "Compare them"}], previous_response_id="resp_img2",
+                                  image_urls=["https://blob/a.png", "https://blob/b.png"]))
+    assert fake.responses.calls[-1]["input"] == [{"role": "user", "content": "Compare them"}]
+
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "Compare again"}], previous_response_id="resp_gone",
+                                  image_urls=["https://blob/a.png", "https://blob/b.png"]))
+    assert attached(fake.responses.calls[-1]) == ["https://blob/a.png", "https://blob/b.png"]
+
+def batch_body(*lines):
+    return "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+
+def test_chat_batch_streams_results_and_resumes(fake_openai):
+    """Test that batch items stream back as NDJSON with per-item errors, and a resume only re-runs failures"""
+    fake = fake_openai()
+    body = batch_body(
+        {"custom_id": "brief-1", **chat_payload(messages=[{"role": "user", "content": "Brief one"}])},
+        "{not json",
+        {"custom_id": "brief-3", **chat_payload(bot_id="nobody")}
+    )
+    response = client.post("/v1/chat/batch?concurrency=2", headers={"Authorization": "Bearer test_token"}, content=body)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    batch_id = lines[0]["batch_id"]
+    assert response.headers["X-Batch-ID"] == batch_id
+    results = {line["custom_id"]: line for line in lines[1:-1]}
+    assert results["brief-1"]["status"] == "ok" and results["brief-1"]["content"] == "Hello there"
+    assert results["1"]["status_code"] == 400
+    assert results["brief-3"]["status_code"] == 404
+    assert lines[-1]["done"] is True and lines[-1]["succeeded"] == 1 and lines[-1]["failed"] == 2
+
+    calls = len(fake.responses.calls)
+    resumed = client.post(f"/v1/chat/batch?batch_id={batch_id}", headers={"Authorization": "Bearer test_token"}, content=body)
+    resumed_lines = [json.loads(line) for line in resumed.text.splitlines()]
+    assert resumed_lines[0]["resumed"] == 1
+    assert len(fake.responses.calls) == calls
+    status = client.get(f"/v1/chat/batch/{batch_id}", headers={"Authorization": "Bearer test_token"}).json()
+    assert status["completed"] == 3 and status["status"] == "completed"
+
+def test_chat_batch_deferred_mode_uses_upstream_batches(fake_openai):
+    """Test that deferred mode uploads a Responses batch file and collects its output when polled"""
+    fake = fake_openai()
+    uploads = []
+    output = json.dumps({"custom_id": "0", "response": {"status_code": 200, "body": {
+        "id": "resp_b0", "model": "gpt-5",
+        "output": [{"type": "message", "content": [{"type": "output_text", "text": "Deferred answer"}]}]}}})
+    async def files_create(file, purpose):
+        uploads.append((purpose, file[1]))
+        return SimpleNamespace(id="file_in")
+    async def files_content(file_id):
+        return SimpleNamespace(text=output)
+    async def batches_create(**params):
+        return SimpleNamespace(id="batch_up")
+    async def batches_retrieve(batch_id):
+        return SimpleNamespace(status="completed", output_file_id="file_out", error_file_id=None)
+    fake.files = SimpleNamespace(create=files_create, content=files_content)
+    fake.batches = SimpleNamespace(create=batches_create, retrieve=batches_retrieve)
+    body = batch_body(chat_payload(messages=[{"role": "user", "content": "Offline brief"}]))
+    submitted = client.post("/v1/chat/batch?mode=deferred", headers={"Authorization": "Bearer test_token"}, content=body).json()
+    assert submitted["status"] == "submitted"
+    purpose, data = uploads[0]
+    line = json.loads(data)
+    assert purpose == "batch" and line["url"] == "/v1/responses"
+    assert line["body"]["prompt_cache_key"].startswith("persona-mktg_strategist-")
+    assert fake.responses.calls == []
+    status = client.get(f"/v1/chat/batch/{submitted['batch_id']}", headers={"Authorization": "Bearer test_token"}).json()
+    assert status["status"] == "completed"
+    assert status["results"][0]["content"] == "Deferred answer"
+
+def test_ready_waits_for_personas_and_warm_up(monkeypatch):
+    """Test that /ready is 503 until upstream connections are warm, while /health stays ok"""
+    monkeypatch.setattr(main, "upstream_warm", False)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["checks"] == {"personas": True, "upstream": False}
+    assert client.get("/health").json()["status"] == "ok"
+    monkeypatch.setattr(main, "upstream_warm", True)
+    assert client.get("/ready").status_code == 200
+    monkeypatch.setattr(main, "persona_cache", {})
+    assert client.get("/ready").status_code == 503
+
+def test_warm_up_opens_upstream_connections(monkeypatch):
+    """Test that warm-up treats any HTTP answer as warm and opens the configured number of connections"""
+    calls = []
+
+    class Models:
+        async def list(self):
+            calls.append(1)
+            raise openai.NotFoundError("not found", response=httpx.Response(404, request=httpx.Request("GET", "http://x")), body=None)
+
+    class WarmClient:
+        models = Models()
+
+        def with_options(self, **options):
+            return self
+
+    monkeypatch.setattr(main, "client", WarmClient())
+    monkeypatch.setattr(main, "shared_client", None)
+    monkeypatch.setattr(main, "upstream_warm", False)
+    monkeypatch.setattr(main, "warmup_connections", 3)
+    asyncio.run(main.warm_up())
+    assert main.upstream_warm
+    assert len(calls) == 3
+
+def test_chat_reconnect_resumes_from_last_event_id(fake_openai):
+    """Test that a reconnect with X-Request-ID and Last-Event-ID replays the rest without a new upstream call"""
+    fake = fake_openai()
+    headers = {"Authorization": "Bearer test_token"}
+    response = client.post("/v1/chat", headers=headers, json=chat_payload())
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.startswith("id: 1\ndata: ")
+    request_id = response.headers["X-Request-ID"]
+    resumed = client.post("/v1/chat", headers={**headers, "X-Request-ID": request_id, "Last-Event-ID": "2"}, json=chat_payload())
+    assert resumed.headers["X-Request-ID"] == request_id and resumed.headers["X-Stream-Resumed"] == "true"
+    assert resumed.text.startswith("id: 3\ndata: ")
+    frames = parse_frames(resumed.text)
+    assert frames[0] == {"content": "e"}
+    assert frames[-1] == {"done": True}
+    assert len(fake.responses.calls) == 1
+    # A different request body under the same id is a new generation
+    other = client.post("/v1/chat", headers={**headers, "X-Request-ID": request_id, "Last-Event-ID": "2"},
+                        json=chat_payload(messages=[{"role": "user", "content": "Something else"}]))
+    assert other.headers["X-Request-ID"] != request_id and other.headers["X-Stream-Resumed"] == "false"
+    assert next(frame for frame in parse_frames(other.text) if "metadata" in frame)["metadata"]["resume"] == "missed"
+    assert len(fake.responses.calls) == 2
+
+def test_chat_disconnect_cancels_upstream_and_releases_slot(monkeypatch):
+    """Test that a generation nobody reads any more is cancelled, closing the upstream stream and freeing its slot"""
+    closed = []
+
+    class BlockingStream:
+        def __init__(self):
+            self._events = self.events()
+
+        def __aiter__(self):
+            return self._events
+
+        async def events(self):
+            yield FakeEvent("response.created", response=FakeResponse("resp_slow"))
+            yield FakeEvent("response.output_text.delta", delta="Hel")
+            await asyncio.sleep(10)
+
+        async def close(self):
+            closed.append(True)
+
+    async def create(**params):
+        return BlockingStream()
+
+    controller = AdmissionController(model_limit=4, persona_limit=4, min_limit=1, max_limit=8,
+                                     max_queue=4, max_wait=1.0, latency_target=1.0)
+    monkeypatch.setattr(main, "client", SimpleNamespace(responses=SimpleNamespace(create=create)))
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "stream_cancel_grace", 0.1)
+    cancellations = main.metrics.cancellations_total.value("mktg_strategist", "gpt-5")
+
+    async def scenario():
+        request = main.ChatRequest(**chat_payload(messages=[{"role": "user", "content": "Never finished"}]))
+        response = await main.chat(request, token=None)
+        body = response.body_iterator
+        first = await body.__anext__()
+        await body.aclose()
+        await asyncio.sleep(0.02)
+        # Within the grace period the upstream call still runs and keeps its slot
+        in_use_during_grace = controller.stats()["model:gpt-5"]["in_use"]
+        await asyncio.sleep(0.2)
+        return first, in_use_during_grace
+
+    first, in_use_during_grace = asyncio.run(scenario())
+    assert json.loads(first.split("data: ", 1)[1]) == {"content": "Hel"}
+    assert in_use_during_grace == 1
+    assert closed
+    assert controller.stats()["model:gpt-5"]["in_use"] == 0
+    assert main.metrics.cancellations_total.value("mktg_strategist", "gpt-5") == cancellations + 1
+
+def test_coalesced_call_keeps_its_slot_after_the_leader_leaves(monkeypatch):
+    """Test that followers take no slot and the leader's slot stays with the upstream call until it ends"""
+    release = None
+
+    async def create(**params):
+        async def events():
+            yield FakeEvent("response.created", response=FakeResponse("resp_shared"))
+            yield FakeEvent("response.output_text.delta", delta="Hel")
+            await release.wait()
+            yield FakeEvent("response.output_text.delta", delta="lo")
+            yield FakeEvent("response.completed", response=FakeResponse("resp_shared"))
+        return events()
+
+    controller = AdmissionController(model_limit=4, persona_limit=4, min_limit=1, max_limit=8,
+                                     max_queue=4, max_wait=1.0, latency_target=1.0)
+    monkeypatch.setattr(main, "client", SimpleNamespace(responses=SimpleNamespace(create=create)))
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "stream_cancel_grace", 0.05)
+    main.response_cache.clear()
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        request = main.ChatRequest(**chat_payload(messages=[{"role": "user", "content": "Shared question"}]))
+        leader = (await main.chat(request, token=None)).body_iterator
+        await leader.__anext__()
+        follower = (await main.chat(request, token=None)).body_iterator
+        await follower.__anext__()
+        in_use_both = controller.stats()["model:gpt-5"]["in_use"]
+        await leader.aclose()
+        await asyncio.sleep(0.2)
+        in_use_after_leader_left = controller.stats()["model:gpt-5"]["in_use"]
+        release.set()
+        rest = [frame async for frame in follower]
+        await asyncio.sleep(0.01)
+        return in_use_both, in_use_after_leader_left, rest, controller.stats()["model:gpt-5"]["in_use"]
+
+    in_use_both, in_use_after_leader_left, rest, in_use_after = asyncio.run(scenario())
+    assert in_use_both == 1 and in_use_after_leader_left == 1 and in_use_after == 0
+    assert {"content": "lo"} in [json.loads(frame.split("data: ", 1)[1]) for frame in rest]
+
+def test_chat_pre_classifier_skips_web_search(fake_openai, monkeypatch):
+    """Test that a request without search cues keeps the tools but switches them off, and is counted"""
+    fake = fake_openai()
+    monkeypatch.setattr(main, "search_classifier", SearchClassifier(enabled=True, estimated_seconds=3.0))
+    skipped = main.metrics.web_search_skipped_total.value("mktg_strategist")
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=[{"role": "user", "content": "Make this slogan punchier: We care"}]))
+    frames = parse_frames(response.text)
+    call = fake.responses.calls[-1]
+    assert call["tools"] == [{"type": "web_search"}]
+    assert call["tool_choice"] == "none"
+    assert frames[-2]["metadata"]["web_search"] == "skipped"
+    assert main.metrics.web_search_skipped_total.value("mktg_strategist") == skipped + 1
+    client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                json=chat_payload(messages=[{"role": "user", "content": "What are competitors doing this year?"}]))
+    assert "tool_choice" not in fake.responses.calls[-1]
+    assert main.search_classifier.stats()["latency_saved_seconds"] == 3.0
+
+def test_chat_leaves_unrouted_persona_at_medium_effort(fake_openai):
+    """Test that the shipped persona is not routed, so questions keep the medium default effort"""
+    fake = fake_openai()
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=[{"role": "user", "content": "Why is my email campaign underperforming?"}]))
+    assert "routing" not in parse_frames(response.text)[-2]["metadata"]
+    assert fake.responses.calls[-1]["reasoning"] == {"effort": "medium"}
+
+def test_chat_routes_by_input_and_reports_decision(fake_openai, monkeypatch):
+    """Test that a short acknowledgement is routed to the light tier and the decision is in the metadata frame"""
+    fake = fake_openai()
+    persona = {**main.persona_cache["mktg_strategist"], "routing": {"latency_slo_seconds": 30}}
+    monkeypatch.setattr(main, "persona_cache", MappingProxyType({**main.persona_cache, "mktg_strategist": persona}))
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=[{"role": "user", "content": "Thanks!"}]))
+    routing = parse_frames(response.text)[-2]["metadata"]["routing"]
+    call = fake.responses.calls[-1]
+    assert routing["tier"] == "light" and routing["reason"] == "acknowledgement"
+    # Minimal effort cannot be combined with web search, so the light tier uses low
+    assert call["reasoning"] == {"effort": "low"} and call["text"] == {"verbosity": "low"}
+    response = client.post("/v1/chat", headers={"Authorization": "Bearer test_token"},
+                           json=chat_payload(messages=[{"role": "user", "content": "Thanks!"}], route="deep", reasoning_effort="low"))
+    routing = parse_frames(response.text)[-2]["metadata"]["routing"]
+    assert routing["tier"] == "deep" and routing["overrides"] == ["reasoning_effort"]
+    assert fake.responses.calls[-1]["reasoning"] == {"effort": "low"}
+
+def test_chat_background_job_can_be_polled_and_attached(fake_openai, monkeypatch):
+    """Test that background mode answers 202 with a job id, and the job's result and frames are retrievable"""
+    fake_openai()
+    monkeypatch.setattr(main, "warmup_enabled", False)
+    monkeypatch.setattr(main, "job_runner", JobRunner(JobStore(ttl_seconds=60, max_jobs=10), main.run_chat_job, workers=1))
+    headers = {"Authorization": "Bearer test_token"}
+    with TestClient(app) as session:
+        response = session.post("/v1/chat", headers=headers, json=chat_payload(background=True))
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.headers["Location"] == f"/v1/jobs/{job_id}"
+        for _ in range(100):
+            status = session.get(f"/v1/jobs/{job_id}", headers=headers).json()
+            if status["status"] == "completed":
+                break
+            time.sleep(0.01)
+        assert status["result"]["content"] == "Hello there"
+        events = session.get(f"/v1/jobs/{job_id}/events", headers=headers)
+        assert parse_frames(events.text)[-1] == {"done": True}
+        tail = session.get(f"/v1/jobs/{job_id}/events", headers={**headers, "Last-Event-ID": str(status["events"] - 1)})
+        assert parse_frames(tail.text) == [{"done": True}]
+        assert session.get("/v1/jobs/missing", headers=headers).status_code == 404
+        assert session.post("/v1/chat", headers=headers, json=chat_payload(background=True, bot_id="nobody")).status_code == 404
+        # No JOBS_WEBHOOK_ALLOWED_HOSTS configured: every webhook is refused before queueing
+        refused = session.post("/v1/chat", headers=headers, json=chat_payload(background=True, webhook_url="https://hooks.example.com/x"))
+        assert refused.status_code == 400
+
+def test_chat_serves_reworded_question_from_semantic_cache(fake_openai, monkeypatch):
+    """Test that a reworded first-turn question is answered from the semantic cache and reported in metadata"""
+    fake = fake_openai()
+    persona = {**main.persona_cache["mktg_strategist"], "semantic_cache": {"threshold": 0.8}, "cache_responses": False}
+    monkeypatch.setattr(main, "persona_cache", MappingProxyType({**main.persona_cache, "mktg_strategist": persona}))
+    monkeypatch.setattr(main, "semantic_cache", SemanticCache(HashingEmbedder(256)))
+    headers = {"Authorization": "Bearer test_token"}
+    first = client.post("/v1/chat", headers=headers,
+                        json=chat_payload(messages=[{"role": "user", "content": "What is a positioning statement?"}]))
+    assert "cache" not in parse_frames(first.text)[-2]["metadata"]
+    calls = len(fake.responses.calls)
+    second = client.post("/v1/chat", headers=headers,
+                         json=chat_payload(messages=[{"role": "user", "content": "what's a positioning statement"}]))
+    frames = parse_frames(second.text)
+    assert "".join(f["content"] for f in frames if "content" in f) == "Hello there"
+    assert frames[-2]["metadata"]["cache"] == "semantic" and frames[-2]["metadata"]["semantic_similarity"] >= 0.8
+    assert len(fake.responses.calls) == calls
+    follow_up = [{"role": "user", "content": "What is a positioning statement?"}, {"role": "assistant", "content": "Hello there"},
+                 {"role": "user", "content": "what's a positioning statement"}]
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=follow_up))
+    assert len(fake.responses.calls) == calls + 1
+
+def test_logs_keeps_total_lines_for_existing_clients(monkeypatch, tmp_path):
+    """Test that /logs returns the tail with returned_lines and the deprecated total_lines key"""
+    log_file = tmp_path / "app.log"
+    log_file.write_text("".join(f"2024-01-01 00:00:00,000 - app - INFO - line {i}\n" for i in range(5)))
+    monkeypatch.setattr(logs, "log_file_path", str(log_file))
+    body = client.get("/logs?lines=2").json()
+    assert body["returned_lines"] == body["total_lines"] == 2
+    assert body["logs"][-1].endswith("line 4")
+
+def test_slow_shared_response_cache_does_not_block_other_requests(fake_openai, monkeypatch):
+    """Test that shared cache round trips run off the event loop and a failing store reads as a miss"""
+    class SlowStore:
+        def __init__(self):
+            self.values = {}
+            self.reads_started = 0
+            self.reading = False
+        def get(self, key):
+            self.reads_started += 1
+            self.reading = True
+            time.sleep(0.3)
+            self.reading = False
+            return self.values.get(key)
+        def set(self, key, value, ttl_seconds=None):
+            time.sleep(0.3)
+            self.values[key] = value
+    class BrokenStore:
+        def get(self, key):
+            raise SharedStoreError("connection refused")
+        def set(self, key, value, ttl_seconds=None):
+            raise SharedStoreError("connection refused")
+    fake_openai()
+    headers = {"Authorization": "Bearer test_token"}
+    payload = chat_payload(messages=[{"role": "user", "content": "Slow cache question"}])
+    store = SlowStore()
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            chat = asyncio.create_task(http.post("/v1/chat", headers=headers, json=payload))
+            while not store.reads_started:
+                await asyncio.sleep(0.005)
+            health = await http.get("/health")
+            # Answered while the chat request was still waiting on its cache lookup
+            return health, store.reading, await chat
+
+    monkeypatch.setattr(main, "response_cache", SharedResponseCache(store, 100, 10 ** 6, 60))
+    health, lookup_in_progress, response = asyncio.run(scenario())
+    assert health.status_code == 200 and lookup_in_progress
+    assert parse_frames(response.text)[-2]["metadata"]["cache"] == "miss"
+    assert main.response_cache.stats()["misses"] == 1 and len(store.values) == 1
+
+    broken = SharedResponseCache(BrokenStore(), 100, 10 ** 6, 60)
+    monkeypatch.setattr(main, "response_cache", broken)
+    response = client.post("/v1/chat", headers=headers, json=payload)
+    assert parse_frames(response.text)[-1] == {"done": True}
+    assert broken.stats()["errors"] == 2 and broken.stats()["misses"] == 1
+
+def test_web_search_responses_do_not_calibrate_token_estimate(fake_openai, monkeypatch):
+    """Test that input tokens inflated by search results leave the estimator alone, while a plain answer calibrates it"""
+    estimator = TokenEstimator()
+    monkeypatch.setattr(main, "token_estimator", estimator)
+    usage = SimpleNamespace(input_tokens=50000, output_tokens=40, input_tokens_details=SimpleNamespace(cached_tokens=0))
+    events = stream_events()
+    events[1:1] = [FakeEvent("response.web_search_call.in_progress", item_id="ws_1"),
+                   FakeEvent("response.web_search_call.completed", item_id="ws_1")]
+    events[-1] = FakeEvent("response.completed", response=FakeResponse("resp_123", usage))
+    fake_openai(events)
+    headers = {"Authorization": "Bearer test_token"}
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=[{"role": "user", "content": "Latest campaign news"}]))
+    assert (estimator.factor, estimator.samples) == (1.0, 0)
+    plain = stream_events()
+    plain[-1] = FakeEvent("response.completed", response=FakeResponse("resp_123", usage))
+    fake_openai(plain)
+    client.post("/v1/chat", headers=headers, json=chat_payload(messages=[{"role": "user", "content": "Define a tagline"}]))
+    assert estimator.samples == 1
+
+def test_cors_exposes_resume_headers():
+    """Test that cross-origin pages can read the headers the resume loop depends on"""
+    response = client.get("/health", headers={"Origin": "https://datera-ai-suite-preview.vercel.app"})
+    exposed = [header.strip().lower() for header in response.headers["access-control-expose-headers"].split(",")]
+    assert "x-request-id" in exposed and "x-stream-resumed" in exposed
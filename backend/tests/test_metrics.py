@@ -0,0 +1,28 @@
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+def test_histogram_renders_cumulative_buckets():
+    """Test Prometheus histogram exposition with labels"""
+    histogram = Histogram("stage_seconds", "Stage latency", ("persona",), buckets=(0.1, 1))
+    histogram.observe(0.05, "p")
+    histogram.observe(0.5, "p")
+    histogram.observe(5, "p")
+    lines = histogram.render()
+    assert 'stage_seconds_bucket{persona="p",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{persona="p",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{persona="p",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{persona="p"} 3' in lines
+    assert histogram.count("p") == 3
+
+def test_registry_renders_help_type_and_values():
+    """Test counters and gauges in the registry output"""
+    registry = Registry()
+    counter = registry.register(Counter("errors_total", "Errors", ("type",)))
+    gauge = registry.register(Gauge("in_flight", "In flight"))
+    counter.inc('Runtime"Error')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    text = registry.render()
+    assert "# TYPE errors_total counter" in text
+    assert 'errors_total{type="Runtime\\"Error"} 1' in text
+    assert "in_flight 1" in text
@@ -0,0 +1,81 @@
+import os
+import json
+import pytest
+from app import personas
+from app.personas import PersonaLoader
+
+@pytest.fixture
+def persona_dir(tmp_path, monkeypatch):
+    """A registry with two personas in a temporary working directory"""
+    (tmp_path / "config").mkdir()
+    (tmp_path / "prompts").mkdir()
+    registry = {"personas": [
+        {"id": "a", "version": "v1", "instructions_path": "prompts/a.md", "enabled": True},
+        {"id": "b", "version": "v1", "instructions_path": "prompts/b.md", "enabled": True}
+    ]}
+    (tmp_path / "config" / "personas.registry.json").write_text(json.dumps(registry))
+    (tmp_path / "prompts" / "a.md").write_text("Persona A")
+    (tmp_path / "prompts" / "b.md").write_text("Persona B")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(personas, "APP_DIR", str(tmp_path / "missing"))
+    return tmp_path
+
+def touch(path, text):
+    path.write_text(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_reload_only_replaces_changed_personas(persona_dir):
+    """Test that unchanged personas keep the same snapshot entry across reloads"""
+    loader = PersonaLoader()
+    first = loader.load()
+    assert not loader.changed()
+    touch(persona_dir / "prompts" / "b.md", "Persona B, revised")
+    assert loader.changed()
+    second = loader.load(first)
+    assert second["a"] is first["a"]
+    assert second["b"]["text"] == "Persona B, revised"
+    assert second["b"]["sha256"] != first["b"]["sha256"]
+    with pytest.raises(TypeError):
+        second["b"]["text"] = "mutated"
+
+def test_failed_persona_keeps_previous_version(persona_dir):
+    """Test that a missing instructions file does not drop an already loaded persona"""
+    loader = PersonaLoader()
+    first = loader.load()
+    os.remove(persona_dir / "prompts" / "a.md")
+    second = loader.load(first)
+    assert second["a"] is first["a"]
+    assert set(second) == {"a", "b"}
+
+def test_touched_file_with_same_content_is_not_a_change(persona_dir):
+    """Test that an mtime-only change re-hashes but keeps the entry"""
+    loader = PersonaLoader()
+    first = loader.load()
+    touch(persona_dir / "prompts" / "a.md", "Persona A")
+    second = loader.load(first)
+    assert second["a"] is first["a"]
+    assert not loader.changed()
+
+def test_instruction_tokens_counted_at_load(persona_dir):
+    """Test that a token counter is applied once per instructions file"""
+    counted = []
+    loader = PersonaLoader(token_counter=lambda text: counted.append(text) or len(text))
+    first = loader.load()
+    assert first["a"]["instructions_tokens"] == len("Persona A")
+    loader.load(first)
+    assert counted.count("Persona A") == 1
+
+def test_bundle_matches_source_load(persona_dir):
+    """Test that a bundle loads the same snapshot as the source files and the first reload keeps it"""
+    bundle_path = str(persona_dir / "config" / "personas.bundle.json")
+    personas.build_bundle(PersonaLoader(token_counter=len), bundle_path)
+    loader = PersonaLoader(token_counter=len)
+    bundled = loader.load_bundle(bundle_path)
+    assert bundled["a"]["text"] == "Persona A"
+    assert bundled["b"]["instructions_tokens"] == len("Persona B")
+    assert loader.changed()
+    reloaded = loader.load(bundled)
+    assert reloaded["a"] is bundled["a"]
+    assert reloaded["b"] is bundled["b"]
+    assert not loader.changed()
@@ -0,0 +1,138 @@
+import asyncio
+from types import SimpleNamespace
+from app.resilience import CircuitBreaker, CircuitBreakers, open_with_fallback
+
+def delta(text):
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+def fake_create(delays, calls, cancelled):
+    """Responses.create stand-in whose first token arrives after a per-model delay"""
+    async def create(model, stream, **params):
+        calls.append(model)
+        async def events():
+            try:
+                await asyncio.sleep(delays[model])
+                yield delta(f"from {model}")
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+        return events()
+    return create
+
+def test_breaker_opens_after_failures_and_slo_violations():
+    """Test that errors and slow first tokens open the breaker and success closes it"""
+    breaker = CircuitBreaker("gpt-5", failure_threshold=2, reset_timeout=60, latency_slo=5)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success(latency=10)
+    assert breaker.state == 'open' and not breaker.allow()
+    breaker.opened_at -= 61
+    assert breaker.allow() and breaker.state == 'half_open'
+    breaker.record_success(latency=1)
+    assert breaker.state == 'closed'
+
+def test_open_circuit_routes_straight_to_fallback():
+    """Test that an open primary breaker skips the primary model"""
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=60, latency_slo=None)
+    breakers.get("gpt-5").record_failure()
+    calls, cancelled = [], []
+    create = fake_create({"gpt-5": 0, "gpt-4o-mini": 0}, calls, cancelled)
+    attempts = [("gpt-5", {"model": "gpt-5"}), ("gpt-4o-mini", {"model": "gpt-4o-mini"})]
+    primed = asyncio.run(open_with_fallback(create, attempts, breakers))
+    assert primed.model == "gpt-4o-mini"
+    assert calls == ["gpt-4o-mini"]
+
+def test_hedged_fallback_wins_and_primary_is_cancelled():
+    """Test that a slow primary is hedged and cancelled once the fallback produces a token"""
+    breakers = CircuitBreakers(failure_threshold=5, reset_timeout=60, latency_slo=None)
+    calls, cancelled = [], []
+    create = fake_create({"gpt-5": 5, "gpt-4o-mini": 0.01}, calls, cancelled)
+    attempts = [("gpt-5", {"model": "gpt-5"}), ("gpt-4o-mini", {"model": "gpt-4o-mini"})]
+
+    async def scenario():
+        primed = await open_with_fallback(create, attempts, breakers, hedge_after=0.05)
+        return primed, [event async for event in primed]
+
+    primed, events = asyncio.run(scenario())
+    assert primed.model == "gpt-4o-mini"
+    assert [event.delta for event in events] == ["from gpt-4o-mini"]
+    assert calls == ["gpt-5", "gpt-4o-mini"]
+    assert cancelled == ["gpt-5"]
+
+def test_cancelled_request_cancels_primary_and_hedge():
+    """Test that cancelling the caller cancels every pending attempt, including a started hedge"""
+    breakers = CircuitBreakers(failure_threshold=5, reset_timeout=60, latency_slo=None)
+    calls, cancelled = [], []
+    create = fake_create({"gpt-5": 5, "gpt-4o-mini": 5}, calls, cancelled)
+    attempts = [("gpt-5", {"model": "gpt-5"}), ("gpt-4o-mini", {"model": "gpt-4o-mini"})]
+
+    async def scenario():
+        task = asyncio.create_task(open_with_fallback(create, attempts, breakers, hedge_after=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+    assert calls == ["gpt-5", "gpt-4o-mini"]
+    assert sorted(cancelled) == ["gpt-4o-mini", "gpt-5"]
+
+def test_buffered_events_keep_their_upstream_arrival_times():
+    """Test that events replayed from the priming buffer report when they arrived, not when they are replayed"""
+    async def create(model, stream, **params):
+        async def events():
+            yield SimpleNamespace(type="response.web_search_call.in_progress", item_id="ws")
+            await asyncio.sleep(0.05)
+            yield SimpleNamespace(type="response.web_search_call.completed", item_id="ws")
+            yield delta("answer")
+        return events()
+    breakers = CircuitBreakers(failure_threshold=5, reset_timeout=60, latency_slo=None)
+
+    async def scenario():
+        primed = await open_with_fallback(create, [("gpt-5", {"model": "gpt-5"})], breakers)
+        arrivals = []
+        async for event in primed:
+            await asyncio.sleep(0)
+            arrivals.append(primed.received_at)
+        return arrivals
+
+    started, completed, _ = asyncio.run(scenario())
+    assert completed - started >= 0.04
+
+def test_reasoning_summary_primes_the_stream_before_output_text():
+    """Test that a reasoning summary delta is handed over as it arrives, not held back until the first text"""
+    async def create(model, stream, **params):
+        async def events():
+            yield SimpleNamespace(type="response.created", response=None)
+            yield SimpleNamespace(type="response.reasoning_summary_text.delta", delta="Thinking")
+            await asyncio.sleep(5)
+            yield delta("answer")
+        return events()
+    breakers = CircuitBreakers(failure_threshold=5, reset_timeout=60, latency_slo=None)
+
+    async def scenario():
+        primed = await asyncio.wait_for(open_with_fallback(create, [("gpt-5", {"model": "gpt-5"})], breakers), 1)
+        events = primed.__aiter__()
+        seen = [(await events.__anext__()).type, (await events.__anext__()).type]
+        await primed.close()
+        return primed, seen
+
+    primed, seen = asyncio.run(scenario())
+    assert primed.first_token_latency is not None and primed.first_token_latency < 1
+    assert seen == ["response.created", "response.reasoning_summary_text.delta"]
+
+def test_unused_fallback_keeps_its_half_open_probe():
+    """Test that a fallback which never starts does not take its breaker's half-open probe slot"""
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=60, latency_slo=None)
+    fallback = breakers.get("gpt-4o-mini")
+    fallback.record_failure()
+    fallback.opened_at -= 61
+    calls, cancelled = [], []
+    create = fake_create({"gpt-5": 0, "gpt-4o-mini": 0}, calls, cancelled)
+    attempts = [("gpt-5", {"model": "gpt-5"}), ("gpt-4o-mini", {"model": "gpt-4o-mini"})]
+    primed = asyncio.run(open_with_fallback(create, attempts, breakers, hedge_after=1))
+    assert primed.model == "gpt-5" and calls == ["gpt-5"]
+    assert fallback.state == 'open' and fallback.allow()
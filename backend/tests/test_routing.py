@@ -0,0 +1,65 @@
+from app.routing import Router, supports_reasoning
+
+PERSONA = {"id": "p", "model": "gpt-5", "routing": {"latency_slo_seconds": 10, "tiers": {"light": {"model": "gpt-5-mini"}}}}
+
+def test_route_picks_tier_from_input_features():
+    """Test that acknowledgements, complex questions, images and long inputs map to their tiers"""
+    router = Router()
+    thanks = router.route(PERSONA, "Thanks!")
+    assert (thanks.tier, thanks.reason, thanks.model, thanks.reasoning_effort) == ("light", "acknowledgement", "gpt-5-mini", "minimal")
+    assert router.route(PERSONA, "Can you compare our positioning with the market leader?").tier == "deep"
+    assert router.route(PERSONA, "What does this show?", images=1).reason == "images"
+    assert router.route(PERSONA, "x" * 900).reason == "long_input"
+    assert router.route(PERSONA, "What font should the headline use?").tier == "standard"
+    assert router.route({"id": "q", "model": "gpt-5"}, "Thanks!") is None
+    assert Router(enabled=False).route(PERSONA, "Thanks!") is None
+
+def test_route_marketing_prompts_by_depth_not_vocabulary():
+    """Test that everyday marketing questions stay standard and only explicit planning or long briefs go deep"""
+    router = Router()
+    for text in ("Why is my email campaign underperforming?",
+                 "Which subject line works better for a spring campaign email?",
+                 "Can you plan three LinkedIn posts about the new feature?",
+                 "What positioning statement fits a premium coffee brand?"):
+        decision = router.route(PERSONA, text)
+        assert (decision.tier, decision.reasoning_effort) == ("standard", "medium"), text
+    assert router.route(PERSONA, "Write a tagline for our spring campaign").reason == "short_input"
+    assert router.route(PERSONA, "We need a launch plan for the Q3 product release.").reason == "complex_question"
+    assert router.route(PERSONA, "What is a good content strategy for a B2B SaaS blog?").tier == "deep"
+    brief = ("Our client sells refurbished laptops to students. Sales peak in August and fall off after October. "
+             "Last year's social ads drove clicks but few purchases, and email open rates are around 18%. ") * 5
+    long_brief = router.route(PERSONA, brief + "What should we change this year?")
+    assert (long_brief.tier, long_brief.reason, long_brief.reasoning_effort) == ("deep", "long_input", "high")
+
+def test_route_overrides_and_latency_slo():
+    """Test forced tiers, explicit effort/verbosity overrides and downgrades when a tier misses the SLO"""
+    router = Router()
+    forced = router.route(PERSONA, "Thanks!", forced_tier="deep", verbosity="high")
+    assert forced.tier == "deep" and forced.reason == "forced"
+    assert forced.verbosity == "high" and forced.overrides == ["verbosity"]
+    assert router.route(PERSONA, "Thanks!", forced_tier="off") is None
+    router.observe("p", "deep", 25.0)
+    slowed = router.route(PERSONA, "Give me a go-to-market plan")
+    assert slowed.tier == "standard" and slowed.downgraded_from == "deep"
+    assert slowed.as_metadata()["downgraded_from"] == "deep"
+    assert router.stats()["downgrades"] == 1
+
+def test_supports_reasoning():
+    assert supports_reasoning("gpt-5") and supports_reasoning("gpt-5-mini") and supports_reasoning("o4-mini")
+    assert not supports_reasoning("gpt-4o-mini")
+
+def test_slow_tier_is_probed_again_and_recovers(monkeypatch):
+    """Test that a tier skipped for its latency gets one probe per interval and is used again once it is fast"""
+    clock = [1000.0]
+    monkeypatch.setattr("app.routing.time.time", lambda: clock[0])
+    router = Router(probe_interval=60)
+    router.observe("p", "deep", 25.0)
+    assert router.route(PERSONA, "Give me a go-to-market plan").tier == "standard"
+    clock[0] += 61
+    probe = router.route(PERSONA, "Give me a go-to-market plan")
+    assert probe.tier == "deep" and probe.as_metadata()["probe"] is True
+    assert router.route(PERSONA, "Give me a go-to-market plan").tier == "standard"  # one probe per interval
+    router.observe("p", "deep", 4.0, probe=True)
+    recovered = router.route(PERSONA, "Give me a go-to-market plan")
+    assert recovered.tier == "deep" and not recovered.probe
+    assert router.stats()["probes"] == 1
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import threading
+import pytest
+from app import semantic
+from app.semantic import HashingEmbedder, SemanticCache, VectorIndex, semantic_scope
+
+PERSONA = {'id': 'bot', 'sha256': 'v1', 'semantic_cache': True}
+
+def embed(text):
+    return asyncio.run(HashingEmbedder(256).embed(text))
+
+def similarity(a, b):
+    return sum(x * y for x, y in zip(embed(a), embed(b)))
+
+def test_local_embedder_is_deterministic_and_ranks_rewordings_closer():
+    """Test that the hashing embedder gives unit vectors and scores a rewording above an unrelated question"""
+    vector = embed("Write a launch brief for our new app")
+    assert vector == embed("Write a launch brief for our new app")
+    assert abs(sum(value * value for value in vector) - 1.0) < 1e-9
+    reworded = similarity("Write a launch brief for our new app", "write the launch brief for our new app, please")
+    unrelated = similarity("Write a launch brief for our new app", "How do I price a consulting retainer?")
+    assert reworded > 0.8 > unrelated
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_vector_index_search_and_remove(backend, monkeypatch):
+    """Test threshold search ordering and swap-removal with both index backends"""
+    if backend == "python":
+        monkeypatch.setattr(semantic, "_numpy", None)
+    index = VectorIndex()
+    index.add("a", [1.0, 0.0])
+    assert (index._matrix is not None) == (backend == "numpy")
+    index.add("b", [0.6, 0.8])
+    index.add("c", [0.0, 1.0])
+    assert [entry_id for entry_id, _ in index.search([1.0, 0.0], 0.5)] == ["a", "b"]
+    index.remove("a")
+    assert len(index) == 2
+    assert [entry_id for entry_id, _ in index.search([0.0, 1.0], 0.5)] == ["c", "b"]
+
+def test_cache_matches_within_scope_and_threshold():
+    """Test that a reworded question hits, while another scope or a distant question misses"""
+    async def run():
+        cache = SemanticCache(HashingEmbedder(256), threshold=0.8, max_entries=10)
+        probe = await cache.lookup(PERSONA, "Write a launch brief for our new app", "scope-a")
+        cache.put(PERSONA, probe, {'frames': [{'content': 'Brief'}]})
+        hit = await cache.lookup(PERSONA, "write the launch brief for our new app, please", "scope-a")
+        other_scope = await cache.lookup(PERSONA, "Write a launch brief for our new app", "scope-b")
+        distant = await cache.lookup(PERSONA, "How do I price a consulting retainer?", "scope-a")
+        return cache, hit, other_scope, distant
+    cache, hit, other_scope, distant = asyncio.run(run())
+    assert hit.value == {'frames': [{'content': 'Brief'}]} and hit.similarity > 0.8
+    assert other_scope.value is None and distant.value is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+def test_cache_evicts_lru_expires_and_invalidates_on_new_instructions():
+    """Test LRU eviction per persona, TTL expiry and dropping a persona's answers when its sha256 changes"""
+    async def run():
+        cache = SemanticCache(HashingEmbedder(256), threshold=0.99, max_entries=2)
+        async def store(persona, text, ttl=None):
+            cache.put(persona, await cache.lookup(persona, text, "s"), {'frames': [{'content': text}]}, ttl)
+        await store(PERSONA, "first question about branding")
+        await store(PERSONA, "second question about pricing")
+        await cache.lookup(PERSONA, "first question about branding", "s")  # refresh the first one
+        await store(PERSONA, "third question about channels")
+        evicted = await cache.lookup(PERSONA, "second question about pricing", "s")
+        kept = await cache.lookup(PERSONA, "first question about branding", "s")
+        await store(PERSONA, "short lived answer", ttl=0.01)
+        time.sleep(0.02)
+        expired = await cache.lookup(PERSONA, "short lived answer", "s")
+        changed = await cache.lookup({**PERSONA, 'sha256': 'v2'}, "first question about branding", "s")
+        return cache, evicted, kept, expired, changed
+    cache, evicted, kept, expired, changed = asyncio.run(run())
+    assert evicted.value is None and kept.value is not None
+    assert expired.value is None
+    assert changed.value is None
+    assert cache.stats()['evictions'] >= 1 and cache.stats()['invalidations'] == 1
+
+def test_failed_embedding_skips_the_lookup():
+    """Test that an embedder error is counted and reported as no probe rather than raised"""
+    class BrokenEmbedder:
+        async def embed(self, text):
+            raise RuntimeError("embeddings unavailable")
+    cache = SemanticCache(BrokenEmbedder())
+    assert asyncio.run(cache.lookup(PERSONA, "anything", "s")) is None
+    assert cache.stats()['errors'] == 1
+
+def test_scope_covers_settings_that_change_the_answer():
+    """Test that model, effort and tool choice are part of the scope"""
+    params = {'model': 'gpt-5', 'reasoning': {'effort': 'low'}, 'text': {'verbosity': 'low'}, 'input': 'ignored'}
+    assert semantic_scope(params) == semantic_scope({**params, 'input': 'different question'})
+    assert semantic_scope(params) != semantic_scope({**params, 'reasoning': {'effort': 'high'}})
+    assert semantic_scope(params) != semantic_scope({**params, 'tool_choice': 'none'})
+
+def test_lookup_searches_off_the_event_loop(monkeypatch):
+    """Test that the index scan runs in a worker thread rather than on the loop's thread"""
+    threads = []
+    search = VectorIndex.search
+    def recording_search(self, vector, threshold):
+        threads.append(threading.current_thread())
+        return search(self, vector, threshold)
+    monkeypatch.setattr(VectorIndex, "search", recording_search)
+    cache = SemanticCache(HashingEmbedder(256))
+    asyncio.run(cache.lookup(PERSONA, "anything", "s"))
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,78 @@
+import time
+import pytest
+from app.cache import SharedResponseCache
+from app.conversations import SharedConversationStore
+from app.jobs import Job, JobStore
+from app.shared import LocalSharedStore, SharedStoreClient, SharedStoreError
+
+@pytest.fixture
+def store_client(tmp_path):
+    store = LocalSharedStore(str(tmp_path / "s.sock"), max_keys=3).start()
+    yield SharedStoreClient(f"unix://{store.path}")
+    store.stop()
+
+def test_local_store_speaks_the_redis_subset(store_client):
+    """Test GET/SET with expiry, INCR, DEL, SCAN and LRU eviction in the local stand-in"""
+    store_client.set("a", "1")
+    store_client.set("short", "x", ttl_seconds=0.05)
+    assert store_client.get("a") == b"1"
+    assert store_client.incr("a") == 2
+    time.sleep(0.1)
+    assert store_client.get("short") is None
+    assert sorted(store_client.scan_iter("*")) == ["a"]
+    store_client.set("b", "2")
+    store_client.set("c", "3")
+    store_client.get("a")
+    store_client.set("d", "4")
+    assert store_client.get("b") is None
+    assert store_client.delete("a", "missing") == 1
+    with pytest.raises(SharedStoreError):
+        store_client.execute("HSET", "h", "f", "v")
+
+def test_client_reconnects_in_forked_process(store_client):
+    """Test that a client opened before fork does not reuse the parent's connection"""
+    store_client.set("k", "v")
+    parent_socket = store_client._socket
+    store_client._pid = -1  # as seen from a forked child
+    assert store_client.get("k") == b"v"
+    assert store_client._socket is not parent_socket
+
+def test_shared_conversation_store_and_response_cache(store_client):
+    """Test that the shared-store backed conversation store and response cache round-trip records"""
+    store_client.execute("FLUSHDB")
+    conversations = SharedConversationStore(store_client, ttl_seconds=60, max_entries=10)
+    conversations.put({"response_id": "r1", "conversation_id": "c1", "image_urls": ["u"]})
+    assert conversations.get("r1")["image_urls"] == ["u"]
+    assert conversations.get("missing") is None
+
+    cache = SharedResponseCache(store_client, max_entries=10, max_bytes=1000, ttl_seconds=60)
+    cache.put("key", {"frames": [{"content": "Hi"}]})
+    assert cache.get("key") == {"frames": [{"content": "Hi"}]}
+    cache.clear()
+    assert cache.get("key") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_job_status_is_visible_from_another_worker(store_client):
+    """Test that a job published by one worker's store can be polled through another's"""
+    store_client.execute("FLUSHDB")
+    running_here = JobStore(ttl_seconds=60, max_jobs=10, shared_client=store_client)
+    elsewhere = JobStore(ttl_seconds=60, max_jobs=10, shared_client=store_client)
+    job = Job("job-1", "bot", None)
+    running_here.add(job)
+    job.status, job.result = 'completed', {'status': 'ok', 'content': 'Hi'}
+    running_here.publish(job)
+    assert elsewhere.get("job-1") is None
+    assert elsewhere.status("job-1")["result"]["content"] == "Hi"
+    assert elsewhere.status("missing") is None
+
+def test_unreachable_store_degrades_conversations_and_jobs(tmp_path):
+    """Test that store errors read as unknown chains and skipped writes instead of failing requests"""
+    broken = SharedStoreClient(f"unix://{tmp_path / 'missing.sock'}", timeout=0.1)
+    conversations = SharedConversationStore(broken, ttl_seconds=60, max_entries=10)
+    conversations.put({"response_id": "r1", "conversation_id": "c1"})
+    assert conversations.get("r1") is None
+    assert conversations.errors == 2
+    jobs = JobStore(ttl_seconds=60, max_jobs=10, shared_client=broken)
+    jobs.publish(Job("job-1", "bot", None))
+    with pytest.raises(SharedStoreError):
+        jobs.status("job-1")
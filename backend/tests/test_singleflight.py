@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from app.singleflight import SingleFlight
+
+def test_followers_share_one_upstream_call():
+    """Test that a late subscriber gets the frames already produced plus the live tail"""
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+        gate = asyncio.Event()
+
+        async def producer():
+            calls.append(1)
+            yield {'content': 'a'}
+            await gate.wait()
+            yield {'content': 'b'}
+
+        async def collect(flight):
+            return [frame async for frame in flight.subscribe()]
+
+        flight, leader = flights.join("key", producer, lambda: {'response_id': 'r1'})
+        leader_frames = asyncio.create_task(collect(flight))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        same_flight, second_leader = flights.join("key", producer, lambda: {'response_id': 'r2'})
+        follower_frames = asyncio.create_task(collect(same_flight))
+        gate.set()
+        results = await asyncio.gather(leader_frames, follower_frames)
+        return calls, leader, second_leader, same_flight is flight, results, flight.result, flights.stats()
+
+    calls, leader, second_leader, shared, results, result, stats = asyncio.run(scenario())
+    assert calls == [1]
+    assert leader and not second_leader and shared
+    assert results[0] == results[1] == [{'content': 'a'}, {'content': 'b'}]
+    assert result == {'response_id': 'r1'}
+    assert stats == {'in_flight': 0, 'leaders': 1, 'followers': 1}
+
+def test_errors_reach_every_subscriber():
+    """Test that an upstream failure is raised to all subscribers and the key is released"""
+    async def scenario():
+        flights = SingleFlight()
+
+        async def producer():
+            yield {'content': 'partial'}
+            raise RuntimeError("upstream failed")
+
+        flight, _ = flights.join("key", producer, dict)
+        with pytest.raises(RuntimeError):
+            async for _ in flight.subscribe():
+                pass
+        return flights.stats()['in_flight']
+
+    assert asyncio.run(scenario()) == 0
+
+def test_last_subscriber_leaving_cancels_the_call():
+    """Test that the shared upstream call is cancelled once nobody reads it"""
+    async def scenario():
+        flights = SingleFlight()
+        cancelled = []
+
+        async def producer():
+            yield {'content': 'a'}
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            yield {'content': 'b'}
+
+        flight, _ = flights.join("key", producer, lambda: {})
+        frames = flight.subscribe()
+        assert await frames.__anext__() == {'content': 'a'}
+        await frames.aclose()
+        await asyncio.sleep(0.01)
+        return cancelled, flight.done, flights.in_flight("key")
+
+    cancelled, done, in_flight = asyncio.run(scenario())
+    assert cancelled == [True]
+    assert done and not in_flight
+
+def test_followed_flight_stays_readable_after_it_finishes():
+    """Test that a caller holding a followed flight gets every frame even when it subscribes after the end"""
+    async def run():
+        flights = SingleFlight()
+        async def producer():
+            yield {'content': 'a'}
+        flight, leader = flights.join("key", producer, lambda: {})
+        followed = flights.follow("key")
+        await flight.task
+        return leader, followed is flight, flights.follow("key"), [frame async for frame in followed.subscribe()]
+    leader, same, after_end, frames = asyncio.run(run())
+    assert leader and same and after_end is None
+    assert frames == [{'content': 'a'}]
@@ -0,0 +1,83 @@
+import time
+import asyncio
+from app.streams import ReplayBuffer
+
+async def frames_of(chunks):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+def test_resume_replays_after_last_event_id_and_follows_live_frames():
+    """Test that a resumed reader gets only frames after its last event id, including ones still being produced"""
+    async def run():
+        buffer = ReplayBuffer(ttl_seconds=60, max_streams=10)
+        stream = buffer.open("req-1", "body").start(frames_of([f"data: {n}\n\n" for n in range(1, 5)]))
+        first = []
+        async for frame in stream.events_after():
+            first.append(frame)
+            if len(first) == 2:
+                break
+        resumed = buffer.resume("req-1", "body")
+        rest = [frame async for frame in resumed.events_after(2)]
+        return first, rest, buffer
+    first, rest, buffer = asyncio.run(run())
+    assert first == ["id: 1\ndata: 1\n\n", "id: 2\ndata: 2\n\n"]
+    assert rest == ["id: 3\ndata: 3\n\n", "id: 4\ndata: 4\n\n"]
+    assert buffer.stats()["resumed"] == 1
+
+def test_resume_requires_same_body_and_unexpired_stream():
+    """Test that a different request body or an expired stream is not resumed"""
+    async def run():
+        buffer = ReplayBuffer(ttl_seconds=60, max_streams=1)
+        stream = buffer.open("req-1", "body").start(frames_of(["data: 1\n\n"]))
+        await stream.task
+        assert buffer.resume("req-1", "other body") is None
+        stream.finished_at = time.time() - 120
+        assert buffer.resume("req-1", "body") is None
+        buffer.open("req-2", "body")
+        buffer.open("req-3", "body")
+        return buffer
+    buffer = asyncio.run(run())
+    assert buffer.stats()["streams"] == 1
+    assert buffer.stats()["missed"] == 2
+
+def test_abandoned_generation_is_cancelled_unless_a_reader_returns():
+    """Test that a generation without readers is cancelled after the grace period, and a reattach keeps it alive"""
+    async def slow_frames(cancelled):
+        try:
+            for n in range(1, 100):
+                await asyncio.sleep(0.01)
+                yield f"data: {n}\n\n"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def read_one(stream, last_event_id=0):
+        reader = stream.events_after(last_event_id)
+        frame = await reader.__anext__()
+        await reader.aclose()
+        return frame
+
+    async def run():
+        buffer = ReplayBuffer(ttl_seconds=60, max_streams=10)
+        kept, dropped = [], []
+        survivor = buffer.open("kept", "body", cancel_grace=0.1).start(slow_frames(kept))
+        await read_one(survivor)
+        await asyncio.sleep(0.05)
+        await read_one(survivor, 1)
+        await asyncio.sleep(0.05)
+        reader = survivor.events_after(2)
+        await reader.__anext__()
+        abandoned = buffer.open("dropped", "body", cancel_grace=0).start(slow_frames(dropped))
+        await read_one(abandoned)
+        await asyncio.sleep(0.05)
+        survived = not kept and not survivor.cancelled
+        await reader.aclose()
+        survivor.task.cancel()
+        return survived, dropped, abandoned, buffer
+
+    survived, dropped, abandoned, buffer = asyncio.run(run())
+    assert survived
+    assert dropped == [True]
+    assert abandoned.cancelled and abandoned.done
+    assert buffer.resume("dropped", "body") is None
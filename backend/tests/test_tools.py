@@ -0,0 +1,26 @@
+from app.tools import SearchClassifier, has_web_search, persona_tools
+
+def test_persona_tools_follow_whitelist_and_are_reused():
+    """Test that tools are built from the whitelist once, skipping unknown names"""
+    persona = {"id": "p", "tool_whitelist": ["web_search", "teleport", {"type": "file_search", "vector_store_ids": ["vs_1"]}]}
+    tools = persona_tools(persona)
+    assert tools == [{"type": "web_search"}, {"type": "file_search", "vector_store_ids": ["vs_1"]}]
+    assert persona_tools(dict(persona)) is tools
+    assert persona_tools({"id": "q", "tool_whitelist": []}) == []
+    assert has_web_search(tools) and not has_web_search(tools[1:])
+
+def test_classifier_skips_questions_without_search_cues():
+    """Test that only messages with recency, URL, explicit or factual cues keep web search"""
+    classifier = SearchClassifier(enabled=True, estimated_seconds=4.0)
+    assert classifier.needs_search("What are the latest trends in B2B marketing?") == (True, "recency")
+    assert classifier.needs_search("Summarize https://example.com/launch for me") == (True, "url")
+    assert classifier.needs_search("Find me sources on brand trust") == (True, "explicit")
+    assert classifier.needs_search("Hverjar eru nýjustu fréttir af markaðnum?")[0]
+    assert classifier.needs_search("Rewrite this tagline to sound warmer: Built for teams") == (False, None)
+    assert classifier.record_skip() == 4.0
+    classifier.observe_search(9.0)
+    stats = classifier.stats()
+    assert stats["decisions"] == {"search": 4, "skip": 1}
+    assert stats["latency_saved_seconds"] == 4.0
+    assert stats["avg_search_seconds"] == 5.0
+    assert classifier.applies({}) and not classifier.applies({"web_search_classifier": False})